@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+
+''' Import-time and startup benchmarks, for catching import regressions.
+
+Each measurement runs in a fresh interpreter, so module caching from earlier
+    measurements doesn't affect the results.
+
+Exits with a non-zero status if a heavy dependency is loaded by a code path
+    that shouldn't need it, or a time exceeds its limit.
+'''
+
+import os
+import sys
+import json
+import tempfile
+import subprocess
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+# modules that are only loaded once a module has actually been used (lazily
+#   imported modules are placeholders in sys.modules until then)
+HEAVY = {
+    'numpy'    : 'numpy.linalg',
+    'pandas'   : 'pandas.core.frame',
+    'requests' : 'requests',
+    'pystore'  : 'pystore',
+    'dask'     : 'dask',
+}
+
+# name: (setup code, timed code, heavy modules allowed, time limit (s))
+BENCHMARKS = {
+    'import general_finance': (
+        '', 'import general_finance', (), 0.1),
+    'import groups': (
+        '', 'import groups', ('numpy', 'pandas'), 1.0),
+    'read-only balance': (
+        'from storage import open_store\n'
+        'from general_finance import Account\n',
+        'store = open_store("bench", STORE_PATH, read_only=True)\n'
+        'print(Account(store, "savings", save=False).get_balance())',
+        ('numpy', 'pandas'), 1.5),
+}
+
+RUNNER = '''
+import sys, json, time
+sys.path.insert(0, {root!r})
+STORE_PATH = {path!r}
+{setup}
+start = time.perf_counter()
+{code}
+duration = time.perf_counter() - start
+print(json.dumps(dict(duration=duration, modules=list(sys.modules))))
+'''
+
+def create_store(path, rows=10000):
+    ''' Create a benchmark store at 'path', with one savings account. '''
+    import numpy as np
+    import pandas as pd
+    from storage import open_store
+    credit = np.round(np.random.normal(0, 50, rows), 2)
+    data = pd.DataFrame({'credit': credit,
+                         'balance': 1000 + credit.cumsum(),
+                         'description': 'benchmark'},
+                        index=pd.date_range('2000-01-01', periods=rows,
+                                            freq='D', name='date'))
+    store = open_store('bench', path)
+    store.collection('savings').write('transactions', data,
+                                      metadata={'number': 0})
+
+def measure(setup, code, path, repeats=5):
+    ''' Returns the best duration of running 'code' after 'setup' in a new
+        interpreter, and the modules loaded by it.
+
+    measure(str, str, str, *int) -> float, set[str]
+
+    '''
+    durations = []
+    for _ in range(repeats):
+        output = subprocess.run([sys.executable, '-c', RUNNER.format(
+            root=ROOT, path=path, setup=setup, code=code)],
+            capture_output=True, text=True, check=True).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        durations.append(result['duration'])
+    return min(durations), set(result['modules'])
+
+def run_benchmarks(repeats=5):
+    ''' Run all benchmarks, printing results. Returns True if all passed. '''
+    sys.path.insert(0, ROOT)
+    passed = True
+    with tempfile.TemporaryDirectory() as path:
+        create_store(path)
+        for name, (setup, code, allowed, limit) in BENCHMARKS.items():
+            duration, modules = measure(setup, code, path, repeats)
+            loaded = [module for module, marker in HEAVY.items()
+                      if marker in modules and module not in allowed]
+            ok = duration <= limit and not loaded
+            passed &= ok
+            print('{:<24} {:>8.3f}s (limit {}s){}{}'.format(
+                name, duration, limit,
+                ' loads ' + ', '.join(loaded) if loaded else '',
+                '' if ok else ' FAILED'))
+    return passed
+
+
+if __name__ == '__main__':
+    sys.exit(0 if run_benchmarks() else 1)
@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+
+''' Rule-based categorisation of transactions. '''
+
+import re
+import numpy as np
+import pandas as pd
+
+class Categoriser(object):
+    ''' Labels transactions with categories, from an ordered set of rules.
+
+    Each rule is a dict with a 'category', and any of the conditions:
+        'contains'   - a substring (or list of alternative substrings) of the
+                       description
+        'regex'      - a regular expression searched for in the description
+                       (inline global flags, e.g. '(?i)', apply to it only)
+        'min_amount' - the minimum (signed) credit amount, inclusive
+        'max_amount' - the maximum (signed) credit amount, inclusive
+
+    A transaction is labelled with the category of the first rule whose
+        conditions all match it. A rule with no conditions matches everything.
+
+    '''
+    # rule accessor strings
+    CATEGORY   = 'category'
+    CONTAINS   = 'contains'
+    REGEX      = 'regex'
+    MIN_AMOUNT = 'min_amount'
+    MAX_AMOUNT = 'max_amount'
+
+    def __init__(self, rules, default='', case_sensitive=False):
+        ''' Compile 'rules' for matching.
+
+        'default' is the label for transactions matching no rules.
+        'case_sensitive' determines if text conditions are case sensitive.
+
+        Constructor: Categoriser(list[dict], *str, *bool)
+
+        '''
+        self.rules = [dict(rule) for rule in rules]
+        self.default = default
+        self.case_sensitive = case_sensitive
+        self._flags = re.DOTALL | (0 if case_sensitive else re.IGNORECASE)
+        # each regex is compiled on its own, so inline flags and group names
+        #   don't clash between rules
+        self._regexes = [self._compile(index, rule) for index, rule in
+                         enumerate(self.rules)]
+        self._contains = [self._literals(rule) for rule in self.rules]
+        # the first rule without text conditions from each rule onwards
+        self._next_always = np.full(len(self.rules) + 1, len(self.rules))
+        for index in reversed(range(len(self.rules))):
+            self._next_always[index] = index if self._contains[index] is \
+                None and self._regexes[index] is None else \
+                self._next_always[index + 1]
+        self._categories = np.array([rule[self.CATEGORY] for rule in
+                                     self.rules] + [default], dtype=object)
+        self._min = np.array([rule.get(self.MIN_AMOUNT, -np.inf) for rule in
+                              self.rules] + [-np.inf], dtype=float)
+        self._max = np.array([rule.get(self.MAX_AMOUNT, np.inf) for rule in
+                              self.rules] + [np.inf], dtype=float)
+        self._amount_rules = np.isfinite(self._min) | np.isfinite(self._max)
+        self._cache = dict() # description -> rules with matching text
+
+    SEPARATOR = '\0' # between descriptions, when searched together
+
+    def _compile(self, index, rule):
+        ''' Returns the compiled regex of rule 'index' (None if it has none).
+
+        Raises an Exception if the regex is invalid.
+
+        '''
+        regex = rule.get(self.REGEX, None)
+        if not regex:
+            return None
+        try:
+            return re.compile(regex, self._flags)
+        except re.error as e:
+            raise Exception('Invalid regex {!r} in rule {} ({}): {}'.format(
+                regex, index, rule[self.CATEGORY], e)) from e
+
+    def _literals(self, rule):
+        ''' Returns the list of substrings of a rule, as searched for (None
+            if it has no substring condition).
+
+        '''
+        contains = rule.get(self.CONTAINS, None)
+        if not contains:
+            return None
+        if isinstance(contains, str):
+            contains = [contains]
+        return [text if self.case_sensitive else text.lower() for text in
+                contains]
+
+    def _find(self, texts):
+        ''' Returns the indices of the 'texts' containing each substring of
+            the rules.
+
+        The texts are joined into a single string, so each substring is found
+            with one scan over all of them, rather than one search per text.
+
+        '''
+        literals = {text for contains in self._contains if contains for text
+                    in contains}
+        joined = self.SEPARATOR.join(texts)
+        starts = np.cumsum([0] + [len(text) + 1 for text in texts])[:-1]
+        found = dict()
+        for literal in literals:
+            if self.SEPARATOR in literal: # could span texts
+                found[literal] = np.flatnonzero([literal in text for text in
+                                                 texts])
+                continue
+            positions = np.fromiter((match.start() for match in
+                                     re.finditer(re.escape(literal), joined)),
+                                    dtype=np.int64)
+            found[literal] = np.unique(np.searchsorted(starts, positions,
+                                                       'right') - 1)
+        return found
+
+    def _match_text(self, descriptions):
+        ''' Returns the indices of the rules whose text conditions match each
+            of the unique 'descriptions', in order.
+
+        Results are cached per description, so each is only matched once.
+
+        '''
+        new = [text for text in descriptions if text not in self._cache]
+        if new:
+            texts = np.array(new, dtype=object)
+            found = self._find(new if self.case_sensitive else
+                               [text.lower() for text in new])
+            matched, rules = [np.empty(0, int)], [np.empty(0, int)]
+            for index, (contains, regex) in enumerate(zip(self._contains,
+                                                          self._regexes)):
+                if contains is None and regex is None:
+                    continue
+                ids = None
+                if contains is not None:
+                    ids = np.unique(np.concatenate([found[text] for text in
+                                                    contains]))
+                if regex is not None:
+                    # only search the texts that remain
+                    if ids is None:
+                        ids = np.arange(len(texts))
+                    ids = ids[np.array([regex.search(text) is not None for
+                                        text in texts[ids]], dtype=bool)]
+                matched.append(ids)
+                rules.append(np.full(len(ids), index))
+            matched, rules = np.concatenate(matched), np.concatenate(rules)
+            order = np.lexsort((rules, matched))
+            rules = rules[order]
+            bounds = np.searchsorted(matched[order], np.arange(len(new) + 1))
+            for position, text in enumerate(new):
+                self._cache[text] = rules[bounds[position]:
+                                          bounds[position + 1]]
+        return [self._cache[text] for text in descriptions]
+
+    def _first_rule(self, keys, codes, starts):
+        ''' Returns the index of the first rule from each of 'starts' that
+            matches the description of each of 'codes' (or len(self.rules) if
+            none do).
+
+        'keys' are the sorted (code * (len(rules) + 1) + rule) of the rules
+            with matching text conditions for each code, ending in a sentinel.
+
+        '''
+        stride = len(self.rules) + 1
+        key = keys[np.searchsorted(keys, codes * stride + starts)]
+        rule = np.where(key // stride == codes, key % stride, stride - 1)
+        return np.minimum(rule, self._next_always[starts])
+
+    def label(self, descriptions, amounts=None):
+        ''' Returns the category of each transaction.
+
+        'descriptions' are the transaction descriptions.
+        'amounts' are the matching (signed) credit amounts. If left as None,
+            rules with amount conditions never match.
+
+        self.label(pd.Series, *pd.Series) -> pd.Series
+
+        '''
+        descriptions = pd.Series(descriptions)
+        codes, uniques = pd.factorize(descriptions.fillna('').astype(str))
+        codes = codes.astype(np.int64)
+        matched = self._match_text(list(uniques))
+        keys = np.append(
+            np.repeat(np.arange(len(uniques), dtype=np.int64),
+                      [len(rules) for rules in matched]) *
+            (len(self.rules) + 1) +
+            np.concatenate(matched + [np.empty(0, int)]).astype(np.int64),
+            np.iinfo(np.int64).max)
+        rule = self._first_rule(keys, codes, np.zeros(len(codes), int))
+
+        if self._amount_rules.any():
+            amounts = (np.full(len(codes), np.nan) if amounts is None else
+                       np.asarray(amounts, dtype=float))
+            while True:
+                # rows whose text-matched rule fails its amount conditions
+                #   continue matching from the following rule
+                failed = self._amount_rules[rule] & \
+                         ~((self._min[rule] <= amounts) &
+                           (amounts <= self._max[rule]))
+                if not failed.any():
+                    break
+                rule[failed] = self._first_rule(keys, codes[failed],
+                                                rule[failed] + 1)
+
+        return pd.Series(self._categories[rule], index=descriptions.index,
+                         name=self.CATEGORY)
+
+    def __repr__(self):
+        ''' A formal representation of this Categoriser. '''
+        return 'Categoriser(rules={!r}, default={!r})'.format(self.rules,
+                                                              self.default)
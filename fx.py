@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+
+''' Foreign exchange rates, cached in a store, and vectorised conversion. '''
+
+import numpy as np
+import pandas as pd
+from storage import list_items, write_item
+
+# currency of stocks by exchange prefix (e.g. 'ASX:AEF'), for AlphaVantage
+EXCHANGE_CURRENCIES = {
+    'ASX'  : 'AUD',
+    'TSX'  : 'CAD',
+    'TSXV' : 'CAD',
+    'LON'  : 'GBP',
+    'ETR'  : 'EUR',
+    'EPA'  : 'EUR',
+    'AMS'  : 'EUR',
+    'NZE'  : 'NZD',
+    'HKG'  : 'HKD',
+    'TYO'  : 'JPY',
+}
+DEFAULT_STOCK_CURRENCY = 'USD' # symbols without an exchange prefix
+
+def symbol_currency(symbol):
+    ''' Returns the trading currency of stock 'symbol', from its exchange. '''
+    if ':' in symbol:
+        exchange = symbol.split(':')[0].upper()
+        return EXCHANGE_CURRENCIES.get(exchange, DEFAULT_STOCK_CURRENCY)
+    return DEFAULT_STOCK_CURRENCY
+
+
+class FXRates(object):
+    ''' Daily exchange rates, cached in the internal '_fx' collection of a
+        store, and updated incrementally from AlphaVantage.
+
+    The rate of a pair 'FROM_TO' is the number of TO units per FROM unit.
+
+    '''
+    COLLECTION = '_fx'
+    RATE       = 'rate'
+
+    def __init__(self, store, apikey=None):
+        ''' Use the cached rates of 'store'.
+
+        'apikey' is the AlphaVantage api-key for retrieving rates. If
+            provided, cached rates are updated with the latest data when they
+            are used, else only the cached rates are available.
+
+        Constructor: FXRates(pystore.store, *str)
+
+        '''
+        self._store = store
+        self._apikey = apikey
+        self._rates = dict() # loaded rate histories, by pair
+        try:
+            self._collection = store.collection(self.COLLECTION)
+        except IOError:
+            self._collection = None # read-only store without cached rates
+
+    @staticmethod
+    def get_pair(from_, to):
+        ''' Returns the name of the currency pair from_ -> to. '''
+        return '{}_{}'.format(from_, to)
+
+    def _cached(self, pair):
+        ''' Returns the cached rate history of 'pair', or None. '''
+        if self._collection is None or \
+                pair not in list_items(self._collection):
+            return None
+        return self._collection.item(pair).to_pandas()[self.RATE]
+
+    def update(self, from_, to, start='2000-01-01'):
+        ''' Fetch any rates for from_ -> to newer than those cached.
+
+        Rates are fetched from 'start' for pairs not yet cached.
+
+        '''
+        from providers import alpha_vantage # network code only on fetch
+        pair = self.get_pair(from_, to)
+        cached = self._cached(pair)
+        if cached is not None:
+            start = cached.index[-1]
+            if start >= np.datetime64('today') - 1:
+                return # already up to date
+        start = np.datetime64(start)
+        # compact output covers the last 100 data points
+        outputsize = 'compact' if np.datetime64('today') - start < \
+                     np.timedelta64(100, 'D') else 'full'
+        data = alpha_vantage('FX_DAILY', self._apikey, from_symbol=from_,
+                             to_symbol=to, outputsize=outputsize)
+        data = data['4. close'].astype(float).to_frame(name=self.RATE)
+        data = data[data.index > start].sort_index()
+        if len(data) or cached is None:
+            write_item(self._collection, pair, data, append=True)
+        self._rates.pop(pair, None)
+
+    def get_rate_history(self, from_, to):
+        ''' Returns the from_ -> to rate history.
+
+        Uses the cached pair or its inverse, fetching the pair if neither is
+            cached (or updating it, if an api-key was provided).
+
+        self.get_rate_history(str, str) -> pd.Series
+
+        '''
+        pair = self.get_pair(from_, to)
+        if from_ == to:
+            return pd.Series(1.0, index=pd.DatetimeIndex([]), name=pair)
+        if pair in self._rates:
+            return self._rates[pair]
+        inverse = self.get_pair(to, from_)
+        if self._apikey and self._cached(inverse) is None:
+            self.update(from_, to)
+        rates = self._cached(pair)
+        if rates is None:
+            rates = self._cached(inverse)
+            if rates is None:
+                raise IOError('No rates available for {}'.format(pair))
+            rates = 1 / rates
+        self._rates[pair] = rates.sort_index().rename(pair)
+        return self._rates[pair]
+
+    def get_rates(self, currencies, to, index):
+        ''' Returns the rates from each of 'currencies' to 'to', aligned to
+            the dates of 'index'.
+
+        Rates carry forward over dates without a rate (e.g. weekends), and
+            the first available rate is used for dates before it.
+
+        self.get_rates(iter[str], str, pd.DatetimeIndex) -> pd.DataFrame
+
+        '''
+        rates = dict()
+        for currency in set(currencies):
+            history = self.get_rate_history(currency, to)
+            if currency == to or not len(history):
+                rates[currency] = 1.0
+                continue
+            history = history[~history.index.duplicated(keep='last')]
+            rates[currency] = history.reindex(history.index.union(index)) \
+                                     .ffill().bfill().reindex(index).values
+        return pd.DataFrame(rates, index=index)
+
+    def convert(self, data, currencies, to):
+        ''' Returns time-indexed 'data' converted to currency 'to'.
+
+        'currencies' is the currency of all of 'data', or a dict of the
+            currency of each column.
+
+        Conversion is a single element-wise multiplication by a date-aligned
+            rate matrix.
+
+        self.convert(pd.Series/pd.DataFrame, str/dict, str)
+            -> pd.Series/pd.DataFrame
+
+        '''
+        if isinstance(currencies, str):
+            columns = data.columns if isinstance(data, pd.DataFrame) else [0]
+            currencies = {column: currencies for column in columns}
+        if isinstance(data, pd.Series):
+            factors = self.get_rates(currencies.values(), to, data.index)
+            return data * factors[currencies[0]].values
+        columns = [currencies[column] for column in data.columns]
+        factors = self.get_rates(columns, to, data.index)[columns]
+        return data * factors.values
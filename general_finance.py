@@ -7,12 +7,198 @@ Pystore.path
         -> transactions/stocks (items)
 '''
 
-import pystore
-import requests
-import numpy as np
-import pandas as pd
-from time import sleep
-url_query = lambda url, *a, **kw: requests.get('https://www.'+url, *a, **kw)
+import os
+import sys
+import json
+import operator
+import warnings
+import importlib.util
+from io import StringIO
+from contextlib import nullcontext
+from time import time_ns
+from storage import VERSION, FileLock, lock_item, get_version, list_items, \
+                    write_item
+
+def _lazy_import(name):
+    ''' Returns module 'name', which is only loaded on first use.
+
+    Keeps imports of this module fast for short-lived invocations that may
+        not need heavy dependencies.
+
+    '''
+    module = sys.modules.get(name, None)
+    if module is None:
+        spec = importlib.util.find_spec(name)
+        spec.loader = importlib.util.LazyLoader(spec.loader)
+        module = importlib.util.module_from_spec(spec)
+        sys.modules[name] = module
+        spec.loader.exec_module(module)
+    return module
+
+np = _lazy_import('numpy')
+pd = _lazy_import('pandas')
+
+DEFAULT_CURRENCY = 'AUD'
+# pyarrow filter operators, for filtering transactions in memory
+FILTERS = {'==': operator.eq, '=': operator.eq, '!=': operator.ne,
+           '<': operator.lt, '<=': operator.le, '>': operator.gt,
+           '>=': operator.ge,
+           'in': lambda values, value: values.isin(value),
+           'not in': lambda values, value: ~values.isin(value)}
+
+class Journal(object):
+    ''' An append-only log of mutations to the items of a collection.
+
+    Recording a mutation appends one line to a file in the collection, so is
+        cheap regardless of the size of the item it mutates. Entries are
+        replayed on top of the stored items when they are loaded, and folded
+        into them by compaction.
+
+    Each entry has an increasing sequence number. Compacted items store the
+        last sequence number they include, so entries are never applied twice,
+        even if compaction is interrupted.
+
+    '''
+    FILENAME  = '_journal.jsonl'
+    # accessor strings for entries
+    SEQUENCE  = 'seq'
+    ITEM      = 'item'
+    OPERATION = 'op'
+    ARGUMENTS = 'args'
+
+    def __init__(self, collection, threshold=100, recording=True):
+        ''' Open (or create) the journal of 'collection'.
+
+        'threshold' is the number of pending entries for an item at which it
+            should be compacted.
+        'recording' is False to only replay (and compact) the existing
+            entries, with new mutations saved directly to the stored items.
+            Journals of read-only collections are never recording.
+
+        Constructor: Journal(pystore.collection, *int, *bool)
+
+        '''
+        self.threshold = threshold
+        self.read_only = getattr(collection, 'read_only', False)
+        self.recording = recording and not self.read_only
+        self._path = self.path(collection)
+        self._lock = nullcontext() if self.read_only else \
+                     FileLock(self._path)
+        with self._lock:
+            self._entries = self._read()
+        self._sequence = max([entry[self.SEQUENCE] for entry in
+                              self._entries] + [0])
+
+    @classmethod
+    def path(cls, collection):
+        ''' Returns the path of the journal file of 'collection'. '''
+        return os.path.join(str(collection.datastore), collection.collection,
+                            cls.FILENAME)
+
+    @classmethod
+    def exists(cls, collection):
+        ''' Returns True if 'collection' has a journal file (which may have
+            entries to replay).
+
+        '''
+        return getattr(collection, 'datastore', None) is not None and \
+               os.path.exists(cls.path(collection))
+
+    def _read(self):
+        ''' Returns the entries in the journal file (with the lock held). '''
+        if not os.path.exists(self._path):
+            return []
+        with open(self._path, 'rb') as journal:
+            contents = journal.read()
+        # drop any partial entry from an interrupted write
+        complete = contents[:contents.rfind(b'\n') + 1]
+        if len(complete) != len(contents) and not self.read_only:
+            with open(self._path, 'r+b') as journal:
+                journal.truncate(len(complete))
+        return [json.loads(line) for line in complete.decode().splitlines()
+                if line]
+
+    def record(self, item, operation, **arguments):
+        ''' Durably record 'operation' with 'arguments' on 'item'.
+
+        Returns the sequence number of the recorded entry, which is after
+            all entries recorded so far (including by other processes).
+
+        self.record(str, str, **arguments) -> int
+
+        '''
+        with self._lock:
+            recorded = [entry[self.SEQUENCE] for entry in self._read()]
+            self._sequence = max([self._sequence + 1, time_ns()] +
+                                 [sequence + 1 for sequence in recorded])
+            entry = {self.SEQUENCE: self._sequence, self.ITEM: item,
+                     self.OPERATION: operation, self.ARGUMENTS: arguments}
+            with open(self._path, 'a') as journal:
+                journal.write(json.dumps(entry) + '\n')
+                journal.flush()
+                os.fsync(journal.fileno())
+        self._entries.append(entry)
+        return self._sequence
+
+    def refresh(self, item, after=0):
+        ''' Load any entries for 'item' recorded by other processes since the
+            journal was read, and return those with sequence numbers after
+            'after', in order.
+
+        self.refresh(str, *int) -> list[dict]
+
+        '''
+        known = {entry[self.SEQUENCE] for entry in self._entries}
+        with self._lock:
+            new = [entry for entry in self._read() if entry[self.ITEM] == item
+                   and entry[self.SEQUENCE] not in known]
+        self._entries = sorted(self._entries + new,
+                               key=lambda entry: entry[self.SEQUENCE])
+        return [entry for entry in new if entry[self.SEQUENCE] > after]
+
+    def pending(self, item, after=0):
+        ''' Returns the entries for 'item' with sequence numbers after
+            'after', in order.
+
+        self.pending(str, *int) -> list[dict]
+
+        '''
+        return [entry for entry in self._entries if entry[self.ITEM] == item
+                and entry[self.SEQUENCE] > after]
+
+    def last(self, item):
+        ''' Returns the sequence number of the last entry for 'item'. '''
+        return max([entry[self.SEQUENCE] for entry in self.pending(item)] +
+                   [0])
+
+    def needs_compaction(self, item):
+        ''' Returns True if 'item' has at least 'threshold' pending entries. '''
+        return len(self.pending(item)) >= self.threshold
+
+    def clear(self, item, up_to):
+        ''' Remove the entries for 'item' up to sequence number 'up_to',
+            once they have been compacted into the stored item.
+
+        Only entries known to this journal are removed, so entries recorded
+            by other processes in the meantime are kept.
+
+        '''
+        cleared = {entry[self.SEQUENCE] for entry in self.pending(item)
+                   if entry[self.SEQUENCE] <= up_to}
+        self._entries = [entry for entry in self._entries
+                         if entry[self.SEQUENCE] not in cleared]
+        with self._lock:
+            entries = [entry for entry in self._read()
+                       if entry[self.SEQUENCE] not in cleared]
+            # replace the file atomically, so a crash leaves the old or new
+            #   file
+            temp_path = self._path + '.tmp'
+            with open(temp_path, 'w') as journal:
+                journal.writelines(json.dumps(entry) + '\n' for
+                                   entry in entries)
+                journal.flush()
+                os.fsync(journal.fileno())
+            os.replace(temp_path, self._path)
 
 class Account(object):
     ''' An account for tracking one (or more) values over time. '''
@@ -22,12 +208,27 @@ class Account(object):
     CREDIT       = 'credit'
     NUMBER       = 'number'
     BALANCE      = 'balance'
+    CATEGORY     = 'category'
     ACCOUNT_NO   = 'account_no'
     DESCRIPTION  = 'description'
+    CURRENCY     = 'currency'
     TRANSACTIONS = 'transactions'
+    JOURNAL      = '_journal'
+    CREDITS      = 'credits'
+    DEBITS       = 'debits'
+
+    # items starting with INTERNAL are maintained by the account itself
+    INTERNAL     = '_'
+    ROLLUP       = INTERNAL + 'rollup_'
+    # periods to maintain rollups for (pandas offsets - monthly and weekly)
+    ROLLUPS      = ('M', 'W')
+    # inverted index of description tokens, by month
+    INDEX        = INTERNAL + 'description_index'
+    TOKEN        = 'token'
+    PERIOD       = 'period'
 
     def __init__(self, store, name=None, number=None, data=None, save=True,
-                 **metadata):
+                 journal=False, lazy=False, **metadata):
         ''' Initialise an account with the specified parameters.
 
         If the account is already stored in store (by name or number),
@@ -37,10 +238,21 @@ class Account(object):
         currently stored in store, or both name and number if not currently
         tracked.
 
+        If 'journal' is True, appended transactions (and stock purchases and
+        dividends) are recorded in an append-only Journal, and only written
+        into the stored items when compacted. Pending journal entries are
+        always replayed on load, whether or not 'journal' is True.
+
+        If 'lazy' is True, stored transactions are only loaded into memory
+        when first needed, so out-of-core queries (get_transactions) can be
+        made without materialising the full history.
+
         Constructor: Account(pystore.store, *str, *int, *pd.DataFrame, *bool,
-                             **metadata)
+                             *bool, *bool, **metadata)
 
         '''
+        self._valuation = None
+        self.__data = None
         new_account = False
         if name and not number:
             # attempt to extract metadata from known collection 'name'
@@ -53,6 +265,8 @@ class Account(object):
             # attempt to find which store has the specified number
             found = False
             for name in store.list_collections():
+                if self.is_internal(name):
+                    continue
                 self._metadata = (store.collection(name)
                                        .item(self.TRANSACTIONS)
                                        .metadata)
@@ -70,6 +284,7 @@ class Account(object):
             self.number = number
             # ensure number included in metadata
             metadata.update({self.NUMBER: number})
+            self._metadata = dict()
             self._data = data
             new_account = True
         else:
@@ -77,14 +292,172 @@ class Account(object):
                             ' or number.')
 
         # account successfully found, get data/make a collection for it
+        self._store = store
+        self._fx = None
         self._collection = store.collection(self.name)
+        self._journal = None
+        if journal or Journal.exists(self._collection):
+            # pending entries are always replayed, but new mutations are
+            #   only journalled if requested
+            self._journal = Journal(self._collection, recording=journal)
         self._metadata.update(metadata)
         if not new_account:
-            self._data = self._collection.item(self.TRANSACTIONS).to_pandas()
+            # stored state to check against when writing
+            self._metadata.setdefault(VERSION, 0)
+        if not new_account and not lazy:
+            self._data # load now
         if save:
             self.save()
+            if new_account:
+                self._update_derived()
+
+    @property
+    def _data(self):
+        ''' The transactions of this account, loaded on first use. '''
+        if self.__data is None:
+            with lock_item(self._collection, self.TRANSACTIONS, shared=True):
+                item = self._collection.item(self.TRANSACTIONS)
+                self.__data = item.to_pandas()
+                # the state the data was stored in
+                for key in (VERSION, self.JOURNAL):
+                    if key in item.metadata:
+                        self._metadata[key] = item.metadata[key]
+            self._replay()
+        return self.__data
+
+    @_data.setter
+    def _data(self, data):
+        self.__data = data
+
+    def get_transactions(self, lazy=True, columns=None, filters=None):
+        ''' Returns the transactions of this account.
+
+        If 'lazy' is True, returns a dask DataFrame that is read partition by
+            partition from the stored item, and only materialised on compute.
+            Any journalled transactions are compacted into the store first.
+        'columns' and 'filters' are as for pyarrow parquet reads, and are
+            applied while reading.
+
+        Journalled transactions of read-only stores can't be compacted, so
+            they are read from memory instead (with filters applied there).
+
+        self.get_transactions(*bool, *list[str], *list[tuple])
+            -> dask.DataFrame/pd.DataFrame
+
+        '''
+        if lazy:
+            self.compact()
+        if self._pending() and self._journal.read_only:
+            data = self._filter(self._data, filters)
+            if columns is not None:
+                data = data[columns]
+            if lazy:
+                import dask.dataframe as dd
+                return dd.from_pandas(data, npartitions=1)
+            return data
+        item = self._collection.item(self.TRANSACTIONS, filters=filters,
+                                     columns=columns)
+        return item.data if lazy else item.to_pandas()
+
+    def _filter(self, data, filters):
+        ''' Returns the rows of 'data' matching pyarrow-style 'filters' (a
+            list of conditions, or a list of lists to combine with or).
+
+        '''
+        if not filters:
+            return data
+        if not isinstance(filters[0], list):
+            filters = [filters]
+        matched = np.zeros(len(data), dtype=bool)
+        for conditions in filters:
+            conjunction = np.ones(len(data), dtype=bool)
+            for column, op, value in conditions:
+                values = data.index if column == self.DATE else data[column]
+                conjunction &= np.asarray(FILTERS[op](values, value))
+            matched |= conjunction
+        return data[matched]
+
+    @property
+    def _journalling(self):
+        ''' True if new transactions are journalled rather than saved. '''
+        return self._journal is not None and self._journal.recording
+
+    def _pending(self):
+        ''' Returns the journal entries not yet in the stored transactions.
+        '''
+        if self._journal is None:
+            return []
+        return self._journal.pending(self.TRANSACTIONS,
+                                     self._metadata.get(self.JOURNAL, 0))
+
+    def _replay(self, entries=None):
+        ''' Apply journalled transactions not yet in the stored item.
+
+        'entries' defaults to all the pending journal entries.
+
+        '''
+        if entries is None:
+            entries = self._pending()
+        for entry in entries:
+            self._data = pd.concat([self._data,
+                self._from_json(entry[Journal.ARGUMENTS]['data'])])
+
+    def reload(self):
+        ''' Reload the stored transactions and metadata of this account (e.g.
+            after a conflict with another writer).
+
+        '''
+        self._invalidate()
+        with lock_item(self._collection, self.TRANSACTIONS, shared=True):
+            item = self._collection.item(self.TRANSACTIONS)
+            self._metadata = item.metadata
+            self.__data = item.to_pandas()
+        self._metadata.setdefault(VERSION, 0)
+        self._replay()
+
+    def _to_json(self, data):
+        ''' Returns a JSON string of 'data', for journalling. '''
+        return data.to_json(orient='split', date_format='iso',
+                            date_unit='ns')
+
+    def _from_json(self, data):
+        ''' Returns the DataFrame of a journalled JSON string. '''
+        data = pd.read_json(StringIO(data), orient='split', convert_dates=False)
+        data.index = pd.to_datetime(data.index).rename(self._data.index.name)
+        return data
+
+    def compact(self):
+        ''' Fold any journalled transactions into the stored item.
+
+        Journals of read-only stores can't be compacted, so their entries are
+            only replayed in memory.
+
+        '''
+        if not self._pending() or self._journal.read_only:
+            return
+        with lock_item(self._collection, self.TRANSACTIONS):
+            self._sync()
+            self.save() # including derived items
+
+    def _sync(self):
+        ''' Reload the account if another writer has changed it since it was
+            loaded (with its lock held, so it can't change again).
+
+        Returns True if the account was reloaded.
+
+        '''
+        if get_version(self._collection, self.TRANSACTIONS) == \
+                self._metadata.get(VERSION, 0):
+            return False
+        self.reload() # including any journalled changes
+        return True
 
-    def add_data(self, new_data, item=None):
+    @classmethod
+    def is_internal(cls, item):
+        ''' Returns True if 'item' is maintained internally by an account. '''
+        return item.startswith(cls.INTERNAL)
+
+    def add_data(self, new_data, item=None, reconcile=True):
         ''' Add data to the current data-store.
 
         'new_data' must have the same column format as the existing data.
@@ -92,12 +465,59 @@ class Account(object):
         If 'item' is left as None, defaults to the transactions item, else
             updates the specified item in this account.
 
-        self.add_data(pd.DataFrame, *None/str) -> None
+        For transactions without a balance column, balances are derived from
+            the current balance. If 'reconcile' is True, provided balances are
+            checked against the credits, and the transactions where they
+            diverge are returned (as from reconcile), with a warning if there
+            are any. Otherwise returns None.
+
+        Transactions added by other processes since this account was loaded
+            are kept - the account is reloaded, and the new data added after
+            them.
+
+        self.add_data(pd.DataFrame, *None/str, *bool) -> None/pd.DataFrame
 
         '''
-        if not item:
-            item = self.TRANSACTIONS
-        self._collection.append(item, new_data)
+        if not len(new_data):
+            return None # nothing to add (e.g. no new statement rows)
+        if not item or item == self.TRANSACTIONS:
+            if self._journalling:
+                return self._add_transactions(new_data, reconcile)
+            with lock_item(self._collection, self.TRANSACTIONS):
+                self._sync()
+                return self._add_transactions(new_data, reconcile)
+        else:
+            write_item(self._collection, item, new_data, append=True)
+
+    def _add_transactions(self, new_data, reconcile=True):
+        ''' Add transactions, as for add_data. '''
+        opening = self._data[self.BALANCE].iloc[-1] if len(self._data) \
+                  else 0.0
+        divergences = None
+        if self.BALANCE not in new_data:
+            new_data = self.derive_balance(new_data, opening)
+        elif reconcile:
+            divergences = self.reconcile(new_data, opening)
+            if len(divergences):
+                warnings.warn('Balance diverges from credits in {} new '
+                              'transactions of {}:\n{}'.format(
+                                  len(divergences), self.name, divergences))
+        self._data = pd.concat([self._data, new_data])
+        self._invalidate()
+        if self._journalling:
+            self._journal.record(self.TRANSACTIONS, 'add_data',
+                                 data=self._to_json(new_data))
+            if self._journal.needs_compaction(self.TRANSACTIONS):
+                self.compact()
+            return divergences
+        if self._pending():
+            self.save() # append after the replayed journal entries
+        else:
+            self._metadata[VERSION] = write_item(
+                self._collection, self.TRANSACTIONS, new_data,
+                version=self._metadata.get(VERSION), append=True)
+        self._update_derived(new_data.index.min(), new_data.index.max())
+        return divergences
 
     def prepend_data(self, new_data, item=None):
         ''' Add data to the start of the current data-store.
@@ -110,12 +530,17 @@ class Account(object):
         self.prepend_data(pd.DataFrame, *None/str) -> None
 
         '''
-        if not item:
-            item = self.TRANSACTIONS
-        item = self._collection.item(item)
-        metadata = item.metadata
-        all_data = new_data.append(item.to_pandas())
-        self.overwrite_data(all_data, metadata, item)
+        if not len(new_data):
+            return # nothing to add
+        if not item or item == self.TRANSACTIONS:
+            self._data = pd.concat([new_data, self._data])
+            self.save()
+            self._update_derived(new_data.index.min(), new_data.index.max())
+        else:
+            with lock_item(self._collection, item):
+                stored = self._collection.item(item)
+                all_data = pd.concat([new_data, stored.to_pandas()])
+                self.overwrite_data(all_data, stored.metadata, item)
 
     def overwrite_data(self, new_data, metadata=None, item=None):
         ''' Overwrite the data, and optionally metadata of an item.
@@ -144,40 +569,482 @@ class Account(object):
             else:
                 metadata = self._metadata # TODO why is this here?
             self.save()
+            self._update_derived()
         else:
-            if not metadata:
-                self._collection.write(item, new_data, overwrite=True)
-            else:
-                self._collection.write(item, new_data, metadata=metadata,
-                                       overwrite=True)
+            write_item(self._collection, item, new_data, metadata)
+
+    class Valuation(dict):
+        ''' A snapshot of an account's summary values, for a given state. '''
+        def __init__(self, balance, tracked_from):
+            ''' Store the latest 'balance' (pd.Series of the last balance
+                entry), and the date the account is 'tracked_from'.
+
+            '''
+            super().__init__(balance=balance, tracked_from=tracked_from)
+            self.balance      = balance
+            self.tracked_from = tracked_from
+
+    @property
+    def valuation(self):
+        ''' The valuation of this account, cached until its data changes. '''
+        if self._valuation is None:
+            self._valuation = self.Valuation(
+                self._data.tail(1)[self.BALANCE],
+                self._data.head(1).index.date[0])
+        return self._valuation
+
+    def _invalidate(self):
+        ''' Clear cached values derived from the current state. '''
+        self._valuation = None
 
     def get_balance(self, date='latest'):
         ''' '''
-        return self._data.tail(1)[self.BALANCE]
+        return self.valuation.balance
+
+    def get_running_balance(self, data=None, opening=None):
+        ''' Returns the running balance of 'data' transactions, computed from
+            their credits.
+
+        'data' defaults to all the transactions of this account.
+        'opening' is the balance before the first transaction. If left as
+            None, it is inferred from the first stored balance.
+
+        self.get_running_balance(*pd.DataFrame, *float) -> pd.Series
+
+        '''
+        if data is None:
+            data = self._data
+        credit = data[self.CREDIT]
+        if opening is None:
+            opening = data[self.BALANCE].iloc[0] - credit.iloc[0] \
+                      if len(data) else 0.0
+        return (opening + credit.cumsum()).rename(self.BALANCE)
+
+    def derive_balance(self, data, opening=0.0):
+        ''' Returns a copy of 'data' transactions with a balance column
+            computed from their credits, starting from 'opening'.
+
+        self.derive_balance(pd.DataFrame, *float) -> pd.DataFrame
+
+        '''
+        return data.assign(**{self.BALANCE:
+                              self.get_running_balance(data, opening)})
+
+    def reconcile(self, data=None, opening=None, tolerance=0.005):
+        ''' Returns the transactions where the stored balance diverges from
+            the credits.
+
+        'data' and 'opening' are as for get_running_balance. Only the
+            transactions where a divergence starts or changes are returned,
+            with the stored and expected balance, and the difference.
+
+        self.reconcile(*pd.DataFrame, *float, *float) -> pd.DataFrame
+
+        '''
+        if data is None:
+            data = self._data
+        expected = self.get_running_balance(data, opening)
+        difference = data[self.BALANCE] - expected
+        # a single divergence offsets every later balance, so only flag
+        #   changes in the difference
+        step = np.diff(difference.values, prepend=0.0)
+        flagged = np.abs(step) > tolerance
+        return pd.DataFrame({self.BALANCE: data[self.BALANCE][flagged],
+                             'expected': expected[flagged],
+                             'difference': step[flagged]})
+
+    def find_gaps(self, freq='M', data=None):
+        ''' Returns the 'freq' periods with no transactions, between the
+            first and last transactions of 'data'.
+
+        Missing periods usually indicate missing statements.
+
+        self.find_gaps(*str, *pd.DataFrame) -> pd.PeriodIndex
+
+        '''
+        if data is None:
+            data = self._data
+        if not len(data):
+            return pd.PeriodIndex([], freq=freq)
+        present = data.index.to_period(freq).unique()
+        return pd.period_range(present.min(), present.max(), freq=freq) \
+                 .difference(present)
+
+    @property
+    def currency(self):
+        ''' The currency of this account (metadata, else DEFAULT_CURRENCY). '''
+        return self._metadata.get(self.CURRENCY, DEFAULT_CURRENCY)
+
+    @property
+    def fx(self):
+        ''' The exchange rates cached in this account's store. '''
+        if self._fx is None:
+            from fx import FXRates
+            self._fx = FXRates(self._store)
+        return self._fx
+
+    def get_balance_history(self, freq='D', currency=None):
+        ''' Returns the closing balance of this account at each 'freq' period.
+
+        Periods without transactions carry the previous balance forward.
+
+        If 'currency' is specified, balances are converted to it at the rate
+            of each period.
+
+        self.get_balance_history(*str, *str) -> pd.Series
+
+        '''
+        balance = self._data[self.BALANCE].groupby(level=0).last()
+        balance = balance.resample(freq).last().ffill().rename(self.name)
+        if currency:
+            balance = self.fx.convert(balance, self.currency, currency)
+        return balance
+
+    def get_worth_history(self, freq='D', currency=None):
+        ''' Returns the total worth of this account at each 'freq' period,
+            optionally converted to 'currency'.
+
+        '''
+        return self.get_balance_history(freq, currency)
+
+    def _rollup(self, data, freq, by_category=False):
+        ''' Returns period totals of 'data' transactions for 'freq' periods.
+
+        Credits and debits are positive totals for each period, with the
+            closing balance, or per category totals if 'by_category'.
+
+        '''
+        period = data.index.to_period(freq).to_timestamp()
+        credit = data[self.CREDIT]
+        totals = pd.DataFrame({self.CREDITS: credit.clip(lower=0),
+                               self.DEBITS: -credit.clip(upper=0)},
+                              index=data.index)
+        if by_category:
+            groups = [period.rename(self.DATE), data[self.CATEGORY]]
+            return totals.groupby(groups).sum().reset_index(self.CATEGORY)
+        totals[self.BALANCE] = data[self.BALANCE]
+        return totals.groupby(period.rename(self.DATE)).agg(
+            {self.CREDITS: 'sum', self.DEBITS: 'sum', self.BALANCE: 'last'})
+
+    def _update_derived(self, start=None, end=None):
+        ''' Update the stored items derived from transactions between start
+            and end (all transactions if left as None).
+
+        '''
+        self.update_rollups(start, end)
+        self.update_index(start, end)
+
+    def update_rollups(self, start=None, end=None):
+        ''' Update the stored rollups for transactions between start and end.
+
+        Only periods overlapping [start, end] are recomputed and replaced. If
+            'start' and 'end' are left as None, rebuilds all rollups.
+
+        self.update_rollups(*datetime, *datetime) -> None
+
+        '''
+        items = list_items(self._collection)
+        for freq in self.ROLLUPS:
+            for by_category in (False, True):
+                if by_category and self.CATEGORY not in self._data:
+                    continue
+                name = self.get_rollup_name(freq, by_category)
+                with lock_item(self._collection, name):
+                    self._update_rollup(name, freq, by_category, start, end,
+                                        name in items)
+
+    def _update_rollup(self, name, freq, by_category, start, end, stored):
+        ''' Update rollup 'name', as for update_rollups (with its lock held).
+
+        'stored' is True if the rollup item exists.
+
+        '''
+        if start is None or not stored:
+            # full rebuild
+            data, stored = self._data, None
+        else:
+            first = pd.Timestamp(start).to_period(freq).start_time
+            last  = pd.Timestamp(end).to_period(freq).end_time
+            index = self._data.index
+            data  = self._data[(index >= first) & (index <= last)]
+            stored = self._collection.item(name).to_pandas()
+            stored = stored[(stored.index < first) | (stored.index > last)]
+        rollup = self._rollup(data, freq, by_category)
+        if stored is not None:
+            rollup = pd.concat([stored, rollup]).sort_index(kind='stable')
+        write_item(self._collection, name, rollup)
+
+    def get_rollup_name(self, freq='M', by_category=False):
+        ''' Returns the item name of the 'freq' rollup. '''
+        return self.ROLLUP + freq + ('_' + self.CATEGORY if by_category
+                                     else '')
+
+    def get_rollup(self, freq='M', by_category=False):
+        ''' Returns the period totals of this account for 'freq' periods.
+
+        Totals are maintained as the account changes, so reading them does
+            not require the full transaction history.
+
+        self.get_rollup(*str, *bool) -> pd.DataFrame
+
+        '''
+        self.compact() # include any journalled transactions
+        name = self.get_rollup_name(freq, by_category)
+        if self._pending(): # read-only store, stored rollup is behind
+            return self._rollup(self._data, freq, by_category)
+        if name not in list_items(self._collection):
+            if freq in self.ROLLUPS:
+                try:
+                    self.update_rollups()
+                except IOError:
+                    pass # read-only store, rollups can't be stored
+            return self._rollup(self._data, freq, by_category)
+        return self._collection.item(name).to_pandas()
+
+    @staticmethod
+    def _tokenise(descriptions):
+        ''' Returns the lowercase alphanumeric tokens of each description. '''
+        return descriptions.fillna('').astype(str).str.lower() \
+                           .str.findall(r'[a-z0-9]+')
+
+    def _index(self, data):
+        ''' Returns the (token, month) pairs of the descriptions of 'data'. '''
+        tokens = pd.DataFrame({
+            self.TOKEN: self._tokenise(data[self.DESCRIPTION]).values,
+            self.PERIOD: data.index.to_period('M').to_timestamp()})
+        return tokens.explode(self.TOKEN).dropna().drop_duplicates() \
+                     .set_index(self.PERIOD).sort_index()
+
+    def update_index(self, start=None, end=None):
+        ''' Update the stored description index for transactions between
+            start and end.
+
+        The index records which months each description token occurs in,
+            so text queries only read the months that can match. Only months
+            overlapping [start, end] are recomputed. If 'start' and 'end' are
+            left as None, rebuilds the index.
+
+        self.update_index(*datetime, *datetime) -> None
+
+        '''
+        with lock_item(self._collection, self.INDEX):
+            if start is None or \
+                    self.INDEX not in list_items(self._collection):
+                index = self._index(self._data)
+            else:
+                first = pd.Timestamp(start).to_period('M').start_time
+                last  = pd.Timestamp(end).to_period('M').end_time
+                dates = self._data.index
+                stored = self._collection.item(self.INDEX).to_pandas()
+                index = pd.concat([
+                    stored[(stored.index < first) | (stored.index > last)],
+                    self._index(self._data[(dates >= first) &
+                                           (dates <= last)])
+                ]).sort_index(kind='stable')
+            write_item(self._collection, self.INDEX, index)
+
+    def get_index(self):
+        ''' Returns the description index of this account. '''
+        if self._pending(): # read-only store, stored index is behind
+            return self._index(self._data)
+        if self.INDEX not in list_items(self._collection):
+            try:
+                self.update_index()
+            except IOError:
+                return self._index(self._data) # read-only store
+        return self._collection.item(self.INDEX).to_pandas()
+
+    def _token_months(self, text):
+        ''' Returns the months with descriptions that may contain 'text', or
+            None if the index can't narrow the search.
+
+        '''
+        tokens = self._tokenise(pd.Series([text])).iloc[0]
+        if not tokens:
+            return None
+        index = self.get_index()
+        months = None
+        for position, token in enumerate(tokens):
+            # inner tokens must be whole, but the text may start part way
+            #   through its first token and end part way through its last
+            if len(tokens) == 1:
+                matched = index[self.TOKEN].str.contains(token, regex=False)
+            elif position == 0:
+                matched = index[self.TOKEN].str.endswith(token)
+            elif position == len(tokens) - 1:
+                matched = index[self.TOKEN].str.startswith(token)
+            else:
+                matched = index[self.TOKEN] == token
+            token_months = set(index.index[matched.values])
+            months = token_months if months is None else months & token_months
+        return sorted(months)
+
+    def _no_transactions(self):
+        ''' Returns an empty DataFrame with the stored transaction columns,
+            reading only the item's metadata (no row groups can match).
+
+        '''
+        return self.get_transactions(False, filters=[[
+            (self.DATE, '<', pd.Timestamp('1900-01-01'))]])
+
+    def query(self, start=None, end=None, min_amount=None, max_amount=None,
+              contains=None, regex=None, category=None, case=False):
+        ''' Returns the transactions of this account matching all the
+            specified conditions.
+
+        'start' and 'end' are the inclusive date range.
+        'min_amount' and 'max_amount' are the inclusive (signed) credit range.
+        'contains' is a substring, and 'regex' a regular expression, to search
+            descriptions for ('case' sensitive if specified).
+        'category' is the category of transactions (see categorise).
+
+        Date, amount and category conditions are pushed down into the parquet
+            read, so row groups whose statistics can't match are skipped, and
+            'contains' uses the description index to read only the months
+            that can match.
+
+        self.query(*datetime, *datetime, *float, *float, *str, *str, *str,
+                   *bool) -> pd.DataFrame
+
+        '''
+        self.compact() # include any journalled transactions
+        conditions = []
+        if start is not None:
+            conditions.append((self.DATE, '>=', pd.Timestamp(start)))
+        if end is not None:
+            conditions.append((self.DATE, '<=', pd.Timestamp(end)))
+        if min_amount is not None:
+            conditions.append((self.CREDIT, '>=', min_amount))
+        if max_amount is not None:
+            conditions.append((self.CREDIT, '<=', max_amount))
+        if category is not None:
+            none = self._no_transactions()
+            if self.CATEGORY not in none:
+                return none # never categorised, so nothing can match
+            conditions.append((self.CATEGORY, '==', category))
+        filters = [conditions]
+
+        if contains:
+            months = self._token_months(contains)
+            if months is not None:
+                if not months:
+                    return self.get_transactions(False).iloc[:0]
+                # merge consecutive months into date ranges
+                ranges = []
+                for month in months:
+                    if ranges and ranges[-1][1] + pd.offsets.MonthBegin() \
+                            == month:
+                        ranges[-1][1] = month
+                    else:
+                        ranges.append([month, month])
+                filters = [conditions + [
+                    (self.DATE, '>=', first),
+                    (self.DATE, '<=', last.to_period('M').end_time)]
+                    for first, last in ranges]
+
+        data = self.get_transactions(False, filters=filters
+                                     if any(filters) else None)
+        if contains or regex:
+            descriptions = data[self.DESCRIPTION].fillna('').astype(str)
+            matched = np.ones(len(data), dtype=bool)
+            if contains:
+                matched &= descriptions.str.contains(contains, case=case,
+                                                     regex=False).values
+            if regex:
+                matched &= descriptions.str.contains(regex, case=case).values
+            data = data[matched]
+        return data
+
+    def categorise(self, categoriser, save=True):
+        ''' Label each transaction with its category, from 'categoriser'.
+
+        Categories are stored in the category column of the transactions,
+            and saved with them if 'save' is True.
+
+        self.categorise(categories.Categoriser, *bool) -> pd.Series
+
+        '''
+        self._data[self.CATEGORY] = categoriser.label(
+            self._data[self.DESCRIPTION], self._data[self.CREDIT])
+        if save:
+            self.save()
+            self.update_rollups()
+        return self._data[self.CATEGORY]
 
     def save(self):
-        ''' Save the account with updated data and/or metadata. '''
-        self._collection.write(self.TRANSACTIONS, self._data,
-                               metadata=self._metadata, overwrite=True)
+        ''' Save the account with updated data and/or metadata.
 
-    def plot(self):
-        ''' '''
+        Saving includes any journalled transactions, so clears them from the
+            journal, and updates the derived items (rollups and description
+            index) for them.
+
+        Raises WriteConflict if another writer has changed the stored account
+            since it was loaded.
+
+        '''
+        self._invalidate()
+        last = None
+        folded = []
+        if self._journal is not None:
+            # include transactions journalled by other processes
+            self._replay(self._journal.refresh(
+                self.TRANSACTIONS, self._metadata.get(self.JOURNAL, 0)))
+            folded = [self._from_json(entry[Journal.ARGUMENTS]['data']).index
+                      for entry in self._journal.pending(
+                          self.TRANSACTIONS,
+                          self._metadata.get(self.JOURNAL, 0))]
+            # never behind entries compacted by other processes
+            last = max(self._journal.last(self.TRANSACTIONS),
+                       self._metadata.get(self.JOURNAL, 0))
+            if last:
+                self._metadata[self.JOURNAL] = last
+        self._metadata[VERSION] = write_item(
+            self._collection, self.TRANSACTIONS, self._data, self._metadata,
+            self._metadata.get(VERSION))
+        if last:
+            self._journal.clear(self.TRANSACTIONS, last)
+        folded = [dates for dates in folded if len(dates)]
+        if folded:
+            # the folded transactions are now included in derived items
+            self._update_derived(min(dates.min() for dates in folded),
+                                 max(dates.max() for dates in folded))
+
+    def plot(self, freq=None, max_points=2000, ax=None):
+        ''' Plot the balance history of this account.
+
+        'freq' optionally resamples the balance to the given resolution (e.g.
+            'D', 'W', 'M') before drawing.
+        'max_points' limits the number of points drawn, using shape-preserving
+            downsampling. If None, draws every point.
+        'ax' is the matplotlib axes to draw on. If left as None, draws on a new
+            figure and shows it.
+
+        self.plot(*str, *int, *Axes) -> None
+
+        '''
         import matplotlib.pyplot as plt
-        plt.plot(self._data.index, self._data['balance'])
-        plt.show()
+        from plotting import plot_series
+        show = ax is None
+        if show:
+            ax = plt.gca()
+        balance = self._data[self.BALANCE]
+        plot_series(balance, ax, freq, max_points, title=self.name,
+                    ylabel='Balance ($)')
+        if show:
+            plt.show()
 
     def __str__(self):
         ''' Returns a user-readable string of this Account. '''
-        balance = self.get_balance()
-        balance_str = 'Balance = ${} ({})'.format(balance[0],
+        valuation = self.valuation
+        balance = valuation.balance
+        balance_str = 'Balance = ${} ({})'.format(balance.iloc[0],
                                                   balance.index.date[0])
-        tracked_from = 'Tracked from {}'.format(
-            self._data.head(1).index.date[0])
-        return 'Account({} - {}):\n\t{}\n\t{}'.format(
-            self.name, self.number, '\n\t'.join((balance_str, tracked_from)),
-            '\n\t'.join([key + ' = ' + value \
-                         for (key, value) in self._metadata.items()
-                         if key != self.NUMBER]))
+        tracked_from = 'Tracked from {}'.format(valuation.tracked_from)
+        return 'Account({} - {}):\n\t{}'.format(
+            self.name, self.number, '\n\t'.join([balance_str, tracked_from] +
+            ['{} = {}'.format(key, value) \
+             for (key, value) in self._metadata.items()
+             if key != self.NUMBER and not self.is_internal(key)]))
 
 
 class Stock(object):
@@ -188,6 +1055,32 @@ class Stock(object):
     BROKERAGE = 'total_brokerage'
     QUANTITY  = 'owned_quantity'
     NAME      = 'name'
+    CURRENCY  = 'currency'
+    JOURNAL   = Journal.FILENAME.split('.')[0]
+    INTRADAY  = 'intraday' # interval of stored intraday bars, if any
+    CLOSE     = 'Daily Close'
+
+    # intraday bars, stored in one internal item per month (only the latest
+    #   month is ever appended to), in compact dtypes
+    BARS         = Account.INTERNAL + 'bars_{symbol}_{interval}_'
+    BAR_MONTH    = '%Y-%m'
+    OHLCV        = {'1. open': 'open', '2. high': 'high', '3. low': 'low',
+                    '4. close': 'close', '5. volume': 'volume'}
+    PRICE_DTYPE  = 'float32'
+    VOLUME_DTYPE = 'uint32'
+    INTERVALS    = ('1min', '5min', '15min', '30min', '60min')
+
+    # split and dividend events, stored in a small internal item per stock,
+    #   for adjusting the stored raw closes
+    ADJUSTED = 'adjusted' # metadata flag for split-adjusted valuation
+    FACTORS  = Account.INTERNAL + 'factors_{symbol}'
+    SPLIT    = 'split'
+    DIVIDEND = 'dividend'
+    UPDATED  = 'updated'
+
+    # tax lots, matched by LOT_METHOD, and cached as matched so far
+    LOT_METHOD = 'lot_method'
+    LOTS       = Account.INTERNAL + 'lots'
 
     # internal classes for convenience of presentation of metadata
     class Dividend(dict):
@@ -225,19 +1118,25 @@ class Stock(object):
 
     class Purchase(dict):
         ''' A single purchase/sale of this stock. '''
-        def __init__(self, quantity, date, unit_cost, brokerage):
+        def __init__(self, quantity, date, unit_cost, brokerage, lots=None):
             ''' Store the information in a stock purchase/sale.
 
             A Sale is a Purchase with a negative quantity.
 
+            'lots' optionally specifies the lots a sale is matched to, as a
+                dict of {purchase date: quantity}.
+
             '''
             date = str(date)
             super().__init__(quantity=quantity, date=date,
                              unit_cost=unit_cost, brokerage=brokerage)
+            if lots:
+                self['lots'] = lots
             self.date      = date
             self.quantity  = float(quantity)
             self.unit_cost = float(unit_cost)
             self.brokerage = float(brokerage)
+            self.lots      = lots
 
         def get_cost(self, brokerage=False):
             ''' Returns the total amount paid, optionally with brokerage. '''
@@ -259,9 +1158,57 @@ class Stock(object):
                     .format(type_, self.get_cost(), quantity, self.unit_cost,
                             self.brokerage, self.date)
 
+    class Valuation(dict):
+        ''' A snapshot of a stock's value and costs, for a given state. '''
+        def __init__(self, date, unit_value, quantity, balance, cost,
+                     brokerage):
+            ''' Store the valuation components of a stock.
+
+            'balance' is the uninvested balance from the latest dividend.
+            'cost' is the total cost of all purchases, excluding 'brokerage'.
+
+            '''
+            super().__init__(date=str(date), unit_value=unit_value,
+                             quantity=quantity, balance=balance, cost=cost,
+                             brokerage=brokerage)
+            self.date       = date
+            self.unit_value = float(unit_value)
+            self.quantity   = float(quantity)
+            self.balance    = float(balance)
+            self.cost       = float(cost)
+            self.brokerage  = float(brokerage)
+
+        def get_value(self, stored_balance=False, unit=False):
+            ''' Returns the unit/full value, as for Stock.get_value. '''
+            if unit:
+                return self.unit_value
+            value = self.unit_value * self.quantity
+            if stored_balance:
+                value += self.balance
+            return value
+
+        def get_cost(self, brokerage=False):
+            ''' Returns the total cost, as for Stock.get_cost. '''
+            if brokerage:
+                return self.cost + self.brokerage
+            return self.cost
+
+        def get_profit(self, stored_balance=True, brokerage=False,
+                       relative=False):
+            ''' Returns the absolute/relative profit, as for
+                Stock.get_profit.
+
+            '''
+            value = self.get_value(stored_balance)
+            cost  = self.get_cost(brokerage)
+
+            if relative:
+                return value / cost - 1
+            return value - cost
+
     def __init__(self, collection, symbol, apikey=None, name='', quantity=None,
                  purchase_date=None, unit_cost=None, brokerage=None,
-                 **metadata):
+                 journal=None, **metadata):
         ''' Tracks a stock. If the stock is not already tracked, records the
             specified purchase information for a new purchase of the stock.
 
@@ -269,10 +1216,23 @@ class Stock(object):
             Must be provided for new stocks. If provided for an existing stock,
             that stock is updated with the latest data, else only the existing
             data is used.
+        'journal' is an optional Journal of the collection. If provided, its
+            pending entries are replayed, and if it's recording, purchases
+            and dividends are journalled instead of rewriting the stored item
+            each time.
+        'intraday' can be specified in 'metadata' as one of Stock.INTERVALS to
+            also store intraday OHLCV bars at that interval, which are updated
+            whenever daily data is.
+        'adjusted' can be specified in 'metadata' as True to also store split
+            and dividend factors, and value the stock with split-adjusted
+            prices and quantities.
         '''
         self._collection = collection
         self.symbol = symbol
-        if symbol not in collection.list_items():
+        self._valuation = None
+        self._factors = None
+        self._journal = None # set once the stored item exists
+        if symbol not in list_items(collection):
             # stock is new, populate and add user specified metadata
             self._data = self.get_data(symbol, purchase_date, apikey)
             self._metadata = {
@@ -288,30 +1248,63 @@ class Stock(object):
                 raise Exception("quantity, purchase_date, unit_cost and "
                                 "brokerage must be specified for a purchase")
             self.add_quantity(*purchase_data)
+            self._journal = journal
+            if apikey and self.adjusted:
+                self.update_factors(apikey)
+            if apikey and self.intraday:
+                self.update_bars(apikey)
         else:
-            # existing stock, get stored metadata, ignore inputs
-            item = collection.item(symbol)
-            self._metadata = item.metadata
+            # existing stock, ignore inputs
+            with lock_item(collection, symbol, shared=True):
+                latest_date = collection.item(symbol).to_pandas().index[-1]
 
             # update with latest stock values (if desired and appropriate)
-            latest_date = item.to_pandas().index[-1]
             if apikey and latest_date < np.datetime64('today') - 1:
                 try:
-                    collection.append(symbol, self.get_data(symbol,
-                                                  latest_date, apikey))
+                    data = self.get_data(symbol, latest_date, apikey)
+                    write_item(collection, symbol,
+                               data[data.index > latest_date], append=True)
                 except IOError as e:
                     print('Could not update data!')
                     print(e)
             elif not apikey:
                 print('No API key provided - using stored data.')
 
-            # retrieve updated data
-            self._data = collection.item(symbol).to_pandas()
+            # retrieve updated data and stored metadata
+            self.reload()
+            self._journal = journal
+            self._replay()
+            if apikey and self.adjusted:
+                self.update_factors(apikey)
+            if apikey and self.intraday:
+                self.update_bars(apikey)
 
     @property
     def name(self):
         return self._metadata[self.NAME]
 
+    @property
+    def currency(self):
+        ''' The trading currency of the stock (metadata, else inferred from
+            the exchange of its symbol).
+
+        '''
+        currency = self._metadata.get(self.CURRENCY, None)
+        if not currency:
+            from fx import symbol_currency
+            currency = symbol_currency(self.symbol)
+        return currency
+
+    @property
+    def intraday(self):
+        ''' The interval of the stored intraday bars, or None. '''
+        return self._metadata.get(self.INTRADAY, None)
+
+    @property
+    def adjusted(self):
+        ''' Whether this stock is valued with split-adjusted data. '''
+        return bool(self._metadata.get(self.ADJUSTED, False))
+
     @property
     def quantity(self):
         ''' The current owned quantity of the stock. '''
@@ -336,6 +1329,28 @@ class Stock(object):
                 for dividend in self._metadata[self.DIVIDENDS]]
         return self._metadata[self.DIVIDENDS]
 
+    @property
+    def valuation(self):
+        ''' The valuation of this stock, cached until its state changes. '''
+        if self._valuation is None:
+            latest = self.get_close_history().tail(1)
+            purchases = self.get_purchase_history()
+            dividends = self.get_dividend_history()
+            quantity = self.quantity
+            if self.adjusted:
+                dates, quantities = self._quantity_changes()
+                quantity = (quantities * self.get_split_factors(dates)).sum()
+            self._valuation = self.Valuation(
+                latest.index[0], latest.iloc[0], quantity,
+                dividends[-1].balance if dividends else 0.0,
+                sum([purchase.get_cost() for purchase in purchases]),
+                sum([purchase.brokerage for purchase in purchases]))
+        return self._valuation
+
+    def _invalidate(self):
+        ''' Clear cached values derived from the current state. '''
+        self._valuation = None
+
     def get_value(self, stored_balance=False, unit=False):
         ''' Returns the latest stored unit/full value of this stock.
 
@@ -343,19 +1358,289 @@ class Stock(object):
 
         '''
         # TODO 'as at date' and 'over time' options
-        value = self._data.tail(1)['Daily Close'][0]
-        if not unit:
-            value *= self.quantity
-            if stored_balance:
-                dividends = self.get_dividend_history()
-                if dividends:
-                    value += dividends[-1].balance
-        return value
+        return self.valuation.get_value(stored_balance, unit)
+
+    def _quantity_changes(self):
+        ''' Returns the dates and quantities of each change in owned quantity
+            (purchases, sales and reinvested dividends).
+
+        self._quantity_changes() -> pd.DatetimeIndex, np.ndarray[float]
+
+        '''
+        changes = [(purchase.date, purchase.quantity) for purchase in
+                   self.get_purchase_history()]
+        changes += [(dividend.date, dividend.amount) for dividend in
+                    self.get_dividend_history()
+                    if dividend.type == dividend.REINVESTMENT]
+        dates, quantities = zip(*changes) if changes else ((), ())
+        return pd.to_datetime(list(dates)), np.array(quantities, dtype=float)
+
+    def get_quantity_history(self):
+        ''' Returns the owned quantity of this stock at each stored date.
+
+        Includes purchases, sales and reinvested dividends. Quantities are in
+            current (post-split) shares if the stock is adjusted.
+
+        '''
+        dates, quantities = self._quantity_changes()
+        if self.adjusted:
+            quantities = quantities * self.get_split_factors(dates)
+        quantity = pd.Series(quantities, index=dates, dtype=float)
+        quantity = quantity.groupby(level=0).sum().cumsum()
+        # quantity changes apply from their date until the next change
+        dates = self.get_close_history().index
+        index = dates.union(quantity.index)
+        return quantity.reindex(index).ffill().fillna(0).reindex(dates)
+
+    def get_close_history(self):
+        ''' Returns the daily close price of this stock at each stored date.
+
+        If intraday bars are stored, days after the latest daily close are
+            resampled from the bars (e.g. the current trading day).
+
+        '''
+        close = self._data[self.CLOSE]
+        if self.adjusted:
+            close = close / self.get_split_factors(close.index)
+        if not self.intraday:
+            return close
+        start = close.index[-1] + np.timedelta64(1, 'D') if len(close) \
+                else None
+        daily = self.get_daily_bars(start=start)['close'].astype(float)
+        return pd.concat([close, daily[daily.index > close.index[-1]]
+                          if len(close) else daily]).rename(self.CLOSE)
+
+    def get_factors(self):
+        ''' Returns the stored split and dividend events of this stock.
+
+        Each event has the split coefficient and dividend per share, on its
+            ex-date.
+
+        self.get_factors() -> pd.DataFrame
+
+        '''
+        if self._factors is None:
+            item = self.FACTORS.format(symbol=self.symbol)
+            if item in list_items(self._collection):
+                self._factors = self._collection.item(item).to_pandas()
+            else:
+                self._factors = pd.DataFrame(
+                    {self.SPLIT: pd.Series(dtype=float),
+                     self.DIVIDEND: pd.Series(dtype=float)},
+                    index=pd.DatetimeIndex([]))
+        return self._factors
+
+    def update_factors(self, apikey):
+        ''' Fetch any split and dividend events since the last update.
+
+        Only the (small) factors item is rewritten - stored closes are raw,
+            and adjusted on demand.
+
+        '''
+        from providers import alpha_vantage # network code only on fetch
+        item = self.FACTORS.format(symbol=self.symbol)
+        factors = self.get_factors()
+        updated = None
+        if item in list_items(self._collection):
+            updated = self._collection.item(item).metadata.get(self.UPDATED)
+        # compact output covers the last 100 data points
+        outputsize = 'full'
+        if updated and np.datetime64('today') - np.datetime64(updated) < \
+                np.timedelta64(100, 'D'):
+            outputsize = 'compact'
+        try:
+            data = alpha_vantage('TIME_SERIES_DAILY_ADJUSTED', apikey,
+                                 symbol=self.symbol, outputsize=outputsize)
+        except IOError as e:
+            print('Could not update adjustment factors!')
+            print(e)
+            return
+        events = pd.DataFrame({
+            self.SPLIT: data['8. split coefficient'].astype(float),
+            self.DIVIDEND: data['7. dividend amount'].astype(float)})
+        events = events[(events[self.SPLIT] != 1) |
+                        (events[self.DIVIDEND] != 0)]
+        factors = pd.concat([factors, events])
+        factors = factors[~factors.index.duplicated(keep='last')].sort_index()
+        write_item(self._collection, item, factors, {
+            self.UPDATED: str(data.index.max().date())})
+        self._factors = factors
+        self._invalidate()
+
+    def get_split_factors(self, dates):
+        ''' Returns the product of the split coefficients after each of
+            'dates' - the number of current shares per share held then.
+
+        self.get_split_factors(pd.DatetimeIndex) -> np.ndarray[float]
+
+        '''
+        factors = self.get_factors()
+        return self._suffix_product(factors.index,
+                                    factors[self.SPLIT].values, dates)
+
+    def get_adjustment_factors(self, dates, dividends=True):
+        ''' Returns the factors adjusting raw closes at each of 'dates' to be
+            comparable with current closes.
+
+        Adjusts for splits, and optionally for dividends (as reinvested at
+            the close before their ex-date).
+
+        self.get_adjustment_factors(pd.DatetimeIndex, *bool)
+            -> np.ndarray[float]
+
+        '''
+        factors = self.get_factors()
+        adjustment = 1 / self.get_split_factors(dates)
+        if dividends and len(factors):
+            close = self._data[self.CLOSE]
+            # raw close before each ex-date (the first close if none before)
+            previous = close.values[np.maximum(close.index.searchsorted(
+                factors.index, side='left') - 1, 0)]
+            ratios = 1 - factors[self.DIVIDEND].values / previous
+            adjustment *= self._suffix_product(factors.index, ratios, dates)
+        return adjustment
+
+    @staticmethod
+    def _suffix_product(event_dates, values, dates):
+        ''' Returns the product of the 'values' of events after each of
+            'dates', using a reverse cumulative product.
+
+        '''
+        suffix = np.append(np.cumprod(np.asarray(values, dtype=float)[::-1])
+                           [::-1], 1.0)
+        return suffix[event_dates.searchsorted(dates, side='right')]
+
+    def get_adjusted_close(self, dividends=True):
+        ''' Returns the split (and optionally dividend) adjusted close
+            history, as for the AlphaVantage adjusted close.
+
+        '''
+        close = self._data[self.CLOSE]
+        return close * self.get_adjustment_factors(close.index, dividends)
+
+    @property
+    def lot_method(self):
+        ''' The method sales are matched to lots with (see lots.METHODS). '''
+        from lots import FIFO
+        return self._metadata.get(self.LOT_METHOD, FIFO)
+
+    def _trades(self, purchases, dividends):
+        ''' Returns the lot trades of 'purchases' and reinvested 'dividends'.
+
+        Reinvested shares cost the close price on their date. If the stock is
+            adjusted, quantities and unit costs are in current (post-split)
+            shares, as for the close history.
+
+        '''
+        trades = [dict(purchase) for purchase in purchases]
+        reinvestments = [dividend for dividend in dividends
+                         if dividend.type == dividend.REINVESTMENT]
+        if reinvestments:
+            close = self.get_close_history()
+            dates = pd.to_datetime([dividend.date for dividend in
+                                    reinvestments])
+            prices = close.reindex(close.index.union(dates)).ffill().bfill() \
+                          .reindex(dates).values
+            if self.adjusted:
+                prices = prices * self.get_split_factors(dates) # raw price
+            trades += [dict(date=dividend.date, quantity=dividend.amount,
+                            unit_cost=price, brokerage=0.0) for
+                       dividend, price in zip(reinvestments, prices)]
+        if self.adjusted and trades:
+            factors = self.get_split_factors(pd.to_datetime(
+                [trade['date'] for trade in trades]))
+            for trade, factor in zip(trades, factors):
+                trade['quantity'] *= factor
+                trade['unit_cost'] /= factor
+                if trade.get('lots'):
+                    lots = pd.to_datetime(list(trade['lots']))
+                    trade['lots'] = {date: quantity * lot_factor for
+                                     (date, quantity), lot_factor in
+                                     zip(trade['lots'].items(),
+                                         self.get_split_factors(lots))}
+        return trades
+
+    def get_lots(self, method=None):
+        ''' Returns the LotMatcher of this stock's trades with 'method'.
+
+        Matching continues from the state cached in the stock metadata, so
+            only trades since the last match are processed, unless a trade
+            was backdated before them (or the method differs).
+
+        'method' defaults to the lot method of this stock.
+
+        self.get_lots(*str) -> lots.LotMatcher
+
+        '''
+        from lots import LotMatcher
+        method = method or self.lot_method
+        purchases = self.get_purchase_history()
+        dividends = self.get_dividend_history()
+        state = self._metadata.get(self.LOTS, None)
+        # split events change adjusted quantities, so rematch on new ones
+        splits = int((self.get_factors()[self.SPLIT] != 1).sum()) \
+                 if self.adjusted else 0
+        if state and state['method'] == method and \
+                state.get(self.SPLIT, 0) == splits and \
+                state[self.PURCHASES] <= len(purchases) and \
+                state[self.DIVIDENDS] <= len(dividends):
+            trades = self._trades(purchases[state[self.PURCHASES]:],
+                                  dividends[state[self.DIVIDENDS]:])
+            if all(str(trade['date']) >= state['last'] for trade in trades):
+                matcher = LotMatcher(method, state)
+                matcher.process(trades)
+            else:
+                state = None
+        else:
+            state = None
+        if state is None:
+            matcher = LotMatcher(method)
+            matcher.process(self._trades(purchases, dividends))
+        if method == self.lot_method:
+            self._metadata[self.LOTS] = dict(matcher.state(), **{
+                self.PURCHASES: len(purchases),
+                self.DIVIDENDS: len(dividends), self.SPLIT: splits})
+        return matcher
+
+    def _update_lots(self):
+        ''' Match any new trades into the cached lots (if cached). '''
+        if self.LOTS in self._metadata:
+            self.get_lots()
+
+    def get_realised_gains(self, method=None):
+        ''' Returns the realised gains of each lot disposal.
+
+        'method' defaults to the lot method of this stock.
+
+        self.get_realised_gains(*str) -> pd.DataFrame
+
+        '''
+        return self.get_lots(method).get_realised()
+
+    def get_unrealised_gain(self, method=None):
+        ''' Returns the unrealised gain of the open lots, at the latest
+            stored close.
+
+        '''
+        lots = self.get_lots(method).get_open_lots()
+        return float(((self.get_value(unit=True) - lots['unit_cost']) *
+                      lots['quantity']).sum())
+
+    def get_value_history(self):
+        ''' Returns the full value of this stock at each stored date. '''
+        return (self.get_close_history() * self.get_quantity_history()) \
+                .rename(self.symbol)
 
     def get_cost(self, brokerage=False):
         ''' Returns the total cost of this stock - brokerage optional. '''
-        return sum([purchase.get_cost(brokerage) for purchase in
-                    self.get_purchase_history()])
+        return self.valuation.get_cost(brokerage)
+
+    def get_cost_history(self, brokerage=False):
+        ''' Returns the cost of each purchase/sale of this stock, by date. '''
+        purchases = self.get_purchase_history()
+        return pd.Series([purchase.get_cost(brokerage) for purchase in
+                          purchases], dtype=float, index=pd.to_datetime(
+                              [purchase.date for purchase in purchases]))
 
     def get_profit(self, stored_balance=True, brokerage=False, relative=False):
         ''' Returns absolute ($) or relative (%) profit for this stock.
@@ -370,14 +1655,9 @@ class Stock(object):
         '''
         # TODO add optional start and end dates to calculate profit since
         #   or up to given date, or over specified time bracket
-        value = self.get_value(stored_balance)
-        cost  = self.get_cost(brokerage)
-
-        if relative:
-            return value / cost - 1
-        return value - cost
+        return self.valuation.get_profit(stored_balance, brokerage, relative)
 
-    def add_dividend(self, type_, amount, date, balance=0.0):
+    def add_dividend(self, type_, amount, date, balance=0.0, _record=True):
         '''
 
         'type_' should be one of Stock.Dividend.REINVESTMENT or
@@ -388,42 +1668,276 @@ class Stock(object):
         self._metadata[self.DIVIDENDS].append(dividend)
         if type_ == dividend.REINVESTMENT:
             self._metadata[self.QUANTITY] += dividend.amount
-        self.save()
+        if _record:
+            self._record('add_dividend', dict(dividend))
 
-    def add_quantity(self, quantity, date, unit_cost, brokerage):
-        ''' '''
-        purchase = self.Purchase(quantity, date, unit_cost, brokerage)
+    def add_quantity(self, quantity, date, unit_cost, brokerage, lots=None,
+                     _record=True):
+        ''' Record a purchase, or a sale (negative 'quantity').
+
+        'lots' optionally specifies the lots a sale is matched to, as a dict
+            of {purchase date: quantity}.
+
+        '''
+        purchase = self.Purchase(quantity, date, unit_cost, brokerage, lots)
         self._metadata[self.QUANTITY]  += quantity
         self._metadata[self.BROKERAGE] += brokerage
         self._metadata[self.PURCHASES].append(purchase)
-        self.save()
+        if _record:
+            self._record('add_quantity', dict(purchase))
+
+    def _record(self, operation, arguments):
+        ''' Persist a mutation - journalled if possible, else saved.
+
+        If another writer saved the stock since it was loaded, reloads it and
+            re-applies the mutation on top of its changes.
+
+        Cached lots are matched with the new trade as it is persisted.
+
+        '''
+        if self._journal is None or not self._journal.recording:
+            with lock_item(self._collection, self.symbol):
+                if self._sync():
+                    getattr(self, operation)(**arguments, _record=False)
+                self._update_lots()
+                self.save()
+            return
+        self._invalidate()
+        self._update_lots()
+        self._journal.record(self.symbol, operation, **arguments)
+        if self._journal.needs_compaction(self.symbol):
+            self.compact()
+
+    def _replay(self, entries=None):
+        ''' Apply journalled mutations not yet in the stored item.
+
+        'entries' defaults to all the pending journal entries.
+
+        '''
+        if self._journal is None:
+            return
+        if entries is None:
+            entries = self._journal.pending(self.symbol,
+                                            self._metadata.get(self.JOURNAL,
+                                                               0))
+        for entry in entries:
+            getattr(self, entry[Journal.OPERATION])(
+                **entry[Journal.ARGUMENTS], _record=False)
+
+    def compact(self):
+        ''' Fold any journalled mutations into the stored item (unless the
+            store is read-only).
+
+        '''
+        if self._journal is None or self._journal.read_only or \
+                not self._journal.pending(self.symbol,
+                                          self._metadata.get(self.JOURNAL, 0)):
+            return
+        with lock_item(self._collection, self.symbol):
+            if self._sync():
+                self._replay() # mutations are still journalled
+            self.save()
+
+    def _sync(self):
+        ''' Reload the stock if another writer has changed it since it was
+            loaded (with its lock held, so it can't change again).
+
+        Returns True if the stock was reloaded.
+
+        '''
+        if get_version(self._collection, self.symbol) == \
+                self._metadata.get(VERSION, 0):
+            return False
+        self.reload()
+        return True
+
+    def get_bar_items(self, interval=None):
+        ''' Returns the names of the stored monthly intraday bar items of this
+            stock, in date order.
+
+        'interval' defaults to the intraday interval of this stock. If False,
+            includes the items of all intervals.
+
+        self.get_bar_items(*str/bool) -> list[str]
+
+        '''
+        if interval is None:
+            interval = self.intraday
+            if interval is None:
+                return []
+        prefix = self.BARS.format(symbol=self.symbol, interval=interval) \
+                 if interval else self.BARS.split('{interval}')[0] \
+                                           .format(symbol=self.symbol)
+        return sorted(item for item in list_items(self._collection)
+                      if item.startswith(prefix))
+
+    def update_bars(self, apikey, interval=None):
+        ''' Fetch intraday bars newer than those stored.
+
+        New bars are appended to the item of their month, so earlier months
+            are never rewritten.
+
+        'interval' defaults to the intraday interval of this stock.
+
+        '''
+        interval = interval or self.intraday
+        items = self.get_bar_items(interval)
+        latest = None
+        outputsize = 'full'
+        if items:
+            latest = self._collection.item(items[-1]).to_pandas().index[-1]
+            # compact output covers the last 100 bars
+            if np.datetime64('now') - np.datetime64(latest) < \
+                    np.timedelta64(100 * int(interval[:-3]), 'm'):
+                outputsize = 'compact'
+        try:
+            data = self.get_intraday_data(self.symbol, apikey, interval,
+                                          outputsize=outputsize)
+        except IOError as e:
+            print('Could not update intraday data!')
+            print(e)
+            return
+        if latest is not None:
+            data = data[data.index > latest]
+
+        prefix = self.BARS.format(symbol=self.symbol, interval=interval)
+        for month, bars in data.groupby(data.index.strftime(self.BAR_MONTH)):
+            write_item(self._collection, prefix + month, bars, append=True)
+        self._invalidate()
+
+    def get_bars(self, interval=None, start=None, end=None):
+        ''' Returns the stored intraday OHLCV bars of this stock between
+            'start' and 'end' (inclusive).
+
+        Only the monthly items within the date range are read.
+
+        'interval' defaults to the intraday interval of this stock.
+
+        self.get_bars(*str, *datetime64, *datetime64) -> pd.DataFrame
+
+        '''
+        prefix = self.BARS.format(symbol=self.symbol,
+                                  interval=interval or self.intraday)
+        first = pd.Timestamp(start).strftime(self.BAR_MONTH) if start \
+                is not None else ''
+        last = pd.Timestamp(end).strftime(self.BAR_MONTH) if end \
+               is not None else '~'
+        # month names sort chronologically
+        bars = [self._collection.item(item).to_pandas() for item in
+                self.get_bar_items(interval)
+                if first <= item[len(prefix):] <= last]
+        if not bars:
+            return pd.DataFrame({column: pd.Series(dtype=self.VOLUME_DTYPE
+                                 if column == 'volume' else self.PRICE_DTYPE)
+                                 for column in self.OHLCV.values()},
+                                index=pd.DatetimeIndex([]))
+        bars = pd.concat(bars).sort_index()
+        if start is not None:
+            bars = bars[bars.index >= pd.Timestamp(start)]
+        if end is not None:
+            bars = bars[bars.index <= pd.Timestamp(end)]
+        return bars
+
+    def get_daily_bars(self, interval=None, start=None, end=None):
+        ''' Returns the stored intraday bars, resampled to daily OHLCV bars.
+
+        Arguments are as for Stock.get_bars.
+
+        self.get_daily_bars(*str, *datetime64, *datetime64) -> pd.DataFrame
+
+        '''
+        bars = self.get_bars(interval, start, end)
+        daily = bars.resample('D').agg({'open': 'first', 'high': 'max',
+                                        'low': 'min', 'close': 'last',
+                                        'volume': 'sum'})
+        return daily.dropna(subset=['close'])
+
+    def reload(self):
+        ''' Reload the stored data and metadata of this stock. '''
+        self._invalidate()
+        self._factors = None
+        with lock_item(self._collection, self.symbol, shared=True):
+            item = self._collection.item(self.symbol)
+            self._metadata = item.metadata
+            self._data = item.to_pandas()
+        self._metadata.setdefault(VERSION, 0)
 
     def save(self):
-        ''' Save the current state of this stock. '''
-        self._collection.write(self.symbol, self._data,
-                               metadata=self._metadata, overwrite=True)
+        ''' Save the current state of this stock, including any journalled
+            mutations.
+
+        Raises WriteConflict if another writer has changed the stored stock
+            since it was loaded.
+
+        '''
+        self._invalidate()
+        last = None
+        if self._journal is not None:
+            # include mutations journalled by other processes
+            self._replay(self._journal.refresh(
+                self.symbol, self._metadata.get(self.JOURNAL, 0)))
+            # never behind entries compacted by other processes
+            last = max(self._journal.last(self.symbol),
+                       self._metadata.get(self.JOURNAL, 0))
+            if last:
+                self._metadata[self.JOURNAL] = last
+        self._metadata[VERSION] = write_item(
+            self._collection, self.symbol, self._data, self._metadata,
+            self._metadata.get(VERSION))
+        if last:
+            self._journal.clear(self.symbol, last)
 
     def __str__(self):
         ''' '''
-        # update purchases and dividends to correct format
-        self.get_purchase_history()
-        self.get_dividend_history()
+        # valuation also updates purchases and dividends to correct format
+        valuation = self.valuation
         # create desired output string
         sep = '\n' + ' ' * 4
         return ('Stock:{sep}value=${:.2f} (at {date})'
                 '{sep}profit=${:.2f} (at {date}){sep}').format(
-                    self.get_value(), self.get_profit(),
+                    valuation.get_value(), valuation.get_profit(),
                     sep=sep, date=np.datetime64('today')) + \
                 sep.join('{}={}'.format(key, value) for
-                         key, value in self._metadata.items())
+                         key, value in self._metadata.items()
+                         if not Account.is_internal(key))
 
     def __repr__(self):
         ''' '''
         return str(self)
 
+    @classmethod
+    def _compact(cls, data):
+        ''' Returns AlphaVantage OHLCV 'data' with named columns, in compact
+            dtypes.
+
+        '''
+        data = data[list(cls.OHLCV)].rename(columns=cls.OHLCV)
+        return data.astype({column: cls.VOLUME_DTYPE if column == 'volume'
+                            else cls.PRICE_DTYPE for column in data.columns})
+
+    @classmethod
+    def get_intraday_data(cls, symbol, apikey, interval='5min', **params):
+        ''' Returns intraday OHLCV bars for 'symbol' stock.
+
+        'interval' should be one of Stock.INTERVALS.
+
+        Parameters are as defined by the AlphaVantage TIME_SERIES_INTRADAY
+            API (e.g. outputsize='full' for the last 30 days of bars).
+
+        '''
+        if interval not in cls.INTERVALS:
+            raise Exception('Invalid interval {!r} - should be one of {}'
+                            .format(interval, cls.INTERVALS))
+        from providers import alpha_vantage # network code only on fetch
+        data = alpha_vantage('TIME_SERIES_INTRADAY', apikey, symbol=symbol,
+                             interval=interval, **params)
+        data = cls._compact(data)
+        data.name = symbol
+        return data.sort_index()
+
     @classmethod
     def get_data(cls, symbol, start_date, apikey,
-                 function='TIME_SERIES_DAILY', **params):
+                 function='TIME_SERIES_DAILY', ohlcv=False, **params):
         ''' Returns close data for 'symbol' stock since 'start_date'.
 
         Requires an AlphaVantage API key.
@@ -431,40 +1945,12 @@ class Stock(object):
         Parameters are as defined by the AlphaVantage API.
 
         'start_date' should be of datetime64[ns] format.
+        'ohlcv' returns full open/high/low/close/volume bars in compact dtypes
+            instead of just close data.
 
         '''
-        # update parameters
-        params.update(dict(symbol=symbol, apikey=apikey, function=function))
-
-        query_minute = np.datetime64('now').tolist().minute
-
-        # If extra functionality is needed, probably best to transfer to using
-        #   the open-source alpha_vantage library (pip-installable), but for
-        #   now that would just add excess overhead
-        with url_query('alphavantage.co/query?', params=params) as query:
-            data = query.json()
-            url  = query.url
-
-        # parse and format data
-        try:
-            data.pop('Meta Data')
-        except KeyError:
-            error = data.get('Error Message', None)
-            if error:
-                # add url to error message
-                error = error.replace('.', ' ({}).'.format(url), 1)
-                raise IOError(error)
-            else:
-                # too many calls for API plan (for free key, >5/min or >500)
-                print(data['Note'])
-                print('Auto-retrying on new minute.')
-                while np.datetime64('now').tolist().minute == query_minute:
-                    sleep(1) # wait until next minute
-                return cls.get_data(start_date=start_date, **params)
-
-        # only data item remaining, get it and create a DataFrame
-        data = pd.DataFrame(list(data.values())[0]).transpose()
-        data.index = data.index.astype('datetime64[ns]')
+        from providers import alpha_vantage # network code only on fetch
+        data = alpha_vantage(function, apikey, symbol=symbol, **params)
 
         # check if retrieved data is sufficient
         start_date = np.datetime64(start_date)
@@ -473,35 +1959,51 @@ class Stock(object):
             # doesnt't go far enough back, get more data
             params['outputsize'] = 'full'
             try:
-                return cls.get_data(start_date=start_date, **params)
+                return cls.get_data(symbol, start_date, apikey, function,
+                                    ohlcv, **params)
             except IOError as e:
                 print(e)
 
-        # only get market close values (removes open, high, low, and volume)
-        data = data['4. close'].to_frame(name='Daily Close')
+        if ohlcv:
+            data = cls._compact(data)
+        else:
+            # only get market close values (removes open, high, low, volume)
+            data = data['4. close'].to_frame(name=cls.CLOSE).astype(float)
         data.name = symbol
-        return data.astype(float)[data.index >= start_date].sort_index()
+        return data[data.index >= start_date].sort_index()
 
 
 class StocksAccount(Account):
     ''' '''
     def __init__(self, store, name=None, number=None, data=None, save=True,
-                 apikey=None, update=True, **metadata):
-        super().__init__(store, name, number, data, save, **metadata)
+                 apikey=None, update=True, journal=False, lazy=False,
+                 **metadata):
+        super().__init__(store, name, number, data, save, journal, lazy,
+                         **metadata)
         self.__sqolru = apikey
         self._load_stocks(update)
 
+    def compact(self):
+        ''' Fold any journalled transactions and stock mutations into the
+            stored items.
+
+        '''
+        super().compact()
+        for stock in self._stocks.values():
+            stock.compact()
+
     def _load_stocks(self, update):
         ''' Load existing stocks from the collection. '''
         self._stocks  = dict()
         self._names   = dict()
 
         # initialise previously stored stocks from storage
-        for symbol in self._collection.list_items():
-            if symbol == self.TRANSACTIONS: continue
+        for symbol in list_items(self._collection):
+            if symbol == self.TRANSACTIONS or self.is_internal(symbol):
+                continue
             # otherwise assume to be a valid stock symbol
             stock = Stock(self._collection, symbol, self.__sqolru,
-                          update=update)
+                          journal=self._journal, update=update)
             self._stocks[symbol] = stock
             self._names[stock.name] = symbol
 
@@ -510,7 +2012,7 @@ class StocksAccount(Account):
         ''' Add a new stock to the account - must occur as a purchase. '''
         self._stocks[symbol] = Stock(self._collection, symbol, self.__sqolru,
                                      name, quantity, purchase_date, unit_cost,
-                                     brokerage, **metadata)
+                                     brokerage, self._journal, **metadata)
         self._names[name] = symbol
 
     def delete_stock(self, symbol):
@@ -519,18 +2021,88 @@ class StocksAccount(Account):
         symbol = stock.symbol
         self._stocks.pop(symbol)
         self._names.pop(stock.name)
-        self._collection.delete_item(symbol)
+        items = stock.get_bar_items(False) + [symbol]
+        if stock.FACTORS.format(symbol=symbol) in \
+                list_items(self._collection):
+            items.append(stock.FACTORS.format(symbol=symbol))
+        for item in items:
+            with lock_item(self._collection, item):
+                self._collection.delete_item(item)
+
+    def add_quantity(self, symbol, quantity, date, unit_cost, brokerage,
+                     lots=None):
+        ''' Make an additional purchase (or sale) of an existing stock by
+            name/symbol.
 
-    def add_quantity(self, symbol, quantity, date, unit_cost, brokerage):
-        ''' Make an additional purchase of an existing stock by name/symbol '''
+        '''
         return self.get_stock(symbol) \
-                   .add_quantity(quantity, date, unit_cost, brokerage)
+                   .add_quantity(quantity, date, unit_cost, brokerage, lots)
+
+    def get_realised_gains(self, by_year=True, start_month=None):
+        ''' Returns the realised gains of all stocks in this account.
+
+        If 'by_year' is True, returns the total gains in each financial year
+            (starting in 'start_month', default lots.FY_START), else each lot
+            disposal, with a symbol column.
+
+        self.get_realised_gains(*bool, *int) -> pd.DataFrame
+
+        '''
+        from lots import FY_START, LotMatcher, realised_by_year
+        realised = [stock.get_realised_gains().assign(symbol=symbol)
+                    for symbol, stock in self._stocks.items()]
+        realised = pd.concat(realised, ignore_index=True) if realised else \
+                   LotMatcher().get_realised().assign(symbol='')
+        if not by_year:
+            return realised
+        return realised_by_year(realised, start_month or FY_START)
+
+    def get_unrealised_gain(self):
+        ''' Returns the unrealised gain of the open lots of all stocks. '''
+        return sum(stock.get_unrealised_gain()
+                   for stock in self._stocks.values())
+
+    def project(self, years=30, paths=10000, **options):
+        ''' Returns a Monte Carlo projection of the value of the stocks in
+            this account over the next 'years' years.
+
+        'options' are as for projection.project.
+
+        self.project(*int, *int, **options) -> projection.Projection
+
+        '''
+        from projection import project
+        return project(self, years, paths, **options)
 
     def add_dividend(self, symbol, type_, amount, date, balance):
         ''' Add a dividend to an existing stock by name/symbol. '''
         return self.get_stock(symbol) \
                    .add_dividend(type_, amount, date, balance)
 
+    def add_data(self, new_data, item=None, reconcile=True):
+        ''' Add data to the current data-store, as for Account.add_data.
+
+        If 'item' is a stock symbol, that stock is reloaded with the new data.
+
+        self.add_data(pd.DataFrame, *None/str, *bool) -> None/pd.DataFrame
+
+        '''
+        divergences = super().add_data(new_data, item, reconcile)
+        if item in self._stocks:
+            self._stocks[item].reload()
+        return divergences
+
+    def overwrite_data(self, new_data, metadata=None, item=None):
+        ''' Overwrite the data, and optionally metadata of an item, as for
+            Account.overwrite_data.
+
+        If 'item' is a stock symbol, that stock is reloaded with the new data.
+
+        '''
+        super().overwrite_data(new_data, metadata, item)
+        if item in self._stocks:
+            self._stocks[item].reload()
+
     def get_stock(self, name):
         ''' get by symbol or name '''
         stock = self._stocks.get(name, None)
@@ -538,33 +2110,93 @@ class StocksAccount(Account):
             stock = self._stocks[self._names[name]]
         return stock
 
-    def get_profit(self, stored_balance=True, brokerage=True, relative=False):
-        ''' Returns the total profit of the stocks in this account. '''
+    @property
+    def fx(self):
+        ''' The exchange rates cached in this account's store, updated using
+            this account's api-key.
+
+        '''
+        if self._fx is None:
+            from fx import FXRates
+            self._fx = FXRates(self._store, self.__sqolru)
+        return self._fx
+
+    def get_profit(self, stored_balance=True, brokerage=True, relative=False,
+                   currency=None):
+        ''' Returns the total profit of the stocks in this account.
+
+        If 'currency' is specified, stock values are converted to it at the
+            latest rates, and costs at the rates on the date of each purchase.
+            Otherwise values are summed in their own currencies.
+
+        '''
+        if currency:
+            value = 0
+            cost = 0
+            for stock in self._stocks.values():
+                valuation = stock.valuation
+                value += self.fx.convert(pd.Series(
+                    [valuation.get_value(stored_balance)],
+                    index=pd.DatetimeIndex([valuation.date])),
+                    stock.currency, currency).iloc[0]
+                cost += self.fx.convert(stock.get_cost_history(brokerage),
+                                        stock.currency, currency).sum()
+            return value / cost - 1 if relative else value - cost
+
+        valuations = [stock.valuation for stock in self._stocks.values()]
         if not relative:
-            return sum([stock.get_profit(stored_balance, brokerage) for
-                        stock in self._stocks.values()])
+            return sum([valuation.get_profit(stored_balance, brokerage) for
+                        valuation in valuations])
         else:
             value = 0
             cost = 0
-            for stock in self._stocks.values():
-                value += stock.get_value(stored_balance)
-                cost += stock.get_cost(brokerage)
+            for valuation in valuations:
+                value += valuation.get_value(stored_balance)
+                cost += valuation.get_cost(brokerage)
             return value / cost - 1
 
+    def get_value_history(self, freq='D', currency=None):
+        ''' Returns the combined value of the stocks in this account at each
+            'freq' period, carrying prices forward over non-trading days.
+
+        If 'currency' is specified, the value of each stock is converted to it
+            at the rate of each date before summing.
+
+        self.get_value_history(*str, *str) -> pd.Series
+
+        '''
+        if not self._stocks:
+            return pd.Series(dtype=float, name=self.name)
+        values = pd.concat([stock.get_value_history() for stock in
+                            self._stocks.values()], axis=1)
+        if currency:
+            values = self.fx.convert(values, {symbol: stock.currency for
+                symbol, stock in self._stocks.items()}, currency)
+        return values.resample(freq).last().ffill().fillna(0) \
+                     .sum(axis=1).rename(self.name)
+
+    def get_worth_history(self, freq='D', currency=None):
+        ''' Returns the cash balance plus stock value of this account at each
+            'freq' period, optionally converted to 'currency'.
+
+        '''
+        worth = pd.concat([self.get_balance_history(freq, currency),
+                           self.get_value_history(freq, currency)], axis=1)
+        return worth.ffill().fillna(0).sum(axis=1).rename(self.name)
+
     def __str__(self):
         ''' '''
         sep = '\n  '
         return 'Stocks{}{sep}profit={} ({:.2f}%){sep}Stocks:\n{sep}'.format(
             super().__str__(), self.get_profit(),
             100*self.get_profit(relative=True), sep=sep) +\
-            '\n\n{sep}'.join('{}{}{!s}'.format(symbol, sep, stock) for \
-                             symbol, stock in self._stocks.items()) \
-                .format(sep=sep)
+            ('\n\n' + sep).join('{}{}{!s}'.format(symbol, sep, stock) for \
+                                  symbol, stock in self._stocks.items())
 
 
 if __name__ == '__main__':
-    pystore.set_path('./db')
-    store = pystore.store('accounts')
+    from storage import open_store
+    store = open_store('accounts', './db')
     savings = Account(store, 'savings')
     with open('API_KEY.txt') as magical_key:
         apikey = magical_key.readline()
@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+
+'''
+Group consolidation across users.
+
+Pystore.path
+-> users (stores) <- a group is a set of these
+    -> accounts (collections)
+        -> transactions/stocks (items)
+'''
+
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from general_finance import Account, StocksAccount
+from storage import list_items, open_store
+
+TOTAL = 'total'
+
+def open_account(store, name):
+    ''' Returns a read-only view of account 'name' in 'store', or None if the
+        collection isn't an account.
+
+    open_account(pystore.store, str) -> Account/StocksAccount/None
+
+    '''
+    items = list_items(store.collection(name))
+    if Account.TRANSACTIONS not in items:
+        return None # not an account
+    if {item for item in items if not Account.is_internal(item)} \
+            - {Account.TRANSACTIONS}:
+        # additional items are stocks
+        return StocksAccount(store, name, save=False, update=False)
+    return Account(store, name, save=False)
+
+def load_member(path, name, freq='D', currency=None, snapshot=False):
+    ''' Returns the worth of each account in user store 'name' over time.
+
+    If 'currency' is specified, worth is converted to it using the exchange
+        rates cached in the store.
+    If 'snapshot' is True, the store's exported snapshot (see
+        snapshot.export_snapshot) is memory-mapped instead.
+
+    Run in a worker process, so the store is opened from 'path' rather than
+        passed in. The store is opened read-only, so workers don't need to
+        import pystore, and stocks use their stored price data only.
+
+    load_member(str, str, *str, *str, *bool) -> pd.DataFrame
+
+    '''
+    if snapshot:
+        from snapshot import load_snapshot, snapshot_path
+        store = load_snapshot(snapshot_path(name, path))
+    else:
+        store = open_store(name, path, read_only=True)
+    worth = dict()
+    for account in store.list_collections():
+        account = open_account(store, account)
+        if account is not None:
+            worth[account.name] = account.get_worth_history(freq, currency)
+    return merge_history(worth)
+
+def merge_history(histories):
+    ''' Merges a dict of worth time series onto a common date index.
+
+    Worth carries forward between records, and is zero before an account's
+        first record.
+
+    merge_history(dict[str: pd.Series]) -> pd.DataFrame
+
+    '''
+    if not histories:
+        return pd.DataFrame()
+    return pd.concat(histories, axis=1).sort_index().ffill().fillna(0)
+
+
+class Group(object):
+    ''' A group of users, with consolidated worth tracking. '''
+    def __init__(self, members, path=None, freq='D', workers=None,
+                 currency=None, snapshot=False):
+        ''' Initialise a group of the user stores in 'members'.
+
+        'path' is the pystore path the member stores are in. If left as None,
+            uses the current pystore path.
+        'freq' is the resolution of the worth time series (pandas offset).
+        'workers' is the number of processes to load members with. If left as
+            None, uses one per CPU.
+        'currency' is the reporting currency. If left as None, worth is summed
+            in the currencies of each account.
+        'snapshot' is True to load members from their exported snapshots,
+            which the worker processes share through the page cache.
+
+        Constructor: Group(list[str], *str, *str, *int, *str, *bool)
+
+        '''
+        if path is None:
+            import pystore
+            path = pystore.get_path()
+        self.members = list(members)
+        self.path = str(path)
+        self.freq = freq
+        self.workers = workers
+        self.currency = currency
+        self.snapshot = snapshot
+        self._worth = None
+
+    def load(self):
+        ''' (Re)load all member stores, in parallel worker processes. '''
+        count = len(self.members)
+        with ProcessPoolExecutor(self.workers) as executor:
+            worth = executor.map(load_member, [self.path] * count,
+                                 self.members, [self.freq] * count,
+                                 [self.currency] * count,
+                                 [self.snapshot] * count)
+            self._worth = dict(zip(self.members, worth))
+
+    def get_member_worth(self, name):
+        ''' Returns the per-account worth of member 'name' over time. '''
+        if self._worth is None:
+            self.load()
+        return self._worth[name]
+
+    def get_net_worth(self, members=False):
+        ''' Returns the combined worth of the group over time.
+
+        If 'members' is True, also includes the total worth of each member as
+            a separate column.
+
+        self.get_net_worth(*bool) -> pd.DataFrame
+
+        '''
+        if self._worth is None:
+            self.load()
+        worth = merge_history({name: accounts.sum(axis=1) for
+                               name, accounts in self._worth.items()})
+        worth[TOTAL] = worth.sum(axis=1)
+        if not members:
+            return worth[[TOTAL]]
+        return worth
+
+    def match_transfers(self, member, window=3):
+        ''' Match transfers between the accounts of all members, and store
+            the links in the store of 'member'.
+
+        Returns the TransferMatcher, for excluding linked transfers (see
+            transfers.TransferMatcher).
+
+        self.match_transfers(str, *int) -> transfers.TransferMatcher
+
+        '''
+        from transfers import TransferMatcher
+        others = {name: open_store(name, self.path) for name in self.members
+                  if name != member}
+        matcher = TransferMatcher(open_store(member, self.path), window,
+                                  others)
+        matcher.update()
+        return matcher
+
+    def __str__(self):
+        ''' Returns a user-readable string of this Group. '''
+        worth = self.get_net_worth(members=True)
+        if worth.empty:
+            return 'Group({}):\n\tNo accounts tracked'.format(
+                ', '.join(self.members))
+        latest = worth.tail(1)
+        return 'Group({}):\n\tNet worth = ${:.2f} ({})\n\t{}'.format(
+            ', '.join(self.members), latest[TOTAL].iloc[0],
+            latest.index.date[0],
+            '\n\t'.join('{} = ${:.2f}'.format(name, latest[name].iloc[0])
+                        for name in self.members if name in latest))
+
+
+if __name__ == '__main__':
+    import pystore
+    pystore.set_path('./db')
+    group = Group(pystore.list_stores())
+    print(group)
@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+
+''' Tax-lot matching of stock sales to purchases, for realised and unrealised
+    gains.
+
+Open lots are kept in a heap ordered by the matching method, so matching n
+    trades is O(n log n). Matcher state is plain data, so it can be cached
+    (e.g. in stock metadata) and continued as new trades arrive, rather than
+    replaying the full trade history.
+'''
+
+import heapq
+import pandas as pd
+
+FIFO    = 'FIFO' # first in, first out
+LIFO    = 'LIFO' # last in, first out
+HIFO    = 'HIFO' # highest cost first
+METHODS = (FIFO, LIFO, HIFO)
+
+FY_START = 7 # first month of the financial year (July)
+LONG_TERM_DAYS = 365 # holding period for discounted capital gains
+
+def financial_year(dates, start_month=FY_START):
+    ''' Returns the financial year of each of 'dates', labelled by the
+        calendar year it ends in.
+
+    financial_year(pd.DatetimeIndex/pd.Series, *int) -> np.ndarray[int]
+
+    '''
+    dates = pd.DatetimeIndex(dates)
+    if start_month == 1:
+        return dates.year.values
+    return dates.year.values + (dates.month.values >= start_month)
+
+
+class LotMatcher(object):
+    ''' Matches disposals of a stock to its open lots. '''
+    # accessor strings for lots and disposals
+    ID        = 'id'
+    DATE      = 'date'
+    QUANTITY  = 'quantity'
+    UNIT_COST = 'unit_cost' # including acquisition brokerage
+    SOLD      = 'sold'      # disposal date
+    PROCEEDS  = 'proceeds'  # net of disposal brokerage
+    COST      = 'cost'
+    GAIN      = 'gain'
+    DAYS      = 'days'      # holding period
+
+    def __init__(self, method=FIFO, state=None):
+        ''' Create a matcher for the given 'method', optionally continuing
+            from a previous 'state' (from LotMatcher.state).
+
+        'method' is one of FIFO, LIFO or HIFO (highest cost first).
+
+        Constructor: LotMatcher(*str, *dict)
+
+        '''
+        if method not in METHODS:
+            raise Exception('Invalid lot matching method {!r} - should be one '
+                            'of {}'.format(method, METHODS))
+        self.method = method
+        state = state or dict()
+        self._next = state.get('next', 0)
+        self.last = state.get('last', '')
+        self.realised = list(state.get('realised', []))
+        self._lots = {lot[self.ID]: dict(lot) for lot in state.get('open', [])}
+        self._heap = [self._key(lot) for lot in self._lots.values()]
+        heapq.heapify(self._heap)
+        self.quantity = sum(lot[self.QUANTITY] for lot in self._lots.values())
+
+    def _key(self, lot):
+        ''' Returns the heap key of 'lot' - the smallest key is matched first. '''
+        if self.method == FIFO:
+            return (lot[self.ID],)
+        if self.method == LIFO:
+            return (-lot[self.ID],)
+        return (-lot[self.UNIT_COST], lot[self.ID])
+
+    def _id(self, key):
+        ''' Returns the lot id of heap 'key'. '''
+        return abs(key[-1])
+
+    def acquire(self, date, quantity, unit_cost, brokerage=0.0):
+        ''' Open a lot of 'quantity' units bought at 'unit_cost' on 'date'.
+
+        Acquisition 'brokerage' is included in the cost of the lot.
+
+        '''
+        date = str(date)
+        lot = {self.ID: self._next, self.DATE: date,
+               self.QUANTITY: float(quantity),
+               self.UNIT_COST: float(unit_cost) + float(brokerage) / quantity}
+        self._next += 1
+        self._lots[lot[self.ID]] = lot
+        self.quantity += lot[self.QUANTITY]
+        heapq.heappush(self._heap, self._key(lot))
+        self.last = max(self.last, date)
+
+    def dispose(self, date, quantity, unit_price, brokerage=0.0, lots=None):
+        ''' Match a sale of 'quantity' units at 'unit_price' on 'date' to
+            open lots, and record the realised gains.
+
+        'brokerage' is deducted from the proceeds, pro-rata to each lot.
+        'lots' optionally specifies the lots to sell, as a dict of
+            {acquisition date: quantity}. Any remaining quantity is matched
+            by the matching method.
+
+        Returns the disposals of each matched lot.
+
+        self.dispose(str, float, float, *float, *dict) -> list[dict]
+
+        '''
+        date = str(date)
+        quantity = float(quantity)
+        if quantity > self.quantity + 1e-9:
+            raise Exception('Sale of {} units on {} exceeds the {} held'
+                            .format(quantity, date, self.quantity))
+        proceeds = quantity * float(unit_price) - float(brokerage)
+        disposals = []
+
+        def match(lot, amount):
+            ''' Sell 'amount' units of 'lot'. '''
+            lot[self.QUANTITY] -= amount
+            self.quantity -= amount
+            if lot[self.QUANTITY] <= 1e-9:
+                del self._lots[lot[self.ID]] # left in the heap until popped
+            cost = amount * lot[self.UNIT_COST]
+            share = proceeds * amount / quantity
+            disposals.append({self.DATE: lot[self.DATE], self.SOLD: date,
+                              self.QUANTITY: amount, self.COST: cost,
+                              self.PROCEEDS: share, self.GAIN: share - cost,
+                              self.DAYS: (pd.Timestamp(date) -
+                                          pd.Timestamp(lot[self.DATE])).days})
+
+        remaining = quantity
+        for lot_date, amount in (lots or dict()).items():
+            # specific lots, oldest first for lots bought on the same date
+            for lot in sorted((lot for lot in self._lots.values()
+                               if lot[self.DATE] == str(lot_date)),
+                              key=lambda lot: lot[self.ID]):
+                amount_ = min(amount, lot[self.QUANTITY], remaining)
+                if amount_ <= 0:
+                    break
+                match(lot, amount_)
+                amount -= amount_
+                remaining -= amount_
+
+        while remaining > 1e-9:
+            lot = self._lots.get(self._id(self._heap[0]), None)
+            if lot is None or self._key(lot) != self._heap[0]:
+                heapq.heappop(self._heap) # sold (specifically) or stale
+                continue
+            amount = min(remaining, lot[self.QUANTITY])
+            match(lot, amount)
+            remaining -= amount
+            if lot[self.ID] not in self._lots:
+                heapq.heappop(self._heap)
+
+        self.realised.extend(disposals)
+        self.last = max(self.last, date)
+        return disposals
+
+    def process(self, trades):
+        ''' Process 'trades' in date order.
+
+        Each trade is a dict of date, quantity (negative for sales),
+            unit_cost (the sale price for sales), brokerage, and optionally
+            lots (for sales).
+
+        '''
+        for trade in sorted(trades, key=lambda trade: str(trade['date'])):
+            if trade['quantity'] >= 0:
+                self.acquire(trade['date'], trade['quantity'],
+                             trade['unit_cost'], trade.get('brokerage', 0.0))
+            else:
+                self.dispose(trade['date'], -trade['quantity'],
+                             trade['unit_cost'], trade.get('brokerage', 0.0),
+                             trade.get('lots', None))
+
+    def get_open_lots(self):
+        ''' Returns the open lots, in acquisition order. '''
+        lots = pd.DataFrame(sorted(self._lots.values(),
+                                   key=lambda lot: lot[self.ID]),
+                            columns=[self.ID, self.DATE, self.QUANTITY,
+                                     self.UNIT_COST])
+        lots[self.DATE] = pd.to_datetime(lots[self.DATE])
+        return lots.drop(columns=self.ID)
+
+    def get_realised(self):
+        ''' Returns the disposals of all matched sales, in sale order. '''
+        realised = pd.DataFrame(self.realised, columns=[
+            self.DATE, self.SOLD, self.QUANTITY, self.COST, self.PROCEEDS,
+            self.GAIN, self.DAYS])
+        for column in (self.DATE, self.SOLD):
+            realised[column] = pd.to_datetime(realised[column])
+        return realised
+
+    def state(self):
+        ''' Returns the (JSON-serialisable) state of this matcher. '''
+        return dict(method=self.method, next=self._next, last=self.last,
+                    open=sorted(self._lots.values(),
+                                key=lambda lot: lot[self.ID]),
+                    realised=self.realised)
+
+
+def realised_by_year(realised, start_month=FY_START):
+    ''' Returns the total realised gains of 'realised' disposals in each
+        financial year, split into short and long term gains.
+
+    realised_by_year(pd.DataFrame, *int) -> pd.DataFrame
+
+    '''
+    gain = realised[LotMatcher.GAIN]
+    long_term = realised[LotMatcher.DAYS] >= LONG_TERM_DAYS
+    summary = pd.DataFrame({
+        LotMatcher.PROCEEDS: realised[LotMatcher.PROCEEDS],
+        LotMatcher.COST: realised[LotMatcher.COST],
+        LotMatcher.GAIN: gain,
+        'short_term': gain.where(~long_term, 0.0),
+        'long_term': gain.where(long_term, 0.0),
+    })
+    years = pd.Index(financial_year(realised[LotMatcher.SOLD], start_month),
+                     name='financial_year')
+    return summary.groupby(years).sum()
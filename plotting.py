@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+
+''' Plotting helpers, with pre-aggregation for large histories. '''
+
+import numpy as np
+import pandas as pd
+
+def set_plot_labels(ax, title, ylabel=None, xticks=None):
+    ''' Sets the title, and optionally y label and x tick labels of ax. '''
+    ax.set_title(title)
+    if ylabel:
+        ax.set_ylabel(ylabel)
+    if xticks:
+        ax.set_xticks(range(len(xticks)))
+        ax.set_xticklabels(xticks)
+
+def stacked_column(data, ax, title='title', ylabel='Y', xticks=None,
+                   tags=None, relative=False, **kwargs):
+    ''' Creates an absolute or relative stacked column graph.
+
+    'data' is a 2D array of shape (columns, tags).
+
+    '''
+    data = np.asarray(data, dtype=float)
+    if relative:
+        data = data / data.sum(axis=1, keepdims=True)
+    indices = np.arange(len(data))
+    # bottom of each stack segment is the sum of the segments below it
+    bottoms = np.cumsum(data, axis=1) - data
+    plots = [ax.bar(indices, data[:,col], bottom=bottoms[:,col], **kwargs)
+             for col in range(data.shape[1])]
+
+    set_plot_labels(ax, title, ylabel, xticks)
+    if tags:
+        ax.legend((p[0] for p in plots), tags)
+
+def cumulative_line(data, ax, ylabel='Y', title='title', xticks=None,
+                    tags=None, precomputed=False, **kwargs):
+    ''' Creates a cumulative line graph for each tag. '''
+    indices = np.arange(len(data))
+    if not precomputed:
+        data = np.cumsum(data, axis=0)
+
+    ax.plot(indices, data, **kwargs)
+    set_plot_labels(ax, title, ylabel, xticks)
+    if tags:
+        ax.legend(tags)
+
+    return data
+
+def pie(data, labels, ax, title='title', autopct='%1.1f%%', **kwargs):
+    ''' Creates a pie chart of the given data. '''
+    ax.pie(data, labels=labels, autopct=autopct, **kwargs)
+    set_plot_labels(ax, title)
+
+def resample(data, freq, how='last'):
+    ''' Resamples time-indexed 'data' to 'freq' resolution.
+
+    'how' is the aggregation for each period (e.g. 'last' for balances,
+        'sum' for spending). Empty periods are forward filled for 'last'.
+
+    resample(pd.Series/pd.DataFrame, str, *str) -> pd.Series/pd.DataFrame
+
+    '''
+    data = data.resample(freq).agg(how)
+    if how == 'last':
+        data = data.ffill()
+    return data
+
+def lttb(x, y, threshold):
+    ''' Returns the indices of 'threshold' points of (x, y) chosen by the
+        Largest-Triangle-Three-Buckets algorithm.
+
+    LTTB keeps the first and last points, and from each bucket in between
+        selects the point making the largest triangle with the previously
+        selected point and the mean of the next bucket, preserving the
+        visual shape of the series.
+
+    lttb(np.array, np.array, int) -> np.array[int]
+
+    '''
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    length = len(x)
+    if threshold >= length or threshold < 3:
+        return np.arange(length)
+
+    # bucket boundaries for the points between the first and last
+    edges = np.linspace(1, length - 1, threshold - 1).astype(int)
+    # mean of each bucket, computed in one pass with cumulative sums
+    x_sum = np.concatenate(([0], np.cumsum(x)))
+    y_sum = np.concatenate(([0], np.cumsum(y)))
+    counts = np.append(edges[1:] - edges[:-1], 1)
+    ends = np.append(edges[1:], length)
+    x_mean = (x_sum[ends] - x_sum[edges]) / counts
+    y_mean = (y_sum[ends] - y_sum[edges]) / counts
+    x_mean[-1], y_mean[-1] = x[-1], y[-1]
+
+    selected = np.empty(threshold, dtype=int)
+    selected[0], selected[-1] = 0, length - 1
+    previous = 0
+    for bucket in range(threshold - 2):
+        start, end = edges[bucket], edges[bucket+1]
+        # twice the triangle area, for every candidate in the bucket at once
+        area = np.abs((x[previous] - x_mean[bucket+1])
+                      * (y[start:end] - y[previous])
+                      - (x[previous] - x[start:end])
+                      * (y_mean[bucket+1] - y[previous]))
+        previous = start + int(np.argmax(area))
+        selected[bucket+1] = previous
+    return selected
+
+def downsample(data, max_points):
+    ''' Downsamples time-indexed 'data' to at most 'max_points' with LTTB.
+
+    Each column of a DataFrame is downsampled separately, so a dict of
+        Series is returned.
+
+    downsample(pd.Series/pd.DataFrame, int) -> pd.Series/dict[pd.Series]
+
+    '''
+    if isinstance(data, pd.DataFrame):
+        return {column: downsample(data[column], max_points)
+                for column in data.columns}
+    data = data.dropna()
+    x = data.index.asi8 if isinstance(data.index, pd.DatetimeIndex) \
+        else data.index.values
+    return data.iloc[lttb(x, data.values, max_points)]
+
+def plot_series(data, ax, freq=None, max_points=None, how='last',
+                title='title', ylabel='Y', tags=None, **kwargs):
+    ''' Plots time-indexed 'data', pre-aggregated for interactive drawing.
+
+    'freq' resamples the data to the given resolution before drawing, using
+        the 'how' aggregation.
+    'max_points' optionally further limits the number of points drawn for
+        each line, using shape-preserving LTTB downsampling.
+
+    plot_series(pd.Series/pd.DataFrame, Axes, *str, *int, *str, *str, *str,
+                *list[str], **kwargs) -> None
+
+    '''
+    if freq:
+        data = resample(data, freq, how)
+    if isinstance(data, pd.Series):
+        data = data.to_frame()
+    for column in data.columns:
+        line = data[column]
+        if max_points:
+            line = downsample(line, max_points)
+        ax.plot(line.index, line.values, **kwargs)
+
+    set_plot_labels(ax, title, ylabel)
+    if tags:
+        ax.legend(tags)
@@ -0,0 +1,323 @@
+#!/usr/bin/env python3
+
+''' Monte Carlo projections of stock portfolios.
+
+Future returns are bootstrapped from the stored price history of each stock
+    (resampling whole periods, so correlations between stocks are kept), or
+    modelled as correlated geometric Brownian motion fitted to it.
+
+Paths are simulated as batched array operations over (paths, periods,
+    symbols), in chunks of paths sized to cap memory use. Holding values
+    compound in log space, and scheduled contributions are folded in with a
+    cumulative sum, so no step of the simulation loops over time.
+'''
+
+import numpy as np
+import pandas as pd
+
+BOOTSTRAP  = 'bootstrap'
+GBM        = 'gbm'
+METHODS    = (BOOTSTRAP, GBM)
+MAX_MEMORY = 2**26 # bytes of simulated returns per chunk of paths
+DTYPE      = 'float32' # of simulated returns and holding values
+
+# periods per year of each supported projection frequency
+PERIODS_PER_YEAR = {'D': 252, 'W': 52, 'M': 12, 'Q': 4, 'Y': 1}
+
+def get_returns(closes, freq='M'):
+    ''' Returns the log return of each column of 'closes' in each 'freq'
+        period, from the last close of each period.
+
+    get_returns(pd.DataFrame, *str) -> pd.DataFrame
+
+    '''
+    if freq == 'D':
+        closes = closes.groupby(closes.index.normalize()).last()
+    else:
+        closes = closes.groupby(closes.index.to_period(freq)).last()
+    return np.log(closes.astype(float)).diff().iloc[1:]
+
+def get_dividend_yield(stock, freq='M'):
+    ''' Returns the average dividend yield of 'stock' per 'freq' period.
+
+    Uses the stored dividends per share (see Stock.update_factors) if
+        available, else the dividends recorded for the stock relative to its
+        value at the time.
+
+    get_dividend_yield(Stock, *str) -> float
+
+    '''
+    close = stock.get_close_history()
+    if not len(close):
+        return 0.0
+    factors = stock.get_factors()
+    if len(factors):
+        dividends = factors[stock.DIVIDEND]
+        # factors cover the full listing, but yields are averaged over the
+        #   stored closes (and priced by the close before each ex-date)
+        dividends = dividends[(dividends.index > close.index[0]) &
+                              (dividends.index <= close.index[-1])]
+        # per-share dividends are in raw (unadjusted) prices
+        raw = stock._data[stock.CLOSE]
+        previous = raw.values[raw.index.searchsorted(dividends.index,
+                                                     side='left') - 1]
+        yields = dividends.values / previous
+    else:
+        dividends = stock.get_dividend_history()
+        if not dividends:
+            return 0.0
+        dates = pd.to_datetime([dividend.date for dividend in dividends])
+        value = stock.get_value_history()
+        value = value.reindex(value.index.union(dates)).ffill() \
+                     .reindex(dates).values
+        quantity = stock.get_quantity_history()
+        quantity = quantity.reindex(quantity.index.union(dates)).ffill() \
+                           .reindex(dates).values
+        # deposits are cash, reinvestments are in shares
+        yields = np.array([dividend.amount / value_ if dividend.type ==
+                           dividend.DEPOSIT else dividend.amount / quantity_
+                           for dividend, value_, quantity_ in
+                           zip(dividends, value, quantity)])
+        yields = yields[np.isfinite(yields)]
+    years = max((close.index[-1] - close.index[0]).days / 365.25, 1.0)
+    return float(yields.sum() / years / PERIODS_PER_YEAR[freq])
+
+def _sample_bootstrap(rng, returns, paths, periods, block):
+    ''' Returns (paths, periods, symbols) log returns, resampled in blocks of
+        'block' consecutive periods of the historical 'returns' array.
+
+    '''
+    history = len(returns)
+    block = min(block, history)
+    blocks = -(-periods // block) # ceiling division
+    starts = rng.integers(0, history - block + 1, size=(paths, blocks))
+    index = (starts[:, :, None] + np.arange(block)).reshape(paths, -1)
+    return returns[index[:, :periods]]
+
+def _sample_gbm(rng, mean, cholesky, paths, periods):
+    ''' Returns (paths, periods, symbols) normally distributed log returns
+        with the given 'mean' and covariance (as its 'cholesky' factor).
+
+    '''
+    normal = rng.standard_normal((paths * periods, len(mean)), dtype=DTYPE)
+    normal = normal @ cholesky.T
+    normal += mean
+    return normal.reshape(paths, periods, len(mean))
+
+def _cholesky(covariance):
+    ''' Returns a factor L of 'covariance' with L @ L.T = covariance, clipping
+        negative eigenvalues if it isn't positive definite (e.g. from
+        pairwise estimates over different histories).
+
+    '''
+    try:
+        return np.linalg.cholesky(covariance)
+    except np.linalg.LinAlgError:
+        values, vectors = np.linalg.eigh(covariance)
+        return vectors * np.sqrt(np.clip(values, 0, None))
+
+def simulate(returns, values, periods, paths=10000, method=BOOTSTRAP,
+             yields=None, contributions=0.0, allocation=None, reinvest=True,
+             block=1, seed=None, max_memory=MAX_MEMORY):
+    ''' Returns the total value of a portfolio at the start and end of each
+        of 'periods' periods, along each of 'paths' simulated paths.
+
+    'returns' is the historical log returns of each holding in each period
+        (e.g. from get_returns). Rows with missing returns are dropped for
+        bootstrapping, so resampled periods are common to all holdings.
+    'values' is the current value of each holding.
+    'method' is BOOTSTRAP (resampling 'block' consecutive periods at a time)
+        or GBM (correlated geometric Brownian motion, fitted to 'returns').
+    'yields' is the dividend yield of each holding per period. Dividends are
+        reinvested in the holding if 'reinvest', else accumulated as cash.
+    'contributions' is invested at the end of each period, either a constant
+        amount or one per period, split between holdings by 'allocation'
+        (default their current value weights).
+    'seed' seeds the random generator, for reproducible projections (given
+        the same 'max_memory', which sets the number of paths per chunk).
+
+    simulate(pd.DataFrame/np.ndarray, array[float], int, *int, *str,
+             *array[float], *float/array[float], *array[float], *bool, *int,
+             *int/np.random.Generator, *int) -> np.ndarray[float]
+
+    '''
+    if method not in METHODS:
+        raise Exception('Invalid projection method {!r} - should be one of {}'
+                        .format(method, METHODS))
+    returns = np.asarray(returns, dtype=float).reshape(len(returns), -1)
+    values = np.asarray(values, dtype=float).reshape(-1)
+    symbols = len(values)
+    if method == BOOTSTRAP:
+        returns = returns[~np.isnan(returns).any(axis=1)]
+        if not len(returns):
+            raise Exception('No common return history to bootstrap from')
+    else:
+        data = pd.DataFrame(returns)
+        mean = data.mean().fillna(0).values.astype(DTYPE)
+        cholesky = _cholesky(data.cov().fillna(0).values).astype(DTYPE)
+    returns = returns.astype(DTYPE)
+
+    yields = np.zeros(symbols) if yields is None else \
+             np.asarray(yields, dtype=float).reshape(-1)
+    if allocation is None:
+        total = values.sum()
+        allocation = values / total if total else \
+                     np.full(symbols, 1 / symbols)
+    allocation = np.asarray(allocation, dtype=float).reshape(-1)
+    allocation = allocation / allocation.sum()
+    contributions = np.broadcast_to(np.asarray(contributions, dtype=float),
+                                    (periods,))
+    # amount contributed to each holding at the end of each period
+    contributed = (contributions[:, None] * allocation).astype(DTYPE)
+    growth = (np.log1p(yields) if reinvest else np.zeros(symbols)) \
+             .astype(DTYPE)
+
+    rng = seed if isinstance(seed, np.random.Generator) else \
+          np.random.default_rng(seed)
+    row = max(1, periods * symbols * np.dtype(DTYPE).itemsize)
+    chunk = int(max(1, min(paths, max_memory // row)))
+    totals = np.empty((paths, periods + 1))
+    totals[:, 0] = values.sum()
+    for start in range(0, paths, chunk):
+        size = min(chunk, paths - start)
+        if method == BOOTSTRAP:
+            log_growth = _sample_bootstrap(rng, returns, size, periods, block)
+        else:
+            log_growth = _sample_gbm(rng, mean, cholesky, size, periods)
+        log_growth += growth
+        # value of each holding: V_t = G_t * (V_0 + sum_{s<=t} c_s / G_s),
+        #  for cumulative growth G_t
+        np.cumsum(log_growth, axis=1, out=log_growth)
+        cumulative = np.exp(log_growth, out=log_growth)
+        if contributed.any():
+            holdings = np.divide(contributed, cumulative)
+            np.cumsum(holdings, axis=1, out=holdings)
+            holdings += values.astype(DTYPE)
+            holdings *= cumulative
+        else:
+            holdings = cumulative
+            holdings *= values.astype(DTYPE)
+        total = holdings.sum(axis=2, dtype=float)
+        if not reinvest and yields.any():
+            # dividends are paid on the value at the end of each period
+            total += np.cumsum(holdings @ yields.astype(DTYPE), axis=1,
+                               dtype=float)
+        totals[start:start+size, 1:] = total
+    return totals
+
+
+class Projection(object):
+    ''' The simulated paths of a portfolio's value. '''
+    def __init__(self, dates, values):
+        ''' Store the simulated portfolio 'values' (paths x dates) at each of
+            'dates'.
+
+        Constructor: Projection(pd.DatetimeIndex, np.ndarray[float])
+
+        '''
+        self.dates = dates
+        self.values = values
+
+    @property
+    def paths(self):
+        ''' The number of simulated paths. '''
+        return len(self.values)
+
+    def get_quantiles(self, quantiles=(0.05, 0.25, 0.5, 0.75, 0.95)):
+        ''' Returns the 'quantiles' of the simulated value at each date.
+
+        self.get_quantiles(*tuple[float]) -> pd.DataFrame
+
+        '''
+        return pd.DataFrame(np.quantile(self.values, quantiles, axis=0).T,
+                            index=self.dates, columns=list(quantiles))
+
+    def get_final(self):
+        ''' Returns the simulated value at the end of each path. '''
+        return pd.Series(self.values[:, -1], name=self.dates[-1])
+
+    def get_probability(self, target):
+        ''' Returns the probability of the value reaching at least 'target'
+            at each date.
+
+        '''
+        return pd.Series((self.values >= target).mean(axis=0),
+                         index=self.dates)
+
+    def plot(self, quantiles=(0.05, 0.25, 0.5, 0.75, 0.95), ax=None):
+        ''' Plot the 'quantiles' of the simulated value over time. '''
+        import matplotlib.pyplot as plt
+        if ax is None:
+            ax = plt.gca()
+        self.get_quantiles(quantiles).plot(ax=ax)
+        return ax
+
+    def __str__(self):
+        ''' A string representation of this Projection. '''
+        final = self.get_quantiles((0.05, 0.5, 0.95)).iloc[-1]
+        return 'Projection of {} paths to {}: median {:.2f} (90% in ' \
+               '{:.2f} - {:.2f})'.format(self.paths,
+               self.dates[-1].strftime('%Y-%m-%d'), *final.values[[1, 0, 2]])
+
+
+def project(account, years=30, paths=10000, freq='M', method=BOOTSTRAP,
+            contributions=0.0, allocation=None, reinvest=True, block=1,
+            seed=None, currency=None, yields=None, max_memory=MAX_MEMORY):
+    ''' Returns a Projection of the value of the stocks of 'account' over
+        the next 'years' years.
+
+    Returns and dividend yields of each stock are estimated from its stored
+        history (in current shares, if the stock is adjusted), with 'freq'
+        periods (one of PERIODS_PER_YEAR).
+    'contributions', 'allocation' (a dict of weights by symbol), 'reinvest',
+        'block' and 'seed' are as for simulate.
+    If 'currency' is specified, current values are converted to it at the
+        latest rates (returns are in each stock's own currency).
+    'yields' optionally overrides the estimated dividend yields, as a dict of
+        yearly yields by symbol.
+
+    project(StocksAccount, *int, *int, *str, *str, *float/array[float],
+            *dict, *bool, *int, *int, *str, *dict, *int) -> Projection
+
+    '''
+    if freq not in PERIODS_PER_YEAR:
+        raise Exception('Invalid projection frequency {!r} - should be one of '
+                        '{}'.format(freq, tuple(PERIODS_PER_YEAR)))
+    stocks = {symbol: stock for symbol, stock in account._stocks.items()
+              if stock.valuation.quantity > 0}
+    if not stocks:
+        raise Exception('No stocks are held in {}'.format(account.name))
+    symbols = list(stocks)
+    closes = pd.concat([stocks[symbol].get_close_history().rename(symbol)
+                        for symbol in symbols], axis=1).sort_index()
+    returns = get_returns(closes, freq)
+
+    values = []
+    for symbol in symbols:
+        valuation = stocks[symbol].valuation
+        value = valuation.get_value()
+        if currency:
+            value = account.fx.convert(pd.Series(
+                [value], index=pd.DatetimeIndex([valuation.date])),
+                stocks[symbol].currency, currency).iloc[0]
+        values.append(value)
+
+    yields = yields or dict()
+    yields = [yields[symbol] / PERIODS_PER_YEAR[freq] if symbol in yields
+              else get_dividend_yield(stocks[symbol], freq)
+              for symbol in symbols]
+    if allocation is not None:
+        allocation = [allocation.get(symbol, 0.0) for symbol in symbols]
+
+    periods = int(round(years * PERIODS_PER_YEAR[freq]))
+    values = simulate(returns, values, periods, paths, method, yields,
+                      contributions, allocation, reinvest, block, seed,
+                      max_memory)
+    if freq == 'D':
+        dates = pd.bdate_range(closes.index[-1].normalize(),
+                               periods=periods + 1)
+    else:
+        dates = pd.period_range(closes.index[-1], periods=periods + 1,
+                                freq=freq).to_timestamp(how='end') \
+                                          .normalize()
+    return Projection(dates, values)
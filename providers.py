@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+
+''' Online data providers - only imported when data is fetched. '''
+
+import requests
+import numpy as np
+import pandas as pd
+from time import sleep
+url_query = lambda url, *a, **kw: requests.get('https://www.'+url, *a, **kw)
+
+def alpha_vantage(function, apikey, **params):
+    ''' Returns the time series of an AlphaVantage 'function' query.
+
+    Parameters are as defined by the AlphaVantage API. Columns are as
+        returned by the API (e.g. '4. close'), with string values, and the
+        index is of datetime64[ns] format, in the order returned.
+
+    If the API call limit has been reached, waits and retries on the next
+        minute. Raises an IOError for invalid queries.
+
+    alpha_vantage(str, str, **params) -> pd.DataFrame
+
+    '''
+    params.update(dict(function=function, apikey=apikey))
+
+    query_minute = np.datetime64('now').tolist().minute
+
+    # If extra functionality is needed, probably best to transfer to using
+    #   the open-source alpha_vantage library (pip-installable), but for
+    #   now that would just add excess overhead
+    with url_query('alphavantage.co/query?', params=params) as query:
+        data = query.json()
+        url  = query.url
+
+    # parse and format data
+    try:
+        data.pop('Meta Data')
+    except KeyError:
+        error = data.get('Error Message', None)
+        if error:
+            # add url to error message
+            error = error.replace('.', ' ({}).'.format(url), 1)
+            raise IOError(error)
+        else:
+            # too many calls for API plan (for free key, >5/min or >500)
+            print(data['Note'])
+            print('Auto-retrying on new minute.')
+            while np.datetime64('now').tolist().minute == query_minute:
+                sleep(1) # wait until next minute
+            return alpha_vantage(**params)
+
+    # only data item remaining, get it and create a DataFrame
+    data = pd.DataFrame(list(data.values())[0]).transpose()
+    data.index = data.index.astype('datetime64[ns]')
+    return data
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+
+''' Out-of-core queries across all the accounts in a store.
+
+Transactions are read lazily with dask, partition by partition, so filters,
+    group-bys and aggregations over a whole store only materialise their
+    results.
+'''
+
+import pandas as pd
+from general_finance import Account, Journal
+from storage import list_items
+
+ACCOUNT = 'account' # column of the account name in store-wide results
+PERIOD  = 'period'  # column of the period start in periodic summaries
+
+def list_accounts(store):
+    ''' Returns the names of the accounts (non-internal collections with
+        transactions) in 'store'.
+
+    '''
+    return [name for name in store.list_collections()
+            if not Account.is_internal(name) and Account.TRANSACTIONS in
+            list_items(store.collection(name))]
+
+def store_transactions(store, accounts=None, columns=None, filters=None):
+    ''' Returns a lazy dask DataFrame of the transactions of all 'accounts'
+        in 'store', with an account column of the account names.
+
+    'accounts' defaults to all accounts in the store.
+    'columns' and 'filters' are as for pyarrow parquet reads, and are applied
+        while reading each account.
+
+    store_transactions(pystore.store, *list[str], *list[str], *list[tuple])
+        -> dask.DataFrame
+
+    '''
+    import dask.dataframe as dd
+    if accounts is None:
+        accounts = list_accounts(store)
+    frames = [_transactions(store, name, columns, filters)
+              .assign(**{ACCOUNT: name}) for name in accounts]
+    return dd.concat(frames, interleave_partitions=True)
+
+def _transactions(store, name, columns=None, filters=None):
+    ''' Returns a lazy dask DataFrame of the transactions of account 'name'
+        in 'store', including any pending journal entries.
+
+    'columns' the account doesn't store are included as null.
+
+    '''
+    collection = store.collection(name)
+    if Journal.exists(collection):
+        data = Account(store, name, save=False, lazy=True) \
+               .get_transactions(True, filters=filters)
+    else:
+        data = collection.item(Account.TRANSACTIONS, filters=filters).data
+    if columns is None:
+        return data
+    # accounts may not have every column (e.g. if never categorised), so
+    #   only read those stored, and add the rest as null
+    return data[[column for column in columns if column in data.columns]] \
+               .assign(**{column: None for column in columns
+                          if column not in data.columns})[list(columns)]
+
+def _add_period(partition, freq):
+    ''' Adds the start of the 'freq' period of each row of 'partition'. '''
+    return partition.assign(**{PERIOD:
+        partition.index.to_period(freq).to_timestamp()})
+
+def summarise(store, freq='M', by=(ACCOUNT,), accounts=None, filters=None,
+              scheduler=None):
+    ''' Returns the credit and debit totals and transaction counts in each
+        'freq' period of the transactions in 'store', grouped by the 'by'
+        columns (e.g. account and/or category). Transactions without a
+        value of a 'by' column (e.g. uncategorised) are grouped as null.
+
+    Aggregation runs partition by partition (in parallel, with the dask
+        'scheduler'), so only the summary is held in memory.
+
+    summarise(pystore.store, *str, *tuple[str], *list[str], *list[tuple],
+              *str) -> pd.DataFrame
+
+    '''
+    by = list(by)
+    columns = [Account.CREDIT] + [column for column in by if
+                                  column != ACCOUNT]
+    data = store_transactions(store, accounts, columns, filters)
+    data = data.map_partitions(_add_period, freq)
+    data = data.assign(**{
+        Account.CREDITS: data[Account.CREDIT].clip(lower=0),
+        Account.DEBITS: -data[Account.CREDIT].clip(upper=0)})
+    summary = data.groupby([PERIOD] + by, dropna=False).agg({
+        Account.CREDITS: 'sum', Account.DEBITS: 'sum',
+        Account.CREDIT: 'count'})
+    summary = summary.compute(scheduler=scheduler)
+    return summary.rename(columns={Account.CREDIT: 'count'}).sort_index()
+
+def aggregate(store, by, agg, accounts=None, columns=None, filters=None,
+              scheduler=None):
+    ''' Returns the 'agg' aggregation of transactions in 'store', grouped by
+        the 'by' columns, computed out-of-core.
+
+    'agg' is as for pandas DataFrame.groupby(...).agg.
+
+    aggregate(pystore.store, list[str], dict/str, *list[str], *list[str],
+              *list[tuple], *str) -> pd.DataFrame
+
+    '''
+    data = store_transactions(store, accounts, columns, filters)
+    return data.groupby(list(by)).agg(agg).compute(scheduler=scheduler)
+
+def query_store(store, accounts=None, **conditions):
+    ''' Returns the transactions of all 'accounts' in 'store' matching the
+        'conditions', with an account column of the account names.
+
+    'conditions' are as for Account.query, and are pushed down into the read
+        of each account.
+
+    query_store(pystore.store, *list[str], **conditions) -> pd.DataFrame
+
+    '''
+    if accounts is None:
+        accounts = list_accounts(store)
+    results = [Account(store, name, save=False, lazy=True)
+               .query(**conditions).assign(**{ACCOUNT: name})
+               for name in accounts]
+    return pd.concat(results).sort_index(kind='stable') if results else \
+           pd.DataFrame()
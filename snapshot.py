@@ -0,0 +1,344 @@
+#!/usr/bin/env python3
+
+'''
+Memory-mapped Arrow snapshots of a store, for read-only analytic workers.
+
+A snapshot is a directory of Arrow IPC files:
+    transactions.arrow - the transactions of all accounts, with an account
+        column
+    prices.arrow - the price series of all stocks, with account and symbol
+        columns
+    lots.arrow - the purchases, sales and dividends of all stocks
+    items/<collection>/<item>.arrow - any other (internal) items
+Item metadata and the row range of each item are stored in the schema
+    metadata of its file.
+
+Snapshots are memory-mapped when loaded, so items are zero-copy slices of the
+    mapped files, and any number of worker processes share one page-cached
+    copy of the data. Pending journal entries of accounts are replayed into
+    the exported items.
+'''
+
+import os
+import json
+import shutil
+import pandas as pd
+import pyarrow as pa
+from general_finance import Account, Journal, Stock
+from storage import DEFAULT_PATH, ParquetCollection, ReadOnlyError, \
+                    list_items, lock_item
+
+SUFFIX       = '.arrow'
+TRANSACTIONS = 'transactions' + SUFFIX
+PRICES       = 'prices' + SUFFIX
+LOTS         = 'lots' + SUFFIX
+ITEMS        = 'items'
+KEY          = b'gold_finger' # schema metadata key
+INDEX        = '__index__'    # column of the index of each item
+ACCOUNT      = 'account'
+SYMBOL       = 'symbol'
+
+def snapshot_path(name, path=None):
+    ''' Returns the default snapshot directory of user store 'name' at
+        'path' (alongside the store).
+
+    '''
+    return os.path.join(os.path.expanduser(path or DEFAULT_PATH),
+                        name + SUFFIX)
+
+def _write_table(filename, data, metadata):
+    ''' Write 'data' to Arrow IPC file 'filename', with 'metadata' in its
+        schema.
+
+    '''
+    table = pa.Table.from_pandas(data, preserve_index=False)
+    schema_metadata = dict(table.schema.metadata or {})
+    schema_metadata[KEY] = json.dumps(metadata, default=str).encode()
+    table = table.replace_schema_metadata(schema_metadata)
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    with pa.OSFile(filename, 'wb') as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+
+def _read_table(filename):
+    ''' Returns the memory-mapped table in Arrow IPC file 'filename', and its
+        stored metadata.
+
+    '''
+    table = pa.ipc.open_file(pa.memory_map(filename)).read_all()
+    return table, json.loads(table.schema.metadata[KEY])
+
+def _entry(data, metadata, offset=0):
+    ''' Returns the snapshot metadata of an item with 'data' and 'metadata',
+        starting at row 'offset'.
+
+    '''
+    return dict(offset=offset, length=len(data), columns=list(data.columns),
+                dtypes={column: str(dtype) for column, dtype in
+                        data.dtypes.items()},
+                index=data.index.name, metadata=metadata)
+
+def _combine(items, *keys):
+    ''' Returns the 'items' concatenated into a single DataFrame, with a
+        column for each of 'keys', and the snapshot metadata of each item.
+
+    'items' is a list of (key values, data, metadata) for each item.
+
+    _combine(list[tuple], *str) -> pd.DataFrame, dict[str: dict]
+
+    '''
+    frames = []
+    entries = dict()
+    offset = 0
+    for values, data, metadata in items:
+        entries['/'.join(values)] = _entry(data, metadata, offset)
+        offset += len(data)
+        frames.append(data.rename_axis(INDEX).reset_index()
+                          .assign(**dict(zip(keys, values))))
+    if not frames:
+        return pd.DataFrame({key: pd.Series(dtype=str) for key in keys}), \
+               entries
+    return pd.concat(frames, ignore_index=True), entries
+
+def _lots(stocks):
+    ''' Returns the ledger of purchases, sales and dividends of 'stocks'.
+
+    'stocks' is a list of ((account, symbol), data, metadata) for each stock.
+
+    '''
+    lots = []
+    for (account, symbol), _, metadata in stocks:
+        for purchase in metadata.get(Stock.PURCHASES, []):
+            purchase = Stock.Purchase(**purchase)
+            lots.append(dict(account=account, symbol=symbol,
+                             date=purchase.date, type_='purchase' if
+                             purchase.quantity >= 0 else 'sale',
+                             quantity=purchase.quantity,
+                             unit_cost=purchase.unit_cost,
+                             brokerage=purchase.brokerage))
+        for dividend in metadata.get(Stock.DIVIDENDS, []):
+            dividend = Stock.Dividend(**dividend)
+            lots.append(dict(account=account, symbol=symbol,
+                             date=dividend.date, type_=dividend.type,
+                             quantity=dividend.amount if dividend.type ==
+                             dividend.REINVESTMENT else 0.0,
+                             amount=dividend.amount,
+                             balance=dividend.balance))
+    columns = [ACCOUNT, SYMBOL, 'date', 'type_', 'quantity', 'unit_cost',
+               'brokerage', 'amount', 'balance']
+    lots = pd.DataFrame(lots, columns=columns)
+    lots['date'] = pd.to_datetime(lots['date'])
+    return lots.sort_values('date', kind='stable', ignore_index=True)
+
+def export_snapshot(store, path):
+    ''' Export all the items of 'store' to a snapshot at directory 'path'.
+
+    The snapshot is written alongside, then swapped in, so loaded snapshots
+        remain valid while it is replaced.
+
+    export_snapshot(pystore.store/ParquetStore, str) -> None
+
+    '''
+    from groups import open_account
+    transactions, stocks, others = [], [], []
+    for name in store.list_collections():
+        collection = store.collection(name)
+        # include any pending journal entries of the account
+        account = open_account(store, name) if Journal.exists(collection) \
+                  else None
+        for item in sorted(list_items(collection)):
+            if account is not None and item == Account.TRANSACTIONS:
+                entry = ((name, item), account._data, account._metadata)
+            elif account is not None and item in getattr(account, '_stocks',
+                                                         ()):
+                stock = account._stocks[item]
+                entry = ((name, item), stock._data, stock._metadata)
+            else:
+                with lock_item(collection, item, shared=True):
+                    stored = collection.item(item)
+                    entry = ((name, item), stored.to_pandas(),
+                             stored.metadata)
+            if item == Account.TRANSACTIONS:
+                transactions.append(((name,), *entry[1:]))
+            elif not (Account.is_internal(name) or Account.is_internal(item)):
+                stocks.append(entry)
+            else:
+                others.append(entry)
+
+    temp = path.rstrip(os.sep) + '.tmp{}'.format(os.getpid())
+    data, entries = _combine(transactions, ACCOUNT)
+    _write_table(os.path.join(temp, TRANSACTIONS), data, entries)
+    data, entries = _combine(stocks, ACCOUNT, SYMBOL)
+    _write_table(os.path.join(temp, PRICES), data, entries)
+    _write_table(os.path.join(temp, LOTS), _lots(stocks), dict())
+    for (name, item), data, metadata in others:
+        _write_table(os.path.join(temp, ITEMS, name, item + SUFFIX),
+                     data.rename_axis(INDEX).reset_index(),
+                     {item: _entry(data, metadata)})
+
+    # mapped files stay readable after their directory is removed
+    if os.path.exists(path):
+        shutil.rmtree(path)
+    os.rename(temp, path)
+
+
+class SnapshotItem(object):
+    ''' A read-only item, as a zero-copy slice of a snapshot table. '''
+    def __init__(self, table, entry, filters=None, columns=None):
+        ''' Open the item described by snapshot 'entry' in 'table'.
+
+        'filters' and 'columns' are as for pyarrow parquet reads, and are
+            applied while reading.
+
+        '''
+        self._table = table
+        self._entry = entry
+        self.filters = filters
+        self.columns = columns
+        self.metadata = entry['metadata']
+
+    def to_arrow(self):
+        ''' Returns the data of this item as an Arrow table (zero-copy unless
+            filtered).
+
+        '''
+        index = self._entry['index'] or INDEX
+        columns = self._entry['columns'] if self.columns is None else \
+                  [column for column in self.columns if column != index]
+        table = self._table.slice(self._entry['offset'],
+                                  self._entry['length']) \
+                           .select([INDEX] + columns) \
+                           .rename_columns([index] + columns)
+        if self.filters:
+            import pyarrow.parquet as pq
+            table = table.filter(pq.filters_to_expression(self.filters))
+        return table
+
+    def to_pandas(self):
+        ''' Returns the data of this item as a pandas DataFrame. '''
+        index = self._entry['index']
+        data = self.to_arrow().to_pandas(split_blocks=True)
+        data = data.set_index(index or INDEX)
+        data.index.name = index
+        # restore dtypes without an Arrow equivalent (e.g. pandas strings)
+        return data.astype({column: dtype for column, dtype in
+                            self._entry['dtypes'].items() if column in data
+                            and str(data[column].dtype) != dtype})
+
+    @property
+    def data(self):
+        ''' A dask DataFrame of this item (imports dask). '''
+        import dask.dataframe as dd
+        return dd.from_pandas(self.to_pandas(), npartitions=1)
+
+
+class SnapshotCollection(object):
+    ''' A read-only collection of a snapshot. '''
+    read_only = True
+
+    def __init__(self, snapshot, collection):
+        ''' Open 'collection' of SnapshotStore 'snapshot'. '''
+        self._snapshot = snapshot
+        self.collection = collection
+
+    def list_items(self):
+        ''' Returns the set of item names in this collection. '''
+        return set(self._snapshot._items.get(self.collection, ()))
+
+    def item(self, item, snapshot=None, filters=None, columns=None):
+        ''' Returns the SnapshotItem 'item' of this collection. '''
+        if item not in self.list_items():
+            raise IOError("Item '{}/{}' doesn't exist".format(
+                self.collection, item))
+        table, entry = self._snapshot._item(self.collection, item)
+        return SnapshotItem(table, entry, filters, columns)
+
+    write = ParquetCollection.write
+    append = write
+    delete_item = write
+
+
+class SnapshotStore(object):
+    ''' A read-only store, memory-mapped from a snapshot. '''
+    def __init__(self, path):
+        ''' Load the snapshot at directory 'path'. '''
+        if not os.path.isdir(path):
+            raise IOError("Snapshot '{}' doesn't exist".format(path))
+        self.path = path
+        self._tables = dict() # loaded tables and entries, by filename
+        self._items = dict()  # filenames of items, by collection and item
+        for filename in (TRANSACTIONS, PRICES):
+            _, entries = self._load(filename)
+            for key in entries:
+                collection, item = (key.split('/', 1) + [None])[:2]
+                self._items.setdefault(collection, dict())[
+                    item or Account.TRANSACTIONS] = (filename, key)
+        items = os.path.join(path, ITEMS)
+        for collection in os.listdir(items) if os.path.isdir(items) else ():
+            for filename in os.listdir(os.path.join(items, collection)):
+                item = filename[:-len(SUFFIX)]
+                self._items.setdefault(collection, dict())[item] = \
+                    (os.path.join(ITEMS, collection, filename), item)
+
+    def _load(self, filename):
+        ''' Returns the (memory-mapped) table and entries of 'filename'. '''
+        if filename not in self._tables:
+            self._tables[filename] = _read_table(os.path.join(self.path,
+                                                              filename))
+        return self._tables[filename]
+
+    def _item(self, collection, item):
+        ''' Returns the table and entry of 'item' in 'collection'. '''
+        filename, key = self._items[collection][item]
+        table, entries = self._load(filename)
+        return table, entries[key]
+
+    def list_collections(self):
+        ''' Returns the collection names in this snapshot. '''
+        return list(self._items)
+
+    def collection(self, collection):
+        ''' Returns the SnapshotCollection 'collection' of this snapshot. '''
+        if collection not in self._items:
+            raise ReadOnlyError("Can't create collection '{}' in a snapshot"
+                                .format(collection))
+        return SnapshotCollection(self, collection)
+
+    def item(self, collection, item):
+        ''' Returns 'item' from 'collection', bypassing the collection. '''
+        return self.collection(collection).item(item)
+
+    def get_lots(self):
+        ''' Returns the purchases, sales and dividends of all stocks. '''
+        return self._load(LOTS)[0].to_pandas()
+
+    def get_transactions(self):
+        ''' Returns the transactions of all accounts, with an account column
+            of the account names.
+
+        '''
+        data = self._load(TRANSACTIONS)[0]
+        data = data.to_pandas(split_blocks=True).set_index(INDEX)
+        data.index.name = Account.DATE
+        return data
+
+
+def load_snapshot(path):
+    ''' Returns the SnapshotStore at directory 'path'. '''
+    return SnapshotStore(path)
+
+def load_accounts(path):
+    ''' Returns read-only Account/StocksAccount views of each account in the
+        snapshot at 'path', by name.
+
+    load_accounts(str) -> dict[str: Account]
+
+    '''
+    from groups import open_account
+    store = load_snapshot(path)
+    accounts = dict()
+    for name in store.list_collections():
+        account = open_account(store, name)
+        if account is not None:
+            accounts[name] = account
+    return accounts
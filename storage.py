@@ -0,0 +1,404 @@
+#!/usr/bin/env python3
+
+'''
+Store access, with a read-only path that avoids importing pystore (and dask),
+    and safe writes from concurrent processes.
+
+Pystore.path
+-> users (stores)
+    -> accounts (collections)
+        -> transactions/stocks (items) - directories of parquet parts
+'''
+
+import os
+import re
+import json
+import shutil
+from contextlib import nullcontext
+try:
+    import fcntl
+except ImportError: # Windows
+    fcntl = None
+    import msvcrt
+
+# metadata filenames used by different pystore versions
+METADATA_FILES = ('pystore_metadata.json', 'metadata.json')
+DEFAULT_PATH   = '~/pystore'
+VERSION        = '_version' # metadata key of the write count of an item
+LOCK_SUFFIX    = '.lock'
+NEW_PREFIX     = '__new_' # items being written, swapped in once complete
+OLD_PREFIX     = '__old_' # items being replaced, removed once swapped out
+
+def open_store(name, path=None, read_only=False):
+    ''' Returns the user store 'name' at 'path'.
+
+    If 'read_only' is True, returns a ParquetStore, which reads items directly
+        with pyarrow, without the import time of pystore and dask. Else imports
+        pystore and returns a full pystore store.
+
+    'path' defaults to the current pystore path (read_only=False), or the
+        default pystore path (read_only=True).
+
+    open_store(str, *str, *bool) -> pystore.store/ParquetStore
+
+    '''
+    if read_only:
+        return ParquetStore(name, path)
+    import pystore
+    if path:
+        pystore.set_path(path)
+    return pystore.store(name)
+
+def read_metadata(path):
+    ''' Returns the pystore metadata stored in directory 'path'. '''
+    for filename in METADATA_FILES:
+        filename = os.path.join(path, filename)
+        if os.path.exists(filename):
+            with open(filename) as metadata:
+                return json.load(metadata)
+    return dict()
+
+def write_metadata(path, metadata):
+    ''' Atomically replace the pystore metadata stored in directory 'path'. '''
+    filename = next((os.path.join(path, filename) for filename in
+                     METADATA_FILES if os.path.exists(os.path.join(
+                         path, filename))),
+                    os.path.join(path, METADATA_FILES[0]))
+    temp_path = filename + '.tmp'
+    with open(temp_path, 'w') as file:
+        json.dump(metadata, file, ensure_ascii=False)
+    os.replace(temp_path, filename)
+
+def subdirs(path):
+    ''' Returns the non-snapshot subdirectories of 'path'. '''
+    return [entry.name for entry in os.scandir(path)
+            if entry.is_dir() and entry.name != '_snapshots']
+
+def _part_number(filename):
+    ''' Natural sort key for parquet part files (part.2 before part.10). '''
+    return [int(text) if text.isdigit() else text for
+            text in re.split(r'(\d+)', filename)]
+
+
+class ReadOnlyError(IOError):
+    ''' Raised on attempting to modify a read-only store. '''
+    pass
+
+
+class WriteConflict(IOError):
+    ''' Raised on writing an item that another writer has changed since it
+        was read.
+
+    '''
+    pass
+
+
+class FileLock(object):
+    ''' An inter-process lock on a path, held with a lock file.
+
+    Exclusive locks are for writers, and 'shared' locks for readers (which
+        are exclusive where shared locks aren't supported).
+
+    Locks are reentrant within a process, so nested writes to the same item
+        don't deadlock (but aren't exclusive between threads). Nested locks
+        keep the mode of the outermost lock.
+
+    '''
+    _held = dict() # lock files held by this process: [file, depth]
+
+    def __init__(self, path, shared=False):
+        ''' Create a lock for 'path' (not yet acquired).
+
+        Constructor: FileLock(str, *bool)
+
+        '''
+        self.path = str(path) + LOCK_SUFFIX
+        self.shared = shared
+
+    def __enter__(self):
+        ''' Block until the lock is acquired. '''
+        held = self._held.get(self.path, None)
+        if held:
+            held[1] += 1
+            return self
+        lock_file = open(self.path, 'a+')
+        if fcntl:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_SH if self.shared
+                                            else fcntl.LOCK_EX)
+        else:
+            while True:
+                try:
+                    lock_file.seek(0)
+                    msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    pass # LK_LOCK gives up after 10 attempts - keep waiting
+        self._held[self.path] = [lock_file, 1]
+        return self
+
+    def __exit__(self, *exc_info):
+        ''' Release the lock (once all nested holds are released). '''
+        held = self._held[self.path]
+        held[1] -= 1
+        if held[1]:
+            return
+        lock_file = self._held.pop(self.path)[0]
+        if fcntl:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+        else:
+            lock_file.seek(0)
+            msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+        lock_file.close()
+
+
+def recover_item(path):
+    ''' Finish or undo a swap of the item in directory 'path' by write_item
+        that was interrupted (e.g. by a crash), removing any leftovers.
+
+    Hold the item's exclusive lock, so no swap is in progress.
+
+    '''
+    directory, item = os.path.split(path)
+    new = os.path.join(directory, NEW_PREFIX + item)
+    old = os.path.join(directory, OLD_PREFIX + item)
+    if not os.path.isdir(path):
+        if os.path.isdir(old) and os.path.isdir(new):
+            os.rename(new, path) # swapped out, but not yet swapped in
+        elif os.path.isdir(old):
+            os.rename(old, path)
+    for leftover in (new, old):
+        if os.path.isdir(leftover):
+            shutil.rmtree(leftover)
+
+
+class ItemLock(FileLock):
+    ''' An inter-process lock on a stored item, which recovers the item from
+        any interrupted write when first acquired.
+
+    '''
+    def __init__(self, path, shared=False):
+        ''' Create a lock for the item in directory 'path' (not yet
+            acquired).
+
+        Constructor: ItemLock(str, *bool)
+
+        '''
+        super().__init__(path, shared)
+        self.item_path = str(path)
+
+    def _interrupted(self):
+        ''' Returns True if a write of the item was interrupted. '''
+        directory, item = os.path.split(self.item_path)
+        return any(os.path.isdir(os.path.join(directory, prefix + item))
+                   for prefix in (NEW_PREFIX, OLD_PREFIX))
+
+    def __enter__(self):
+        ''' Block until the lock is acquired, then recover the item. '''
+        super().__enter__()
+        if self._held[self.path][1] == 1 and self._interrupted():
+            if self.shared:
+                # recovering writes, so needs the exclusive lock
+                super().__exit__()
+                with FileLock(self.item_path):
+                    recover_item(self.item_path)
+                super().__enter__()
+            else:
+                recover_item(self.item_path)
+        return self
+
+
+def item_path(collection, item):
+    ''' Returns the directory of 'item' in 'collection'. '''
+    return os.path.join(str(collection.datastore), collection.collection, item)
+
+def list_items(collection):
+    ''' Returns the set of item names in 'collection'.
+
+    Items being overwritten by write_item are briefly stored under a
+        prefixed name while they are swapped, so they are listed by their
+        item name throughout (read them with the item's shared lock held, to
+        wait for the swap to finish, or recover it if it was interrupted).
+
+    list_items(pystore.collection) -> set[str]
+
+    '''
+    if getattr(collection, 'datastore', None) is None:
+        return collection.list_items() # not stored in a directory
+    items = set()
+    for item in subdirs(os.path.join(str(collection.datastore),
+                                     collection.collection)):
+        for prefix in (NEW_PREFIX, OLD_PREFIX):
+            if item.startswith(prefix):
+                item = item[len(prefix):]
+                break
+        items.add(item)
+    return items
+
+def lock_item(collection, item, shared=False):
+    ''' Returns an (unacquired) lock on 'item' of 'collection'.
+
+    Hold an exclusive lock while reading and rewriting an item, so other
+        processes can't write the item in between, or a 'shared' lock while
+        reading it, so it isn't read mid-write. Acquiring the lock recovers
+        the item from any interrupted write (see recover_item).
+
+    Read-only collections can only be read, without locking.
+
+    lock_item(pystore.collection, str, *bool) -> FileLock
+
+    '''
+    if getattr(collection, 'read_only', False):
+        if shared:
+            return nullcontext()
+        raise ReadOnlyError("Can't lock '{}' in a read-only store"
+                            .format(item))
+    return ItemLock(item_path(collection, item), shared)
+
+def get_version(collection, item):
+    ''' Returns the stored version of 'item' of 'collection' (0 if it was
+        never written with write_item).
+
+    '''
+    return read_metadata(item_path(collection, item)).get(VERSION, 0)
+
+def write_item(collection, item, data, metadata=None, version=None,
+               append=False):
+    ''' Write 'data' to 'item' of 'collection', holding the item's lock.
+
+    If 'append' is True, 'data' is appended to the existing item (if any),
+        keeping its metadata and all its rows (pystore's append drops rows
+        whose index is already stored), else the item is overwritten with
+        'data' and 'metadata'.
+    If 'version' is specified, it is the stored version the written state
+        is based on, and WriteConflict is raised if the item has since been
+        written by another writer, instead of clobbering its changes.
+
+    Returns the new version of the item.
+
+    write_item(pystore.collection, str, pd.DataFrame, *dict, *int, *bool)
+        -> int
+
+    '''
+    if getattr(collection, 'read_only', False):
+        collection.write(item, data) # raises ReadOnlyError
+    path = item_path(collection, item)
+    with lock_item(collection, item):
+        current = read_metadata(path).get(VERSION, 0)
+        if version is not None and version != current:
+            raise WriteConflict("'{}' was changed by another writer (version"
+                                " {} is now {})".format(item, version,
+                                                        current))
+        if append and os.path.isdir(path):
+            import pandas as pd
+            data = pd.concat([collection.item(item).to_pandas(), data])
+            metadata = read_metadata(path)
+        metadata = dict(metadata or {})
+        metadata[VERSION] = current + 1
+        if not os.path.isdir(path):
+            collection.write(item, data, metadata=metadata)
+            return current + 1
+        # write alongside and swap in, so the item is never partially written
+        collection.write(NEW_PREFIX + item, data, metadata=metadata,
+                         overwrite=True)
+        old = item_path(collection, OLD_PREFIX + item)
+        os.rename(path, old)
+        os.rename(item_path(collection, NEW_PREFIX + item), path)
+        shutil.rmtree(old)
+    return current + 1
+
+
+class ParquetItem(object):
+    ''' A read-only pystore item, read directly from its parquet parts. '''
+    def __init__(self, path, filters=None, columns=None):
+        ''' Open the item stored in directory 'path'.
+
+        'filters' and 'columns' are as for pyarrow.parquet.read_table, and are
+            applied while reading.
+
+        '''
+        if not os.path.isdir(path):
+            raise IOError("Item '{}' doesn't exist".format(path))
+        self.path = path
+        self.filters = filters
+        self.columns = columns
+        self.metadata = read_metadata(path)
+
+    @property
+    def files(self):
+        ''' The parquet part files of this item, in order. '''
+        return [os.path.join(self.path, filename) for filename in
+                sorted(os.listdir(self.path), key=_part_number)
+                if filename.endswith('.parquet')]
+
+    @property
+    def data(self):
+        ''' A lazy dask DataFrame of this item (imports dask). '''
+        import dask.dataframe as dd
+        return dd.read_parquet(self.files, filters=self.filters,
+                               columns=self.columns)
+
+    def to_pandas(self):
+        ''' Returns the data of this item as a pandas DataFrame. '''
+        import pyarrow.parquet as pq
+        return pq.read_table(self.files, filters=self.filters,
+                             columns=self.columns).to_pandas()
+
+
+class ParquetCollection(object):
+    ''' A read-only pystore collection. '''
+    read_only = True
+
+    def __init__(self, collection, datastore):
+        ''' Open 'collection' in the 'datastore' directory. '''
+        self.collection = collection
+        self.datastore = datastore
+
+    def _item_path(self, item, as_string=False):
+        ''' Returns the directory of 'item'. '''
+        return os.path.join(self.datastore, self.collection, item)
+
+    def list_items(self):
+        ''' Returns the set of item names in this collection. '''
+        return set(subdirs(os.path.join(self.datastore, self.collection)))
+
+    def item(self, item, snapshot=None, filters=None, columns=None):
+        ''' Returns the ParquetItem 'item' of this collection. '''
+        if snapshot:
+            path = os.path.join(self.datastore, self.collection, '_snapshots',
+                                snapshot, item)
+        else:
+            path = self._item_path(item)
+        return ParquetItem(path, filters, columns)
+
+    def write(self, item, *args, **kwargs):
+        ''' Raises ReadOnlyError - read-only collections can't be modified. '''
+        raise ReadOnlyError("Can't write '{}' in a read-only store"
+                            .format(item))
+
+    append = write
+    delete_item = write
+
+
+class ParquetStore(object):
+    ''' A read-only pystore store, which doesn't require pystore or dask. '''
+    def __init__(self, name, path=None):
+        ''' Open the user store 'name' at 'path'. '''
+        path = os.path.expanduser(path or DEFAULT_PATH)
+        self.datastore = os.path.join(path, name)
+        if not os.path.isdir(self.datastore):
+            raise IOError("Store '{}' doesn't exist".format(self.datastore))
+
+    def list_collections(self):
+        ''' Returns the collection names in this store. '''
+        return subdirs(self.datastore)
+
+    def collection(self, collection):
+        ''' Returns the ParquetCollection 'collection' of this store. '''
+        if collection not in self.list_collections():
+            raise ReadOnlyError("Can't create collection '{}' in a read-only"
+                                " store".format(collection))
+        return ParquetCollection(collection, self.datastore)
+
+    def item(self, collection, item):
+        ''' Returns 'item' from 'collection', bypassing the collection. '''
+        return self.collection(collection).item(item)
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+
+from testrun.TestRun import TestRun
+import sys
+sys.path.append('..')
+import pandas as pd
+from categories import Categoriser
+
+class CategoriserTests(TestRun):
+    ''' A test-suite for the Categoriser class. '''
+    def __init__(self):
+        ''' Create the test suite with relevant variables. '''
+        super().__init__()
+        self.rules = [
+            {'category': 'transfer', 'contains': 'TRANSFER'},
+            {'category': 'big groceries', 'contains': 'WOOLWORTHS',
+             'max_amount': -100},
+            {'category': 'groceries', 'contains': ['WOOLWORTHS', 'COLES']},
+            {'category': 'transport', 'regex': r'MYKI|OPAL\s+\d+'},
+            {'category': 'refund', 'min_amount': 0},
+        ]
+        self.descriptions = pd.Series(['TRANSFER TO WOOLWORTHS',
+            'Woolworths 123', 'WOOLWORTHS 123', 'opal 42', 'CLIMB GYM',
+            'CLIMB GYM'])
+        self.amounts = pd.Series([-50.0, -20.0, -150.0, -5.0, -15.0, 10.0])
+
+    def label_test(self, categoriser, expected, descriptions=None,
+                   amounts=None):
+        ''' Test the labels of the test transactions match 'expected'. '''
+        if descriptions is None:
+            descriptions, amounts = self.descriptions, self.amounts
+        labels = list(categoriser.label(descriptions, amounts))
+        assert labels == expected, \
+                'Labels {} do not match {}'.format(labels, expected)
+
+    def test_rule_order(self):
+        ''' Test each transaction gets the first matching rule's category.
+        '''
+        self.label_test(Categoriser(self.rules, default='other'),
+                        ['transfer', 'groceries', 'big groceries',
+                         'transport', 'other', 'refund'])
+
+    def test_amount_fall_through(self):
+        ''' Test transactions failing a rule's amount conditions continue to
+            the following rules, and never match without amounts.
+
+        '''
+        categoriser = Categoriser(self.rules, default='other')
+        self.label_test(categoriser, ['groceries', 'other'],
+                        pd.Series(['WOOLWORTHS 1', 'CLIMB GYM']))
+        self.label_test(categoriser, ['groceries', 'big groceries'],
+                        pd.Series(['WOOLWORTHS 1', 'WOOLWORTHS 1']),
+                        pd.Series([-99.99, -100.0]))
+
+    def test_case_sensitive(self):
+        ''' Test case sensitive text conditions. '''
+        self.label_test(Categoriser(self.rules, default='other',
+                                    case_sensitive=True),
+                        ['transfer', 'other', 'big groceries', 'other',
+                         'other', 'refund'])
+
+    def test_cache(self):
+        ''' Test each unique description is only matched once. '''
+        categoriser = Categoriser(self.rules)
+        categoriser.label(self.descriptions, self.amounts)
+        cached = dict(categoriser._cache)
+        assert len(cached) == 5, cached
+        assert list(cached['TRANSFER TO WOOLWORTHS']) == [0, 1, 2], cached
+        assert list(cached['CLIMB GYM']) == [], cached
+        categoriser.label(self.descriptions.iloc[::-1], self.amounts[::-1])
+        assert all(categoriser._cache[text] is rules for text, rules in
+                   cached.items()), categoriser._cache
+
+    def test_large(self):
+        ''' Test hundreds of substring rules over many unique descriptions.
+        '''
+        rules = [{'category': str(index), 'contains': 'shop{} '.format(index)}
+                 for index in range(300)]
+        descriptions = pd.Series(['SHOP{} #{}'.format(index % 400, index)
+                                  for index in range(20000)])
+        labels = Categoriser(rules, default='other').label(descriptions)
+        expected = [str(index % 400) if index % 400 < 300 else 'other'
+                    for index in range(20000)]
+        assert list(labels) == expected, labels
+
+    def test_inline_flags(self):
+        ''' Test inline global flags only apply to their rule's regex. '''
+        categoriser = Categoriser([{'category': 'gym', 'regex': '(?i)climb'},
+                                   {'category': 'coffee', 'regex': 'Cafe'}],
+                                  case_sensitive=True)
+        self.label_test(categoriser, ['gym', '', 'coffee'],
+                        pd.Series(['Climb gym', 'CAFE', 'Cafe']))
+
+    def test_groups(self):
+        ''' Test rules can reuse group names and use backreferences. '''
+        categoriser = Categoriser([
+            {'category': 'repeat', 'regex': r'(?P<word>\w+) (?P=word)'},
+            {'category': 'numbered', 'regex': r'(?P<word>\d+)'},
+            {'category': 'pair', 'regex': r'(\w)\1'}])
+        self.label_test(categoriser, ['repeat', 'numbered', 'pair', ''],
+                        pd.Series(['the the', 'order 12', 'coffee', 'tea']))
+
+    def test_invalid_regex(self):
+        ''' Test an invalid regex raises an Exception naming its rule. '''
+        try:
+            Categoriser([{'category': 'broken', 'regex': 'a(?i)b'}])
+        except Exception as e:
+            assert 'broken' in str(e), e
+            return
+        raise AssertionError('Invalid regex was accepted')
+
+
+if __name__ == '__main__':
+    categoriser_tests = CategoriserTests()
+    categoriser_tests.run_tests()
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+
+from testrun.TestRun import TestRun
+import sys
+sys.path.append('..')
+import tempfile
+import numpy as np
+import pandas as pd
+import pystore
+from general_finance import Account
+from categories import Categoriser
+
+class IndexTests(TestRun):
+    ''' A test-suite for the description index and indexed queries. '''
+    def __init__(self):
+        ''' Create the test suite with relevant variables. '''
+        super().__init__()
+        self.data = self.transactions('2020-01-01', 200)
+        self.categoriser = Categoriser([
+            {'category': 'groceries', 'contains': ['WOOLWORTHS', 'COLES']},
+            {'category': 'transport', 'contains': 'MYKI'}], default='other')
+
+    @staticmethod
+    def transactions(start, count, seed=0):
+        ''' Returns 'count' transactions every 2 days from 'start'. '''
+        rng = np.random.default_rng(seed)
+        credit = rng.normal(0, 50, count).round(2)
+        return pd.DataFrame(
+            {'credit': credit, 'balance': 1000 + credit.cumsum(),
+             'description': rng.choice(['WOOLWORTHS 123 MELB', 'MYKI TOPUP',
+                                        'PAY', 'Coles Express', None],
+                                       count)},
+            index=pd.date_range(start, periods=count, freq='2D',
+                                name='date'))
+
+    def account(self, categorise=True):
+        ''' Returns a new account of the test transactions. '''
+        pystore.set_path(tempfile.mkdtemp())
+        account = Account(pystore.store('test'), 'savings', 1,
+                          self.data.copy())
+        if categorise:
+            account.categorise(self.categoriser)
+        return account
+
+    def index_test(self, account):
+        ''' Test the stored index of 'account' matches a full rebuild. '''
+        account = Account(account._store, account.name, save=False)
+        pd.testing.assert_frame_equal(account.get_index(),
+                                      account._index(account._data),
+                                      check_dtype=False)
+
+    def query_test(self, account, expected, **conditions):
+        ''' Test the query of 'account' with 'conditions' matches the rows of
+            its transactions where 'expected' is True.
+
+        '''
+        matched = account.query(**conditions)
+        expected = account._data[expected]
+        pd.testing.assert_frame_equal(matched, expected, check_freq=False,
+                                      check_dtype=False)
+
+    def test_index_updates(self):
+        ''' Test the index is maintained through append, prepend and
+            overwrite.
+
+        '''
+        account = self.account()
+        last = account._data.index[-1]
+        added = self.transactions(last + pd.Timedelta(days=1), 30, seed=1)
+        account.add_data(added.drop(columns='balance'))
+        self.index_test(account)
+        account.prepend_data(self.transactions('2019-10-01', 40, seed=2))
+        self.index_test(account)
+        account.overwrite_data(self.transactions('2021-01-01', 50, seed=3))
+        self.index_test(account)
+
+    def test_query(self):
+        ''' Test pushed down conditions match filtering in memory. '''
+        account = self.account()
+        data = account._data
+        descriptions = data['description'].fillna('')
+        dates, credit = data.index, data['credit']
+        self.query_test(account, (dates >= '2020-03-01') &
+                        (dates <= '2020-06-30'),
+                        start='2020-03-01', end='2020-06-30')
+        self.query_test(account, ((credit >= -10) & (credit <= 20)).values,
+                        min_amount=-10, max_amount=20)
+        self.query_test(account, descriptions.str.contains('ORTHS 12')
+                        .values, contains='orths 12')
+        self.query_test(account, descriptions.str.contains('Coles').values,
+                        contains='Coles', case=True)
+        self.query_test(account, (descriptions.str.contains('MYKI') &
+                                  (dates >= '2020-05-01')).values,
+                        contains='myki', start='2020-05-01')
+        self.query_test(account, (data['category'] == 'groceries').values,
+                        category='groceries')
+        self.query_test(account, np.zeros(len(data), dtype=bool),
+                        contains='aldi')
+
+    def test_months(self):
+        ''' Test text queries only read the months that can match. '''
+        account = self.account()
+        account.add_data(pd.DataFrame(
+            {'credit': [-3.0], 'description': ['ALDI 42']},
+            index=pd.DatetimeIndex([account._data.index[-1] +
+                                    pd.Timedelta(days=40)], name='date')))
+        months = account._token_months('aldi')
+        assert months == [account._data.index[-1].to_period('M')
+                          .to_timestamp()], months
+        assert list(account.query(contains='aldi')['credit']) == [-3.0]
+
+    def test_uncategorised(self):
+        ''' Test category queries of uncategorised accounts match nothing.
+        '''
+        account = self.account(categorise=False)
+        assert not len(account.query(category='groceries'))
+
+
+if __name__ == '__main__':
+    index_tests = IndexTests()
+    index_tests.run_tests()
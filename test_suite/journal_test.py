@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+
+from testrun.TestRun import TestRun
+import sys
+sys.path.append('..')
+import tempfile
+import pandas as pd
+import numpy as np
+import pystore
+from general_finance import Account, StocksAccount
+from storage import open_store
+
+class JournalTests(TestRun):
+    ''' A test-suite for journalled accounts. '''
+    def __init__(self):
+        ''' Create the test suite with relevant variables. '''
+        super().__init__()
+        self.data = self.transactions(['2020-01-05', '2020-02-05'],
+                                      [100.0, -20.0], ['PAY', 'WOOLWORTHS'])
+        self.data['balance'] = self.data['credit'].cumsum()
+        self.added = [
+            self.transactions(['2020-03-05'], [-5.0], ['COLES 1']),
+            self.transactions(['2020-04-05', '2020-05-05'], [7.0, 3.0],
+                              ['GIFT', 'INTEREST'])]
+
+    @staticmethod
+    def transactions(dates, credits, descriptions):
+        ''' Returns a DataFrame of transactions. '''
+        return pd.DataFrame({'credit': credits, 'description': descriptions},
+                            index=pd.DatetimeIndex(dates, name='date'))
+
+    def store(self):
+        ''' Returns a new store with a 'savings' account of the test data,
+            with the added transactions journalled.
+
+        '''
+        pystore.set_path(tempfile.mkdtemp())
+        store = pystore.store('test')
+        Account(store, 'savings', 1, self.data)
+        account = Account(store, 'savings', journal=True)
+        for data in self.added:
+            account.add_data(data)
+        return store
+
+    def test_reopen(self):
+        ''' Test reopening a journalled account compacts the journal into
+            the rollups and description index.
+
+        '''
+        store = self.store()
+        account = Account(store, 'savings', journal=True)
+        rollup = account.get_rollup('M')
+        assert len(rollup) == 5, rollup
+        assert rollup['debits'].iloc[2] == 5, rollup
+        assert rollup['balance'].iloc[-1] == 85, rollup
+        for account in (Account(store, 'savings'),
+                        Account(store, 'savings', journal=True)):
+            matched = account.query(contains='coles')
+            assert list(matched['credit']) == [-5.0], matched
+
+    def test_compact(self):
+        ''' Test compaction matches the transactions as journalled. '''
+        store = self.store()
+        account = Account(store, 'savings', save=False, journal=True)
+        expected = account._data.copy()
+        assert len(expected) == 5, expected
+        account.compact()
+        stored = store.collection('savings').item('transactions') \
+                      .to_pandas()
+        pd.testing.assert_frame_equal(stored, expected, check_freq=False,
+                                      check_dtype=False)
+        assert list(account.get_rollup('M')['balance']) == \
+                [100, 80, 75, 82, 85]
+
+    def test_replay(self):
+        ''' Test pending entries are replayed by accounts opened without
+            journalling, including from read-only stores.
+
+        '''
+        store = self.store()
+        read_only = open_store('test', pystore.get_path(), read_only=True)
+        for store in (store, read_only):
+            account = Account(store, 'savings', save=False)
+            assert len(account._data) == 5, account._data
+            matched = account.query(contains='coles')
+            assert list(matched['credit']) == [-5.0], matched
+        assert list(account.get_rollup('M')['balance']) == \
+                [100, 80, 75, 82, 85]
+
+    def test_replay_stocks(self):
+        ''' Test journalled stock purchases are replayed without journalling.
+        '''
+        store = self.store()
+        Account(store, 'shares', 2, self.data)
+        store.collection('shares').write('ASX:TEST', pd.DataFrame(
+            {'Daily Close': np.linspace(10, 15, 100)},
+            index=pd.date_range('2020-01-01', periods=100, freq='B')),
+            metadata={'purchases': [dict(quantity=10, date='2020-01-02',
+                                         unit_cost=10, brokerage=10)],
+                      'dividends': [], 'total_brokerage': 10,
+                      'owned_quantity': 10, 'name': 'Test'})
+        shares = StocksAccount(store, 'shares', save=False, journal=True)
+        shares.get_stock('ASX:TEST').add_quantity(5, '2020-03-02', 11, 10)
+        read_only = open_store('test', pystore.get_path(), read_only=True)
+        for store in (store, read_only):
+            stock = StocksAccount(store, 'shares', save=False) \
+                    .get_stock('ASX:TEST')
+            assert stock._metadata[stock.QUANTITY] == 15, stock._metadata
+
+
+if __name__ == '__main__':
+    journal_tests = JournalTests()
+    journal_tests.run_tests()
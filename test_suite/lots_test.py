@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+
+from testrun.TestRun import TestRun
+import sys
+sys.path.append('..')
+import json
+from lots import LotMatcher, FIFO, LIFO, HIFO, realised_by_year
+
+class LotMatcherTests(TestRun):
+    ''' A test-suite for the LotMatcher class. '''
+    def __init__(self):
+        ''' Create the test suite with relevant variables. '''
+        super().__init__()
+        # (date, quantity, unit cost) of each purchase
+        self.purchases = [('2020-01-10', 10, 1.0), ('2020-02-10', 10, 3.0),
+                          ('2020-03-10', 10, 2.0)]
+
+    def matcher(self, method):
+        ''' Returns a matcher of 'method' with the test purchases. '''
+        matcher = LotMatcher(method)
+        for date, quantity, unit_cost in self.purchases:
+            matcher.acquire(date, quantity, unit_cost)
+        return matcher
+
+    def cost_test(self, method, expected, lots=None):
+        ''' Test the cost of selling 15 units with 'method'. '''
+        disposals = self.matcher(method).dispose('2020-04-01', 15, 4.0,
+                                                 lots=lots)
+        cost = sum(disposal[LotMatcher.COST] for disposal in disposals)
+        proceeds = sum(disposal[LotMatcher.PROCEEDS] for disposal in disposals)
+        assert abs(cost - expected) < 1e-9, \
+                '{} cost {} does not match {}'.format(method, cost, expected)
+        assert abs(proceeds - 60) < 1e-9, \
+                '{} proceeds {} does not match 60'.format(method, proceeds)
+
+    def test_fifo(self):
+        ''' Test sales are matched to the oldest lots first. '''
+        self.cost_test(FIFO, 10 * 1.0 + 5 * 3.0)
+
+    def test_lifo(self):
+        ''' Test sales are matched to the newest lots first. '''
+        self.cost_test(LIFO, 10 * 2.0 + 5 * 3.0)
+
+    def test_hifo(self):
+        ''' Test sales are matched to the highest cost lots first. '''
+        self.cost_test(HIFO, 10 * 3.0 + 5 * 2.0)
+
+    def test_specific_lots(self):
+        ''' Test specified lots are sold first, then the method's lots. '''
+        self.cost_test(LIFO, 5 * 1.0 + 10 * 2.0, lots={'2020-01-10': 5})
+
+    def test_brokerage(self):
+        ''' Test brokerage is included in costs and deducted from proceeds.
+        '''
+        matcher = LotMatcher()
+        matcher.acquire('2020-01-10', 10, 1.0, brokerage=10)
+        disposal, = matcher.dispose('2020-04-01', 10, 4.0, brokerage=5)
+        assert disposal[LotMatcher.COST] == 20, disposal
+        assert disposal[LotMatcher.PROCEEDS] == 35, disposal
+
+    def test_oversell(self):
+        ''' Test selling more than the open quantity raises an Exception. '''
+        matcher = self.matcher(FIFO)
+        try:
+            matcher.dispose('2020-04-01', 31, 4.0)
+        except Exception:
+            return
+        raise AssertionError('Sale exceeding the held quantity succeeded')
+
+    def test_resume(self):
+        ''' Test matching resumed from a saved state matches a full replay.
+        '''
+        trades = [dict(date=date, quantity=quantity, unit_cost=unit_cost)
+                  for date, quantity, unit_cost in self.purchases]
+        trades += [dict(date='2020-04-01', quantity=-15, unit_cost=4.0),
+                   dict(date='2020-05-01', quantity=10, unit_cost=0.5),
+                   dict(date='2020-06-01', quantity=-12, unit_cost=5.0)]
+        for method in (FIFO, LIFO, HIFO):
+            full = LotMatcher(method)
+            full.process(trades)
+            partial = LotMatcher(method)
+            partial.process(trades[:4])
+            # state is stored as JSON in stock metadata
+            state = json.loads(json.dumps(partial.state()))
+            resumed = LotMatcher(method, state)
+            resumed.process(trades[4:])
+            assert resumed.state() == full.state(), \
+                    '{} resumed state does not match'.format(method)
+            assert resumed.quantity == full.quantity == 13
+
+    def test_realised_by_year(self):
+        ''' Test gains are totalled by financial year, and split by term. '''
+        matcher = self.matcher(FIFO)
+        matcher.dispose('2020-06-30', 5, 2.0) # FY2020, short term
+        matcher.dispose('2021-02-01', 10, 2.0) # FY2021, long and short term
+        summary = realised_by_year(matcher.get_realised())
+        assert list(summary.index) == [2020, 2021], summary
+        assert summary.loc[2020, 'gain'] == 5, summary
+        assert summary.loc[2021, 'long_term'] == 5, summary
+        assert summary.loc[2021, 'short_term'] == -5, summary
+
+
+if __name__ == '__main__':
+    lot_tests = LotMatcherTests()
+    lot_tests.run_tests()
@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+
+from testrun.TestRun import TestRun
+import sys
+sys.path.append('..')
+import tempfile
+import pandas as pd
+import pystore
+from general_finance import Account
+from categories import Categoriser
+from queries import summarise
+from storage import open_store
+
+class QueryTests(TestRun):
+    ''' A test-suite for store-wide queries. '''
+    def __init__(self):
+        ''' Create the test suite with relevant variables. '''
+        super().__init__()
+        self.data = pd.DataFrame(
+            {'credit': [100.0, -20.0, -5.0], 'balance': [100.0, 80.0, 75.0],
+             'description': ['PAY', 'WOOLWORTHS', 'MYKI']},
+            index=pd.DatetimeIndex(['2020-01-05', '2020-02-05',
+                                    '2020-02-07'], name='date'))
+
+    def store(self):
+        ''' Returns a new store with a categorised 'savings' account, and an
+            uncategorised 'credit' account.
+
+        '''
+        pystore.set_path(tempfile.mkdtemp())
+        store = pystore.store('test')
+        Account(store, 'savings', 1, self.data.copy()).categorise(
+            Categoriser([{'category': 'groceries', 'contains': 'WOOL'}]))
+        Account(store, 'credit', 2, self.data.copy())
+        return store
+
+    def test_summarise_categories(self):
+        ''' Test summarising by category includes uncategorised accounts. '''
+        store = self.store()
+        for store in (store, open_store('test', pystore.get_path(),
+                                        read_only=True)):
+            summary = summarise(store, by=('account', 'category'))
+            totals = summary.groupby(level='account')['debits'].sum()
+            assert totals.to_dict() == {'credit': 25, 'savings': 25}, summary
+            groceries = summary.xs('groceries', level='category')
+            assert groceries['debits'].sum() == 20, summary
+
+
+if __name__ == '__main__':
+    query_tests = QueryTests()
+    query_tests.run_tests()
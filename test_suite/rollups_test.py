@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+
+from testrun.TestRun import TestRun
+import sys
+sys.path.append('..')
+import tempfile
+import numpy as np
+import pandas as pd
+import pystore
+from general_finance import Account
+from categories import Categoriser
+
+class RollupTests(TestRun):
+    ''' A test-suite for the rollups maintained by accounts. '''
+    def __init__(self):
+        ''' Create the test suite with relevant variables. '''
+        super().__init__()
+        self.data = self.transactions('2020-03-01', 60)
+        self.categoriser = Categoriser([
+            {'category': 'groceries', 'contains': 'WOOLWORTHS'},
+            {'category': 'income', 'min_amount': 0}], default='other')
+
+    @staticmethod
+    def transactions(start, count, seed=0):
+        ''' Returns 'count' transactions every 3 days from 'start'. '''
+        rng = np.random.default_rng(seed)
+        credit = rng.normal(0, 50, count).round(2)
+        return pd.DataFrame(
+            {'credit': credit, 'balance': 1000 + credit.cumsum(),
+             'description': rng.choice(['WOOLWORTHS 1', 'MYKI', 'PAY'],
+                                       count)},
+            index=pd.date_range(start, periods=count, freq='3D', name='date'))
+
+    def account(self):
+        ''' Returns a new categorised account of the test transactions. '''
+        pystore.set_path(tempfile.mkdtemp())
+        account = Account(pystore.store('test'), 'savings', 1,
+                          self.data.copy())
+        account.categorise(self.categoriser)
+        return account
+
+    def categorised(self, data):
+        ''' Returns 'data' with categories from the test categoriser. '''
+        return data.assign(category=self.categoriser.label(
+            data['description'], data['credit']))
+
+    def rollup_test(self, account):
+        ''' Test the stored rollups of 'account' match a full rebuild. '''
+        account = Account(account._store, account.name, save=False)
+        for freq in Account.ROLLUPS:
+            for by_category in (False, True):
+                stored = account.get_rollup(freq, by_category)
+                rebuilt = account._rollup(account._data, freq, by_category)
+                pd.testing.assert_frame_equal(stored, rebuilt,
+                                              check_freq=False,
+                                              check_dtype=False)
+
+    def test_append(self):
+        ''' Test rollups after appending, within and after the last period.
+        '''
+        account = self.account()
+        last = account._data.index[-1]
+        data = self.transactions(last, 20, seed=1)
+        data.index += pd.Timedelta(days=1)
+        account.add_data(self.categorised(data), reconcile=False)
+        self.rollup_test(account)
+
+    def test_prepend(self):
+        ''' Test rollups after prepending, ending within the first week. '''
+        account = self.account()
+        data = self.transactions('2020-01-02', 20, seed=2)
+        account.prepend_data(self.categorised(data))
+        self.rollup_test(account)
+
+    def test_overwrite(self):
+        ''' Test rollups after overwriting with different transactions. '''
+        account = self.account()
+        account.overwrite_data(self.categorised(
+            self.transactions('2021-06-01', 30, seed=3)))
+        self.rollup_test(account)
+
+    def test_empty(self):
+        ''' Test adding no transactions leaves the account unchanged. '''
+        account = self.account()
+        version = account._metadata['_version']
+        for data in (self.data.iloc[:0], self.data[['credit']].iloc[:0]):
+            assert account.add_data(data) is None
+            account.prepend_data(data)
+        assert account._metadata['_version'] == version, account._metadata
+        self.rollup_test(account)
+
+
+if __name__ == '__main__':
+    rollup_tests = RollupTests()
+    rollup_tests.run_tests()
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+
+from testrun.TestRun import TestRun
+import sys
+sys.path.append('..')
+import os
+import shutil
+import tempfile
+import pandas as pd
+import pystore
+from general_finance import Account
+from storage import NEW_PREFIX, OLD_PREFIX, WriteConflict, get_version, \
+                    item_path, list_items, lock_item, write_item
+
+class StorageTests(TestRun):
+    ''' A test-suite for concurrent and crash-safe writes. '''
+    def __init__(self):
+        ''' Create the test suite with relevant variables. '''
+        super().__init__()
+        self.data = pd.DataFrame(
+            {'credit': [100.0, -20.0], 'balance': [100.0, 80.0],
+             'description': ['PAY', 'WOOLWORTHS']},
+            index=pd.DatetimeIndex(['2020-01-05', '2020-02-05'], name='date'))
+        self.new = pd.DataFrame(
+            {'credit': [-5.0], 'balance': [75.0], 'description': ['MYKI']},
+            index=pd.DatetimeIndex(['2020-03-05'], name='date'))
+
+    def collection(self):
+        ''' Returns a new collection with an item 'x' of the test data. '''
+        pystore.set_path(tempfile.mkdtemp())
+        collection = pystore.store('test').collection('test')
+        write_item(collection, 'x', self.data)
+        return collection
+
+    def test_version(self):
+        ''' Test writes based on an outdated version raise WriteConflict. '''
+        collection = self.collection()
+        version = get_version(collection, 'x')
+        assert write_item(collection, 'x', self.new, version=version) == \
+                version + 1
+        try:
+            write_item(collection, 'x', self.data, version=version)
+        except WriteConflict:
+            return
+        raise AssertionError('Outdated write succeeded')
+
+    def test_account_conflict(self):
+        ''' Test saving an account changed by another writer raises
+            WriteConflict, but adding data keeps both writers' changes.
+
+        '''
+        pystore.set_path(tempfile.mkdtemp())
+        store = pystore.store('test')
+        Account(store, 'savings', 1, self.data)
+        first = Account(store, 'savings', save=False)
+        second = Account(store, 'savings', save=False)
+        new = self.new.drop(columns='balance')
+        first.add_data(new)
+        second.add_data(new) # balance from the first writer's data
+        balance = Account(store, 'savings', save=False)._data['balance']
+        assert list(balance) == [100, 80, 75, 70], balance
+        first._metadata['note'] = 'changed'
+        second.save()
+        try:
+            first.save()
+        except WriteConflict:
+            return
+        raise AssertionError('Conflicting save succeeded')
+
+    def interrupt_test(self, collection, expected, shared=False):
+        ''' Test the interrupted write of item 'x' of 'collection' is
+            recovered to 'expected' on locking it.
+
+        '''
+        assert list_items(collection) == {'x'}, list_items(collection)
+        with lock_item(collection, 'x', shared):
+            data = collection.item('x').to_pandas()
+        pd.testing.assert_frame_equal(data, expected, check_freq=False,
+                                      check_dtype=False)
+        directory = os.path.dirname(item_path(collection, 'x'))
+        assert not [name for name in os.listdir(directory) if
+                    name.startswith((NEW_PREFIX, OLD_PREFIX))], \
+                os.listdir(directory)
+
+    def test_interrupted_swap(self):
+        ''' Test a write interrupted between swapping the old item out and
+            the new one in is completed.
+
+        '''
+        collection = self.collection()
+        collection.write(NEW_PREFIX + 'x', self.new)
+        os.rename(item_path(collection, 'x'),
+                  item_path(collection, OLD_PREFIX + 'x'))
+        self.interrupt_test(collection, self.new, shared=True)
+
+    def test_interrupted_write(self):
+        ''' Test a write interrupted before or after the swap keeps the item.
+        '''
+        collection = self.collection()
+        os.makedirs(item_path(collection, NEW_PREFIX + 'x')) # partial
+        self.interrupt_test(collection, self.data)
+        collection = self.collection()
+        shutil.copytree(item_path(collection, 'x'),
+                        item_path(collection, OLD_PREFIX + 'x'))
+        self.interrupt_test(collection, self.data, shared=True)
+
+    def test_interrupted_old(self):
+        ''' Test an item only left as the old item is restored. '''
+        collection = self.collection()
+        os.rename(item_path(collection, 'x'),
+                  item_path(collection, OLD_PREFIX + 'x'))
+        write_item(collection, 'x', self.new, append=True)
+        self.interrupt_test(collection, pd.concat([self.data, self.new]))
+
+
+if __name__ == '__main__':
+    storage_tests = StorageTests()
+    storage_tests.run_tests()
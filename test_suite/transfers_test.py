@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+
+from testrun.TestRun import TestRun
+import sys
+sys.path.append('..')
+import pandas as pd
+from transfers import TransferMatcher, _keys
+
+class TransferMatcherTests(TestRun):
+    ''' A test-suite for matching transfers with the TransferMatcher. '''
+    def match(self, transactions, window=3):
+        ''' Returns the links between 'transactions', a list of (date,
+            account, credit).
+
+        '''
+        matcher = TransferMatcher.__new__(TransferMatcher)
+        matcher.window = window
+        dates, accounts, credits = zip(*transactions)
+        data = pd.DataFrame({'account': accounts, 'credit': credits},
+                            index=pd.DatetimeIndex(dates, name='date'))
+        return matcher.match(_keys(data, 'account', 'credit'))
+
+    def test_closest(self):
+        ''' Test debits link to the closest credit, preferring credits on or
+            after the debit.
+
+        '''
+        links = self.match([('2020-01-01', 'a', 10.0),
+                            ('2020-01-02', 'b', -10.0),
+                            ('2020-01-03', 'a', 10.0),
+                            ('2020-01-03', 'c', -10.0)])
+        assert list(links[TransferMatcher.TO_DATE].dt.day) == [1, 3], links
+        links = self.match([('2020-01-01', 'b', -10.0),
+                            ('2020-01-06', 'a', 10.0)])
+        assert not len(links), links
+
+    def test_same_account(self):
+        ''' Test debits and credits within one account aren't linked. '''
+        links = self.match([('2020-01-01', 'a', -10.0),
+                            ('2020-01-01', 'a', 10.0),
+                            ('2020-01-01', 'b', 10.0),
+                            ('2020-01-01', 'b', -10.0)])
+        assert sorted(zip(links[TransferMatcher.FROM],
+                          links[TransferMatcher.TO])) == \
+                [('a', 'b'), ('b', 'a')], links
+
+    def test_repeated(self):
+        ''' Test repeated amounts on a day are linked once each, in order. '''
+        count = 1000
+        links = self.match([('2020-01-01', 'a', -5.0),
+                            ('2020-01-01', 'b', 5.0)] * count)
+        assert len(links) == count, links
+        assert (links[TransferMatcher.FROM_N] ==
+                links[TransferMatcher.TO_N]).all(), links
+
+
+if __name__ == '__main__':
+    transfer_tests = TransferMatcherTests()
+    transfer_tests.run_tests()
@@ -10,59 +10,9 @@ from matplotlib.figure import Figure
 
 import numpy as np
 
-def set_plot_labels(ax, title, ylabel=None, xticks=None):
-    '''
-    if ax is plt:
-        ax.title(title)
-        if ylabel:
-            ax.ylabel(ylabel)
-        if xticks:
-            ax.xticks(range(len(xticks)), xticks)
-    else:
-    '''
-    ax.set_title(title)
-    if ylabel:
-        ax.set_ylabel(ylabel)
-    if xticks:
-        ax.set_xticklabels(xticks)
-
-def stacked_column(data, ax, title='title', ylabel='Y', xticks=None,
-                   tags=None, relative=False, **kwargs):
-    ''' Creates an absolute or relative stacked column graph. '''
-    if relative:
-        data = data / np.sum([data], axis=2).T
-    indices = np.arange(len(data))
-    plots = []
-    plots.append(ax.bar(indices, data[:,0], **kwargs))
-    for col in range(1, len(data[0])):
-        plots.append(ax.bar(indices, data[:,col],
-                            bottom=data[:,:col].sum(axis=1), **kwargs))
-
-    set_plot_labels(ax, title, ylabel, xticks)
-    if tags:
-        ax.legend((p[0] for p in plots), tags)
-
-def cumulative_line(data, ax, ylabel='Y', title='title', xticks=None,
-                    tags=None, precomputed=False, **kwargs):
-    ''' Creates a cumulative line graph for each tag. '''
-    indices = np.arange(len(data))
-    if not precomputed:
-        data = data.copy()
-        for timestep in range(1, len(data)):
-            data[timestep] += data[timestep-1]
-
-    ax.plot(indices, data)
-    set_plot_labels(ax, title, ylabel, xticks)
-    if tags:
-        ax.legend(tags)
-
-    return data
-
-def pie(data, labels, ax, title='title', autopct='%1.1f%%', **kwargs):
-    ''' Creates a pie chart of the given data. '''
-    ax.pie(data, labels=tags, autopct=autopct)
-    set_plot_labels(ax, title)
-
+import sys
+sys.path.append('..')
+from plotting import stacked_column, cumulative_line, pie
 
 if __name__ == '__main__':
     # generate data
@@ -0,0 +1,277 @@
+#!/usr/bin/env python3
+
+''' Detection of transfers between accounts.
+
+Accounts store one-sided credits, so a transfer between two tracked accounts
+    appears as a debit in one and a matching credit in the other, and is
+    double-counted in spending. Transfers are found by joining debits to
+    credits of the same amount at each date lag within the matching window,
+    with repeated amounts on a day joined by their order, so matching is a
+    sort/hash join rather than a comparison of every pair of transactions.
+
+A stored transaction is identified by its account, date, amount, and its
+    occurrence among transactions of that date and amount in the account.
+'''
+
+import numpy as np
+import pandas as pd
+from general_finance import Account
+from storage import list_items, lock_item, write_item
+
+SEPARATOR = '/' # between member and account names of other group members
+
+def _keys(data, account, credit=Account.CREDIT):
+    ''' Returns the identifying keys of the transactions in 'data' of the
+        'account' column, as a DataFrame of account, date, cents and
+        occurrence columns.
+
+    '''
+    keys = pd.DataFrame({
+        'account': data[account].values,
+        'date': pd.DatetimeIndex(data.index).normalize(),
+        'cents': np.round(data[credit].values.astype(float) * 100)
+                   .astype('int64')})
+    keys['occurrence'] = keys.groupby(['account', 'date', 'cents']).cumcount()
+    return keys
+
+
+class TransferMatcher(object):
+    ''' Matches transfers between the accounts of a store (and optionally of
+        other group members' stores), persisting the links in the internal
+        '_transfers' collection of the store.
+
+    Matching is incremental - only unlinked transactions from the window
+        before the earliest of the last processed dates of each account are
+        matched, so appends don't rematch the full history. Backdated
+        transactions before then are only matched by a full update.
+
+    '''
+    COLLECTION = '_transfers'
+    LINKS      = 'links'
+    # accessor strings of links (indexed by the date of the debit)
+    FROM       = 'from'
+    TO         = 'to'
+    TO_DATE    = 'to_date'
+    AMOUNT     = 'amount'
+    FROM_N     = 'from_occurrence'
+    TO_N       = 'to_occurrence'
+    PROCESSED  = 'processed' # metadata of the last date matched per account
+    WINDOW     = 'window'
+
+    def __init__(self, store, window=3, members=None):
+        ''' Match transfers between the accounts of 'store'.
+
+        'window' is the maximum number of days between a debit and its
+            matching credit.
+        'members' is an optional dict of {member name: store} of other group
+            members, whose accounts are also matched, and are named
+            'member/account' in the links.
+
+        Constructor: TransferMatcher(pystore.store, *int, *dict)
+
+        '''
+        self._store = store
+        self.window = int(window)
+        self._stores = {None: store}
+        self._stores.update(members or dict())
+        try:
+            self._collection = store.collection(self.COLLECTION)
+        except IOError:
+            self._collection = None # read-only store without stored links
+
+    def _accounts(self):
+        ''' Returns the (name, store, account) of each account to match. '''
+        from queries import list_accounts
+        return [(account if member is None else
+                 member + SEPARATOR + account, store, account)
+                for member, store in self._stores.items()
+                for account in list_accounts(store)]
+
+    def _stored(self):
+        ''' Returns the stored links and their metadata. '''
+        if self._collection is not None and \
+                self.LINKS in list_items(self._collection):
+            item = self._collection.item(self.LINKS)
+            return item.to_pandas(), dict(item.metadata)
+        links = pd.DataFrame({
+            self.FROM: pd.Series(dtype=str), self.TO: pd.Series(dtype=str),
+            self.TO_DATE: pd.Series(dtype='datetime64[ns]'),
+            self.AMOUNT: pd.Series(dtype=float),
+            self.FROM_N: pd.Series(dtype='int64'),
+            self.TO_N: pd.Series(dtype='int64')},
+            index=pd.DatetimeIndex([], name=Account.DATE))
+        return links, dict()
+
+    def get_links(self):
+        ''' Returns the stored transfer links, indexed by the date of each
+            debit, with the accounts it was from and to, the date it was
+            received, and its amount.
+
+        self.get_links() -> pd.DataFrame
+
+        '''
+        return self._stored()[0]
+
+    def _linked(self, links):
+        ''' Returns the keys of the transactions on both sides of 'links'. '''
+        cents = np.round(links[self.AMOUNT].values * 100).astype('int64')
+        return pd.concat([
+            pd.DataFrame({'account': links[self.FROM].values,
+                          'date': links.index.values, 'cents': -cents,
+                          'occurrence': links[self.FROM_N].values}),
+            pd.DataFrame({'account': links[self.TO].values,
+                          'date': links[self.TO_DATE].values, 'cents': cents,
+                          'occurrence': links[self.TO_N].values})],
+            ignore_index=True)
+
+    def match(self, rows):
+        ''' Returns the links between debits and credits in 'rows' (keys as
+            from _keys) of the same amount, in different accounts, at most
+            'window' days apart.
+
+        Each transaction is linked at most once, preferring the closest dates
+            (and credits on or after the debit), then the earliest rows.
+
+        self.match(pd.DataFrame) -> pd.DataFrame
+
+        '''
+        rows = rows.assign(id=np.arange(len(rows)),
+                           day=rows['date'].values.astype('datetime64[D]')
+                                                  .astype('int64'))
+        debits = rows[rows['cents'] < 0].assign(cents=lambda d: -d['cents'])
+        credits = rows[rows['cents'] > 0]
+
+        # link the debits and credits each lag apart, from the closest
+        matched = []
+        for lag in sorted(range(-self.window, self.window + 1),
+                          key=lambda lag: (abs(lag), lag < 0)):
+            pairs = self._pair(debits.assign(day=debits['day'] + lag),
+                               credits)
+            matched.append(pairs)
+            debits = debits[~debits['id'].isin(pairs['id_from'])]
+            credits = credits[~credits['id'].isin(pairs['id_to'])]
+        matched = pd.concat(matched)
+        return pd.DataFrame({
+            self.FROM: matched['account_from'].values,
+            self.TO: matched['account_to'].values,
+            self.TO_DATE: matched['date_to'].values,
+            self.AMOUNT: matched['cents'].values / 100,
+            self.FROM_N: matched['occurrence_from'].values,
+            self.TO_N: matched['occurrence_to'].values},
+            index=pd.DatetimeIndex(matched['date_from'].values,
+                                   name=Account.DATE)).sort_index()
+
+    @staticmethod
+    def _pair(debits, credits):
+        ''' Returns the links between 'debits' and 'credits' of the same
+            cents and day (debit days already shifted by the lag), in
+            different accounts.
+
+        The n-th debit of each cents and day is joined to the n-th credit, so
+            transactions of repeated amounts are paired in one pass rather
+            than compared pairwise. Pairs within one account are rejected,
+            and their amounts and days re-paired with the credits rotated.
+
+        '''
+        keys = ['cents', 'day']
+        matched = []
+        offset = 0
+        while True:
+            rank = credits.groupby(keys).cumcount()
+            if offset:
+                rank = (rank + offset) % credits.groupby(keys)['id'] \
+                                                .transform('size')
+            pairs = debits.assign(rank=debits.groupby(keys).cumcount()) \
+                          .merge(credits.assign(rank=rank),
+                                 on=keys + ['rank'],
+                                 suffixes=('_from', '_to'))
+            same = pairs['account_from'].values == pairs['account_to'].values
+            matched.append(pairs[~same])
+            if not same.any():
+                break
+            # re-pair the remaining transactions of days with rejected pairs,
+            #  while they have different accounts to pair with
+            retry = pairs.loc[same, keys].drop_duplicates()
+            debits = debits[~debits['id'].isin(pairs['id_from'][~same])] \
+                           .merge(retry, on=keys)
+            credits = credits[~credits['id'].isin(pairs['id_to'][~same])] \
+                             .merge(retry, on=keys)
+            accounts = pd.concat([debits[keys + ['account']],
+                                  credits[keys + ['account']]]) \
+                         .groupby(keys)['account'].nunique()
+            retry = accounts[accounts > 1].reset_index()[keys]
+            debits = debits.merge(retry, on=keys)
+            credits = credits.merge(retry, on=keys)
+            offset += 1
+            if not len(debits) or not len(credits) or \
+                    offset >= credits.groupby(keys).size().max():
+                break
+        return pd.concat(matched)
+
+    def update(self, full=False):
+        ''' Match the transactions added since the last update (or all
+            unlinked transactions if 'full'), and store any new links.
+
+        Returns the new links.
+
+        self.update(*bool) -> pd.DataFrame
+
+        '''
+        if self._collection is None:
+            self._collection = self._store.collection(self.COLLECTION)
+        with lock_item(self._collection, self.LINKS):
+            links, metadata = self._stored()
+            processed = metadata.get(self.PROCESSED, dict())
+            if metadata.get(self.WINDOW, self.window) != self.window:
+                links, processed = links.iloc[:0], dict() # rematch all
+            accounts = self._accounts()
+            start = None
+            if not full and all(name in processed for name, _, _ in
+                                accounts):
+                start = pd.Timestamp(min(processed.values())) + \
+                        pd.Timedelta(days=1 - self.window)
+
+            rows = []
+            for name, store, account in accounts:
+                data = Account(store, account, save=False, lazy=True) \
+                       .query(start=start)
+                keys = _keys(data.assign(account=name), 'account')
+                if len(keys):
+                    processed[name] = str(keys['date'].max().date())
+                rows.append(keys)
+            if not rows:
+                return links.iloc[:0] # no accounts to match
+            rows = pd.concat(rows, ignore_index=True)
+            # already linked transactions can't be linked again
+            rows = rows.merge(self._linked(links), how='left', indicator=True,
+                              on=['account', 'date', 'cents', 'occurrence'])
+            rows = rows[rows.pop('_merge') == 'left_only'] \
+                       .reset_index(drop=True)
+
+            new = self.match(rows)
+            if len(new):
+                links = pd.concat([links, new]).sort_index(kind='stable') \
+                        if len(links) else new
+            write_item(self._collection, self.LINKS, links,
+                       {self.PROCESSED: processed, self.WINDOW: self.window})
+        return new
+
+    def exclude(self, data, account=None):
+        ''' Returns the transactions of 'data' that aren't linked transfers.
+
+        'data' is the transactions of 'account', or has an account column of
+            the account names (e.g. from queries.query_store). It should
+            include all transactions of each day and amount it covers, so
+            transactions are identified as when they were matched.
+
+        self.exclude(pd.DataFrame, *str) -> pd.DataFrame
+
+        '''
+        if account is not None:
+            keys = _keys(data.assign(account=account), 'account')
+        else:
+            keys = _keys(data, 'account')
+        linked = keys.merge(self._linked(self.get_links()), how='left',
+                            indicator=True,
+                            on=['account', 'date', 'cents', 'occurrence'])
+        return data[(linked['_merge'] == 'left_only').values]